@@ -0,0 +1,109 @@
+"""
+bench_coordination.py
+
+Several workers on one machine sharing stations through an SQLite lease database,
+each in its own process as on separate hosts. Reports how long the workers take to
+split the stations evenly at start, after one of them is killed without releasing
+its leases and after a new one joins, and how often a worker believed it held a
+station whose lease belonged to another worker (should be 0).
+
+    python benchmarks/bench_coordination.py --workers 3 --stations 10 --ttl 3
+"""
+
+
+import argparse
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+
+from hydrophone_streamer.coordination import Coordinator, SQLiteLeaseBackend
+
+
+def worker(db: str, stations: list, worker_id: str, ttl: float, reports, violations) -> None:
+    """
+    Hold leases until killed, publishing the stations held every 50 ms and checking
+    them against the database.
+    """
+    backend = SQLiteLeaseBackend(db)
+    coordinator = Coordinator(backend, stations, worker_id=worker_id, ttl=ttl).start()
+    while True:
+        leases = backend.leases()
+        owned = sorted(coordinator.owned) # read after the leases, see Coordinator.step for the order of updates
+        for station in owned:
+            if station in leases and leases[station].owner != worker_id:
+                violations.append((worker_id, station, time.time()))
+        reports[worker_id] = owned
+        time.sleep(0.05)
+
+
+def balanced(reports: dict, stations: list, workers: list) -> bool:
+    held = [station for worker_id in workers for station in reports.get(worker_id, [])]
+    counts = [len(reports.get(worker_id, [])) for worker_id in workers]
+    return sorted(held) == sorted(stations) and max(counts) - min(counts) <= 1
+
+
+def wait_balanced(reports, stations: list, workers: list, timeout: float) -> float:
+    """
+    Seconds until the live workers hold every station evenly, None on timeout.
+    """
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        snapshot = {worker_id: reports.get(worker_id, []) for worker_id in workers}
+        if balanced(snapshot, stations, workers):
+            return time.perf_counter() - start
+        time.sleep(0.05)
+    return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--stations', type=int, default=10)
+    parser.add_argument('--ttl', type=float, default=3, help='seconds a lease lasts without a heartbeat')
+    parser.add_argument('--output', default=None, help='optional path to write the JSON results to')
+    args = parser.parse_args()
+
+    stations = [f'station_{i:02d}' for i in range(args.stations)]
+    db = os.path.join(tempfile.mkdtemp(prefix='bench_coordination_'), 'leases.sqlite')
+    SQLiteLeaseBackend(db).close() # create the tables before the workers race for them
+
+    context = multiprocessing.get_context('spawn')
+    manager = context.Manager()
+    reports = manager.dict()
+    violations = manager.list()
+    processes = {}
+
+    def spawn(worker_id: str) -> None:
+        processes[worker_id] = context.Process(target=worker, args=(db, stations, worker_id, args.ttl, reports, violations), daemon=True)
+        processes[worker_id].start()
+
+    timeout = 10 * args.ttl
+    try:
+        for i in range(args.workers):
+            spawn(f'worker_{i}')
+        results = {'start_s': wait_balanced(reports, stations, list(processes), timeout)}
+
+        victim = sorted(processes)[0]
+        processes.pop(victim).kill() # no release, its leases have to expire
+        reports.pop(victim, None)
+        results['after_kill_s'] = wait_balanced(reports, stations, list(processes), timeout)
+
+        spawn(f'worker_{args.workers}')
+        results['after_join_s'] = wait_balanced(reports, stations, list(processes), timeout)
+        results['lease_violations'] = len(violations)
+        results['held'] = dict(reports)
+    finally:
+        for process in processes.values():
+            process.kill()
+        manager.shutdown()
+
+    print(json.dumps(results, indent=2))
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""
+bench_sinks.py
+
+Upload throughput of the S3 output sink and its behaviour during a storage outage.
+Runs against moto's in-process S3 stand-in (pip install moto), or a real store
+such as MinIO with --endpoint-url (credentials from the usual boto3 sources).
+
+The outage test points a sink at an unreachable endpoint with a spool directory:
+put_file must keep returning quickly while files are spooled, and a sink on a
+working endpoint must then drain the spool into the bucket.
+
+    python benchmarks/bench_sinks.py --files 20 --size-mb 30
+    python benchmarks/bench_sinks.py --endpoint-url http://localhost:9000 --bucket bench
+"""
+
+
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from hydrophone_streamer.sinks import S3Sink
+
+
+def make_files(directory: str, n_files: int, size: int) -> list:
+    """
+    Incompressible stand-ins for FLAC segments.
+    """
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(n_files):
+        path = os.path.join(directory, f'segment_{i:03d}.flac')
+        with open(path, 'wb') as f:
+            f.write(rng.integers(0, 256, size=size, dtype=np.uint8).tobytes())
+        paths.append(path)
+    return paths
+
+
+def object_keys(client, bucket: str, prefix: str) -> set:
+    keys = set()
+    for page in client.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix):
+        keys.update(entry['Key'] for entry in page.get('Contents', []))
+    return keys
+
+
+def bench_upload(client, bucket: str, paths: list, **options) -> dict:
+    """
+    Hand every file to a sink, then wait for the uploads.
+    """
+    station = f'upload_{options.get("workers", 4)}_{options.get("max_concurrency", 4)}'
+    sink = S3Sink(bucket, station, client=client, **options)
+    start = time.perf_counter()
+    for path in paths:
+        sink.put_file(path)
+    sink.put_text('latest.txt', os.path.basename(paths[-1]), after=os.path.basename(paths[-1]))
+    handed_over = time.perf_counter() - start
+    sink.close()
+    wall = time.perf_counter() - start
+
+    n_bytes = sum(os.path.getsize(path) for path in paths)
+    return {'handed_over_s': handed_over,
+            'wall_s': wall,
+            'mb_per_s': n_bytes / 1e6 / wall,
+            'objects': len(object_keys(client, bucket, station + '/'))}
+
+
+def bench_outage(client, bucket: str, paths: list) -> dict:
+    """
+    Spool during an outage, then drain the spool once the store is back.
+    """
+    import boto3
+    from botocore.config import Config
+
+    spool_dir = tempfile.mkdtemp(prefix='bench_sinks_spool_')
+    try:
+        unreachable = boto3.client('s3', endpoint_url='http://127.0.0.1:9', region_name='us-east-1',
+                                   config=Config(retries={'max_attempts': 1}, connect_timeout=1))
+        sink = S3Sink(bucket, 'outage', client=unreachable, retries=1, retry_delay=0.05,
+                      spool_dir=spool_dir, spool_interval=0.5)
+        start = time.perf_counter()
+        for path in paths:
+            sink.put_file(path)
+            sink.put_text('latest.txt', os.path.basename(path), after=os.path.basename(path))
+        handed_over = time.perf_counter() - start
+        sink.flush()
+        sink.close()
+        spooled = len(os.listdir(spool_dir))
+
+        # the store is back
+        sink = S3Sink(bucket, 'outage', client=client, spool_dir=spool_dir, spool_interval=0.5)
+        start = time.perf_counter()
+        while len(os.listdir(spool_dir)) > 0 and time.perf_counter() - start < 120:
+            time.sleep(0.1)
+        drained = time.perf_counter() - start
+        sink.close()
+
+        latest = client.get_object(Bucket=bucket, Key='outage/latest.txt')['Body'].read().decode()
+        return {'handed_over_s': handed_over,
+                'spooled_files': spooled,
+                'drain_s': drained,
+                'objects': len(object_keys(client, bucket, 'outage/')),
+                'latest_points_at_last': latest == os.path.basename(paths[-1])}
+    finally:
+        shutil.rmtree(spool_dir)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=20)
+    parser.add_argument('--size-mb', type=float, default=30, help='size of each file, a 5 minute 64 kHz FLAC is about 30 MB')
+    parser.add_argument('--endpoint-url', default=None, help='S3 compatible store to use instead of moto')
+    parser.add_argument('--bucket', default='hydrophone-bench')
+    parser.add_argument('--output', default=None, help='optional path to write the JSON results to')
+    args = parser.parse_args()
+
+    import boto3
+
+    if args.endpoint_url is None:
+        from moto import mock_aws
+        context = mock_aws()
+    else:
+        context = contextlib.nullcontext()
+
+    work_dir = tempfile.mkdtemp(prefix='bench_sinks_')
+    try:
+        with context:
+            client = boto3.client('s3', endpoint_url=args.endpoint_url, region_name='us-east-1')
+            with contextlib.suppress(client.exceptions.BucketAlreadyOwnedByYou):
+                client.create_bucket(Bucket=args.bucket)
+            paths = make_files(work_dir, args.files, int(args.size_mb * 1e6))
+
+            results = {'serial': bench_upload(client, args.bucket, paths, workers=1, max_concurrency=1),
+                       'concurrent': bench_upload(client, args.bucket, paths, workers=4, max_concurrency=4),
+                       'outage': bench_outage(client, args.bucket, paths[:5])}
+    finally:
+        shutil.rmtree(work_dir)
+
+    print(json.dumps(results, indent=2))
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
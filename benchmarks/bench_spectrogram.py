@@ -0,0 +1,91 @@
+"""
+bench_spectrogram.py
+
+Time the ingest-time spectrogram pyramid: computing the spectra of synthetic
+segments with the batched STFT against a frame by frame loop, and rendering the
+stored day at every level against decoding the audio of that day again.
+
+    python benchmarks/bench_spectrogram.py --segments 12 --sample-rate 64000 --seconds 300
+"""
+
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from hydrophone_streamer.ring_buffer import pcm_to_float
+from hydrophone_streamer.spectrogram import SpectrogramPyramid, SpectrogramReader, stft_power
+
+
+def frame_loop_power(samples: np.ndarray, sample_rate: float, nfft: int) -> np.ndarray:
+    """
+    Reference: one FFT per frame, the way spectrograms were computed from the FLAC files.
+    """
+    samples = pcm_to_float(samples)
+    window = np.hanning(nfft)
+    scale = 2 / (sample_rate * np.sum(window ** 2))
+    rows = []
+    for start in range(0, len(samples) - nfft + 1, nfft):
+        frame = samples[start:start + nfft]
+        spectrum = np.fft.rfft((frame - frame.mean()) * window)
+        rows.append(np.abs(spectrum) ** 2 * scale)
+    return np.array(rows)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--segments', type=int, default=12)
+    parser.add_argument('--sample-rate', type=int, default=64000)
+    parser.add_argument('--seconds', type=int, default=300)
+    parser.add_argument('--nfft', type=int, default=1024)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    segment = np.cumsum(rng.integers(-2000, 2000, size=args.sample_rate * args.seconds)).astype(np.int32)
+    audio_seconds = args.segments * args.seconds
+
+    start = time.perf_counter()
+    frame_loop_power(segment, args.sample_rate, args.nfft)
+    loop_s = (time.perf_counter() - start) * args.segments
+
+    start = time.perf_counter()
+    stft_power(segment, args.sample_rate, args.nfft, args.nfft)
+    batched_s = (time.perf_counter() - start) * args.segments
+
+    save_dir = tempfile.mkdtemp(prefix='bench_spectrogram_')
+    try:
+        pyramid = SpectrogramPyramid(save_dir, nfft=args.nfft)
+        day_start = datetime(2025, 5, 24, tzinfo=timezone.utc)
+        start = time.perf_counter()
+        for i in range(args.segments):
+            pyramid.write(segment, args.sample_rate, day_start + timedelta(seconds=i * args.seconds))
+        ingest_s = time.perf_counter() - start
+
+        reader = SpectrogramReader(save_dir)
+        render_s = {}
+        for level in reader.levels:
+            start = time.perf_counter()
+            reader.read(day_start, day_start + timedelta(days=1), level=level)
+            render_s[f'{level}s'] = time.perf_counter() - start
+
+        results = {'parameters': vars(args),
+                   'stft_s': {'frame_loop': loop_s, 'batched': batched_s},
+                   'ingest_s': ingest_s,
+                   'ingest_x_realtime': audio_seconds / ingest_s,
+                   'render_day_s': render_s,
+                   'pyramid_bytes_on_disk': sum(os.stat(os.path.join(root, name)).st_blocks * 512
+                                                for root, _, names in os.walk(save_dir) for name in names)}
+    finally:
+        shutil.rmtree(save_dir)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
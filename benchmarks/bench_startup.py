@@ -0,0 +1,64 @@
+"""
+bench_startup.py
+
+Startup time of the command line entry point and of every registered network, each
+measured in a fresh interpreter, i.e. what a Docker start or a systemd restart pays
+before the first poll. With --budget the script exits non-zero when importing the CLI
+takes longer, so it can guard a CI job against startup regressions.
+
+    python benchmarks/bench_startup.py --budget 0.5 --output startup.json
+"""
+
+
+import argparse
+import json
+import subprocess
+import sys
+
+from bench_streamers import import_time
+
+
+def heaviest_imports(statement: str, n: int = 10) -> list:
+    """
+    The `n` modules with the largest cumulative import time (-X importtime) for a statement.
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement],
+                            check=True, capture_output=True, text=True)
+    timings = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line[len('import time:'):].split('|')
+        timings.append((int(cumulative) / 1e6, module.strip()))
+    return [{'module': module, 'cumulative_s': seconds} for seconds, module in sorted(timings, reverse=True)[:n]]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeats', type=int, default=5, help='best of this many fresh interpreters')
+    parser.add_argument('--budget', type=float, default=None, help='fail if importing the CLI takes longer, in seconds')
+    parser.add_argument('--output', default=None, help='optional path to write the JSON results to')
+    args = parser.parse_args()
+
+    from hydrophone_streamer.registry import available_networks
+
+    results = {'python_s': import_time('sys', args.repeats),
+               'cli_s': import_time('hydrophone_streamer.cli', args.repeats),
+               'cli_heaviest': heaviest_imports('import hydrophone_streamer.cli'),
+               'networks': {}}
+    for network in available_networks():
+        statement = f"from hydrophone_streamer.registry import get_network_class; get_network_class('{network}')"
+        results['networks'][network] = {'import_s': import_time(f"hydrophone_streamer.registry; {statement}", args.repeats),
+                                        'heaviest': heaviest_imports(statement)}
+
+    print(json.dumps(results, indent=2))
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.budget is not None and results['cli_s'] > args.budget:
+        sys.exit(f"importing the CLI took {results['cli_s']:.3f} s, over the budget of {args.budget:.3f} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+"""
+bench_streamers.py
+
+Run OOIStreamingClass, ONCStreamingClass and OrcasoundStreamingClass end to end
+against the local stand-ins in standins.py and report, per network:
+    - startup time (importing the package in a fresh interpreter, and constructing the class)
+    - per-poll latency, for the catch-up poll and for the steady-state polls
+    - segments per second and bytes per second over all polls
+    - peak RSS of the process and of its transcoding workers
+    - for Orcasound, the seconds from a segment appearing in the playlist to the FLAC holding it
+
+    python benchmarks/bench_streamers.py --catch-up 12 --polls 5 --per-poll 2 --output results.json
+
+Compare the JSON of two releases to catch regressions.
+"""
+
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from standins import FakeONC, HLSServer, OOIServer
+
+
+def _vm_hwm(pid) -> int:
+    """
+    Peak resident set size of a process in bytes, from /proc.
+    """
+    with open(f'/proc/{pid}/status', 'r') as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def peak_rss() -> dict:
+    """
+    Peak RSS of this process and the sum over its live worker processes.
+    """
+    if os.path.exists('/proc/self/status'):
+        workers = 0
+        for child in multiprocessing.active_children():
+            try:
+                workers += _vm_hwm(child.pid)
+            except FileNotFoundError:
+                pass
+        return {'main_bytes': _vm_hwm('self'), 'workers_bytes': workers}
+    # ru_maxrss is in bytes on macOS, kilobytes elsewhere
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return {'main_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale, 'workers_bytes': None}
+
+
+def import_time(module: str, repeats: int = 3) -> float:
+    """
+    Best wall time of importing `module` in a fresh interpreter.
+    """
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', f'import {module}'], check=True)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def summarise(latencies: list, segments: list, n_bytes: int, construct_time: float) -> dict:
+    """
+    Aggregate the per-poll measurements of one network.
+    """
+    total = sum(latencies)
+    steady = latencies[1:]
+    return {'construct_s': construct_time,
+            'catch_up_poll_s': latencies[0],
+            'catch_up_segments': segments[0],
+            'steady_poll_s_median': float(np.median(steady)) if len(steady) > 0 else None,
+            'steady_poll_s_max': float(np.max(steady)) if len(steady) > 0 else None,
+            'segments': int(sum(segments)),
+            'segments_per_s': sum(segments) / total if total > 0 else None,
+            'bytes': n_bytes,
+            'bytes_per_s': n_bytes / total if total > 0 else None,
+            'poll_s': latencies,
+            'peak_rss': peak_rss()}
+
+
+def poll_loop(instance, release, n_catch_up: int, n_polls: int, per_poll: int, on_poll=None) -> tuple:
+    """
+    Release the catch-up batch, then `per_poll` new segments before every further poll,
+    timing each poll the way stream_data runs it. `on_poll(fetched_results)` is called after each poll.
+    """
+    latencies = []
+    segments = []
+    for i in range(n_polls + 1):
+        release(n_catch_up if i == 0 else per_poll)
+        start = time.perf_counter()
+        fetched_results = instance.poll()
+        instance.next_poll_delay(len(fetched_results))
+        latencies.append(time.perf_counter() - start)
+        segments.append(len(fetched_results))
+        if on_poll is not None:
+            on_poll(fetched_results)
+    return latencies, segments
+
+
+def bench_ooi(args, save_dir: str) -> dict:
+    from hydrophone_streamer.supported_classes.ooi_streaming_class import OOIStreamingClass
+
+    with OOIServer(n_segments=args.catch_up + args.polls * args.per_poll,
+                   sample_rate=args.sample_rate, seconds=args.seconds, latency=args.latency) as server:
+
+        class LocalOOIStreamingClass(OOIStreamingClass):
+            url_prefixes = (server.url,)
+
+        start = time.perf_counter()
+        instance = LocalOOIStreamingClass({'url': server.url}, save_dir=save_dir, max_workers=args.max_workers,
+                                          streaming_decode=args.streaming_decode)
+        construct_time = time.perf_counter() - start
+
+        latencies, segments = poll_loop(instance, server.release, args.catch_up, args.polls, args.per_poll)
+        return summarise(latencies, segments, server.published.bytes_sent, construct_time)
+
+
+def bench_onc(args, save_dir: str) -> dict:
+    os.environ.setdefault('ONC_TOKEN', 'benchmark')
+    from hydrophone_streamer.supported_classes.onc_streaming_class import ONCStreamingClass
+
+    # skip the citation lookup against the live deployments API
+    with open(os.path.join(save_dir, 'reference.bib'), 'w') as f:
+        f.write('@misc{benchmark,}')
+
+    fake = FakeONC(save_dir, n_segments=args.catch_up + args.polls * args.per_poll,
+                   sample_rate=args.sample_rate, seconds=args.seconds, latency=args.latency,
+                   data_products=args.onc_data_products)
+
+    start = time.perf_counter()
+    instance = ONCStreamingClass({'deviceCode': fake.device_code}, save_dir=save_dir, max_workers=args.max_workers)
+    construct_time = time.perf_counter() - start
+    instance.onc = fake
+
+    latencies, segments = poll_loop(instance, fake.release, args.catch_up, args.polls, args.per_poll)
+    return summarise(latencies, segments, fake.published.bytes_sent, construct_time)
+
+
+def bench_orcasound(args, save_dir: str) -> dict:
+    from hydrophone_streamer.supported_classes.orcasound_streaming_class import OrcasoundStreamingClass
+
+    with HLSServer(n_segments=args.catch_up + args.polls * args.per_poll,
+                   segment_seconds=args.hls_segment_seconds, latency=args.latency) as server:
+        start = time.perf_counter()
+        instance = OrcasoundStreamingClass({'node': server.node, 'url': server.url}, save_dir=save_dir, max_workers=args.max_workers)
+        construct_time = time.perf_counter() - start
+
+        # a FLAC is complete once the last segment of its minute is out, measure from there
+        batch_of = [int(start_time.timestamp() // instance.batch_seconds) for start_time, _, _, _ in server.published.segments]
+        delivery = []
+
+        def on_poll(fetched_results: list) -> None:
+            now = time.time()
+            for path in fetched_results:
+                batch = int(instance._file_time(path).timestamp() // instance.batch_seconds)
+                last = max(i for i, b in enumerate(batch_of) if b == batch)
+                delivery.append(now - server.published.release_times[last])
+
+        latencies, segments = poll_loop(instance, server.release, args.catch_up, args.polls, args.per_poll, on_poll)
+        results = summarise(latencies, segments, server.published.bytes_sent, construct_time)
+        results['playlist_to_flac_s_median'] = float(np.median(delivery)) if len(delivery) > 0 else None
+        results['playlist_to_flac_s_max'] = float(np.max(delivery)) if len(delivery) > 0 else None
+        return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--networks', nargs='+', default=['ooi', 'onc'], choices=['ooi', 'onc', 'orcasound'],
+                        help='orcasound needs ffmpeg')
+    parser.add_argument('--catch-up', type=int, default=12, help='segments available on the first poll')
+    parser.add_argument('--polls', type=int, default=5, help='steady-state polls after the catch-up')
+    parser.add_argument('--per-poll', type=int, default=1, help='segments published before each steady-state poll')
+    parser.add_argument('--sample-rate', type=int, default=64000)
+    parser.add_argument('--seconds', type=float, default=15, help='length of each synthetic segment')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every server response')
+    parser.add_argument('--max-workers', type=int, default=4)
+    parser.add_argument('--streaming-decode', action='store_true', help='transcode the OOI miniSEED while it downloads')
+    parser.add_argument('--hls-segment-seconds', type=float, default=10, help='length of the Orcasound HLS segments')
+    parser.add_argument('--onc-data-products', action='store_true',
+                        help='serve ONC files only as data products, to time the order fallback')
+    parser.add_argument('--output', default=None, help='optional path to write the JSON results to')
+    args = parser.parse_args()
+
+    results = {'environment': {'python': platform.python_version(),
+                               'platform': platform.platform(),
+                               'cpu_count': os.cpu_count()},
+               'parameters': vars(args),
+               'startup': {'import_package_s': import_time('hydrophone_streamer.streamer')}}
+
+    benches = {'ooi': bench_ooi, 'onc': bench_onc, 'orcasound': bench_orcasound}
+    for network in args.networks:
+        save_dir = tempfile.mkdtemp(prefix=f'bench_{network}_')
+        try:
+            results[network] = benches[network](args, save_dir)
+        finally:
+            shutil.rmtree(save_dir)
+
+    print(json.dumps(results, indent=2))
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
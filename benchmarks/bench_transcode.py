@@ -0,0 +1,169 @@
+"""
+bench_transcode.py
+
+Compare the legacy mseed -> WAV -> ffmpeg -> FLAC path against the in-process
+transcoder, reading the file whole or streaming it record by record. Reports
+per-segment wall time, peak disk usage of the working directory and how much the
+peak RSS of a fresh process grows during the transcode for each path.
+
+    python benchmarks/bench_transcode.py --segments 3 --sample-rate 64000 --seconds 300
+"""
+
+
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+import obspy
+
+from hydrophone_streamer.transcode import mseed_to_flac
+
+
+class DiskSampler(threading.Thread):
+    """
+    Poll the size of a directory in the background and remember the peak.
+    """
+    def __init__(self, path: str, interval: float = 0.002) -> None:
+        super().__init__(daemon=True)
+        self.path = path
+        self.interval = interval
+        self.peak = 0
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        while not self._stop_event.is_set():
+            total = 0
+            for entry in os.scandir(self.path):
+                try:
+                    total += entry.stat().st_size
+                except FileNotFoundError:
+                    pass
+            self.peak = max(self.peak, total)
+            time.sleep(self.interval)
+
+    def stop(self) -> int:
+        self._stop_event.set()
+        self.join()
+        return self.peak
+
+
+def make_segment(path: str, sample_rate: int, seconds: int, seed: int) -> None:
+    """
+    Write a synthetic hydrophone segment (int32 random walk) as miniSEED.
+    """
+    rng = np.random.default_rng(seed)
+    data = np.cumsum(rng.integers(-2000, 2000, size=sample_rate * seconds)).astype(np.int32)
+    trace = obspy.Trace(data=data, header={'network': 'OO', 'station': 'HYEA2', 'channel': 'YDH',
+                                           'sampling_rate': sample_rate,
+                                           'starttime': obspy.UTCDateTime(2025, 5, 24, 23, 55)})
+    obspy.Stream([trace]).write(path, format='MSEED')
+
+
+def legacy_mseed2flac(filename: str) -> None:
+    """
+    The original OOI transcoding path: obspy WAV on disk, ffmpeg, then rm.
+    """
+    st = obspy.read(filename, format='mseed')
+    st.merge(fill_value=0)
+    sample_rate = st[0].stats['sampling_rate']
+    st.write(filename.replace('mseed','wav'), format='WAV', framerate=sample_rate)
+    os.system('ffmpeg -loglevel error -n -i '+filename.replace('mseed','wav')+' -c:a flac '+filename.replace('mseed','flac')+"&& rm "+filename.replace('mseed','wav'))
+    os.system('rm '+filename)
+
+
+def _memory_status(field: str) -> int:
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) * 1024
+    raise KeyError(field)
+
+
+def _rss_growth(method, filename: str) -> int:
+    """
+    Run `method` and return how far it raised the RSS of this process above where it started, in bytes.
+    """
+    import obspy, soundfile # so the growth does not count the imports
+    before = _memory_status('VmRSS')
+    # reset the high-water mark (Linux), ru_maxrss survives fork and exec so it would report the parent's peak
+    with open('/proc/self/clear_refs', 'w') as f:
+        f.write('5')
+    method(filename)
+    return _memory_status('VmHWM') - before
+
+
+def peak_rss_growth(method, filename: str) -> int:
+    """
+    Peak RSS growth of `method` on a copy of `filename`, measured in a fresh process.
+    """
+    copy = filename + '.copy.mseed'
+    shutil.copy(filename, copy)
+    try:
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+            return pool.submit(_rss_growth, method, copy).result()
+    finally:
+        for path in (copy, copy.replace('mseed', 'flac')):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def run(method, n_segments: int, sample_rate: int, seconds: int) -> dict:
+    """
+    Time `method` over freshly generated segments in a scratch directory.
+    """
+    times = []
+    peaks = []
+    rss = []
+    for i in range(n_segments):
+        work_dir = tempfile.mkdtemp(prefix='bench_transcode_')
+        try:
+            filename = os.path.join(work_dir, f'segment_{i}.mseed')
+            make_segment(filename, sample_rate, seconds, seed=i)
+            rss.append(peak_rss_growth(method, filename))
+
+            sampler = DiskSampler(work_dir)
+            sampler.start()
+            start = time.perf_counter()
+            method(filename)
+            times.append(time.perf_counter() - start)
+            peaks.append(sampler.stop())
+        finally:
+            shutil.rmtree(work_dir)
+
+    return {'wall_time_s_mean': float(np.mean(times)),
+            'wall_time_s_min': float(np.min(times)),
+            'peak_disk_bytes_max': int(np.max(peaks)),
+            'peak_rss_growth_bytes_max': int(np.max(rss))}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--segments', type=int, default=3)
+    parser.add_argument('--sample-rate', type=int, default=64000)
+    parser.add_argument('--seconds', type=int, default=300)
+    parser.add_argument('--output', default=None, help='optional path to write the JSON results to')
+    args = parser.parse_args()
+
+    results = {'in_process': run(mseed_to_flac, args.segments, args.sample_rate, args.seconds),
+               'in_process_streaming': run(partial(mseed_to_flac, streaming=True), args.segments, args.sample_rate, args.seconds)}
+    if shutil.which('ffmpeg') is not None:
+        results['legacy_ffmpeg'] = run(legacy_mseed2flac, args.segments, args.sample_rate, args.seconds)
+    else:
+        print('ffmpeg not found, skipping the legacy path')
+
+    print(json.dumps(results, indent=2))
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,461 @@
+"""
+standins.py
+
+Local stand-ins for the remote services the streamers talk to, so benchmarks run
+offline and repeatably.
+
+OOIServer serves synthetic day listings and miniSEED segments over HTTP the way
+rawdata.oceanobservatories.org does (HEAD, Range, ETag / Last-Modified and 304s).
+HLSServer serves an Orcasound node's latest.txt, growing HLS playlist and AAC
+segments. FakeONC answers the calls ONCStreamingClass makes on its `onc.ONC` client
+(getListByDevice, getFile and getDirectFiles, or the data product delivery calls
+for devices that only offer data products).
+
+Segments are generated up front and "published" in batches by the benchmark with
+`release(n)`, so each poll sees a known number of new segments.
+"""
+
+
+import email.utils
+import hashlib
+import io
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import obspy
+import soundfile as sf
+
+
+OOI_PATH = '/files/CE02SHBP/LJ01D/HYDBBA106/'
+
+
+def synthetic_samples(sample_rate: int, seconds: float, seed: int) -> np.ndarray:
+    """
+    An int32 random walk, compresses about as well as real hydrophone data.
+    """
+    rng = np.random.default_rng(seed)
+    return np.cumsum(rng.integers(-2000, 2000, size=int(sample_rate * seconds))).astype(np.int32)
+
+
+def segment_times(n_segments: int, cadence: float, newest: datetime = None) -> list:
+    """
+    Start times of `n_segments` segments `cadence` seconds apart, the last one at `newest`.
+    """
+    if newest is None:
+        newest = datetime.now(timezone.utc) - timedelta(minutes=1)
+    newest = newest.replace(microsecond=0)
+    return [newest - timedelta(seconds=cadence * (n_segments - 1 - i)) for i in range(n_segments)]
+
+
+class _Published:
+    """
+    Thread safe view of the segments released so far.
+    """
+    def __init__(self, segments: list) -> None:
+        self.segments = segments # (start time, name, body), sorted by time
+        self.n_released = 0
+        self.released_at = time.time()
+        self.release_times = [] # wall time every released segment became visible
+        self.bytes_sent = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def release(self, n: int) -> int:
+        """
+        Publish the next n segments, returns how many were actually released.
+        """
+        with self._lock:
+            n = min(n, len(self.segments) - self.n_released)
+            self.n_released += n
+            self.released_at = time.time()
+            self.release_times += [self.released_at] * n
+            return n
+
+    def visible(self) -> list:
+        with self._lock:
+            return self.segments[:self.n_released]
+
+    def count(self, n_bytes: int) -> None:
+        with self._lock:
+            self.bytes_sent += n_bytes
+            self.requests += 1
+
+
+class _HTTPStandin:
+    """
+    Threaded HTTP server answering from `_resolve`, with HEAD, Range, ETag / Last-Modified and 304s.
+    """
+    path = '/'
+
+    def __init__(self, published: _Published, latency: float = 0.0, host: str = '127.0.0.1') -> None:
+        self.published = published
+        self.latency = latency
+        self._server = ThreadingHTTPServer((host, 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}{self.path}'
+
+    def release(self, n: int) -> int:
+        return self.published.release(n)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _resolve(self, path: str) -> tuple:
+        """
+        Return (status, body, last modified) for a request path.
+        """
+        raise NotImplementedError
+
+    def _handler(self):
+        standin = self
+        published = self.published
+        latency = self.latency
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1' # keep-alive, like the real servers
+
+            def log_message(self, *args) -> None:
+                pass
+
+            def _respond(self, head: bool) -> None:
+                if latency > 0:
+                    time.sleep(latency)
+                status, body, modified = standin._resolve(self.path.split('?')[0])
+                etag = '"' + hashlib.md5(body).hexdigest() + '"'
+                headers = {}
+                if status == 200 and modified is not None:
+                    headers['ETag'] = etag
+                    headers['Last-Modified'] = email.utils.formatdate(modified, usegmt=True)
+                    if self.headers.get('If-None-Match') == etag:
+                        status, body = 304, b''
+
+                byte_range = re.fullmatch(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+                if status == 200 and byte_range is not None and self.headers.get('If-Range', etag) == etag:
+                    first = int(byte_range.group(1))
+                    last = int(byte_range.group(2)) if byte_range.group(2) else len(body) - 1
+                    if first >= len(body):
+                        headers['Content-Range'] = f'bytes */{len(body)}'
+                        status, body = 416, b''
+                    else:
+                        headers['Content-Range'] = f'bytes {first}-{min(last, len(body) - 1)}/{len(body)}'
+                        status, body = 206, body[first:last + 1]
+
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if not head:
+                    self.wfile.write(body)
+                    published.count(len(body))
+
+            def do_GET(self) -> None:
+                self._respond(head=False)
+
+            def do_HEAD(self) -> None:
+                self._respond(head=True)
+
+        return Handler
+
+
+class OOIServer(_HTTPStandin):
+    path = OOI_PATH
+
+    def __init__(self,
+                 n_segments: int = 20,
+                 cadence: float = 60,
+                 sample_rate: int = 64000,
+                 seconds: float = 15,
+                 latency: float = 0.0,
+                 host: str = '127.0.0.1',
+                 ) -> None:
+        """
+        HTTP stand-in for the OOI raw data archive of one hydrophone.
+
+        Args:
+            n_segments (int): Segments generated, released with `release`.
+            cadence (float): Seconds between the start times of two segments.
+            sample_rate (int): Sampling rate of the synthetic audio.
+            seconds (float): Length of each segment. Keep the files above the 1 MB
+                size filter of the OOI class.
+            latency (float): Seconds added to every response, to emulate a WAN link.
+            host (str): Interface to listen on.
+        """
+        segments = []
+        for i, start_time in enumerate(segment_times(n_segments, cadence)):
+            trace = obspy.Trace(data=synthetic_samples(sample_rate, seconds, seed=i),
+                                header={'network': 'OO', 'station': 'HYEA2', 'channel': 'YDH',
+                                        'sampling_rate': sample_rate,
+                                        'starttime': obspy.UTCDateTime(start_time)})
+            buffer = io.BytesIO()
+            obspy.Stream([trace]).write(buffer, format='MSEED')
+            name = f"OO-HYEA2--YDH-{start_time.strftime('%Y-%m-%dT%H:%M:%S')}.000000Z.mseed"
+            segments.append((start_time, name, buffer.getvalue()))
+
+        super().__init__(_Published(segments), latency=latency, host=host)
+
+    def _resolve(self, path: str) -> tuple:
+        if not path.startswith(OOI_PATH):
+            return 404, b'', None
+        rest = path[len(OOI_PATH):]
+        if rest == '':
+            return 200, b'<html><body>hydrophone</body></html>', None
+
+        day = re.fullmatch(r'(\d{4})/(\d{2})/(\d{2})/', rest)
+        if day is not None:
+            prefix = '-'.join(day.groups())
+            names = [name for start_time, name, _ in self.published.visible() if name[14:24] == prefix]
+            if len(names) == 0:
+                return 404, b'', None
+            # like Apache autoindex, names holding a colon get a ./ so they are not read as a url scheme
+            links = ''.join(f'<a href="./{name}">{name}</a>\n' for name in names)
+            return 200, f'<html><body><pre>{links}</pre></body></html>'.encode(), self.published.released_at
+
+        for start_time, name, body in self.published.visible():
+            if rest.endswith('/' + name):
+                return 200, body, start_time.timestamp()
+        return 404, b'', None
+
+
+class HLSServer(_HTTPStandin):
+    def __init__(self,
+                 n_segments: int = 30,
+                 segment_seconds: float = 10,
+                 sample_rate: int = 48000,
+                 latency: float = 0.0,
+                 node: str = 'rpi_standin',
+                 host: str = '127.0.0.1',
+                 ) -> None:
+        """
+        HTTP stand-in for the Orcasound bucket of one node, streaming AAC in MPEG-TS
+        segments. The audio is segmented by ffmpeg's HLS muxer, as on the nodes, so
+        ffmpeg must be installed.
+
+        The stream folder is dated so the last segment ends now, the playlist lists
+        the segments released so far.
+
+        Args:
+            n_segments (int): Segments generated, released with `release`.
+            segment_seconds (float): Target length of each segment.
+            sample_rate (int): Sampling rate of the synthetic audio.
+            latency (float): Seconds added to every response, to emulate a WAN link.
+            node (str): Name of the node, the 'node' of the stream setting.
+            host (str): Interface to listen on.
+        """
+        samples = np.clip(synthetic_samples(sample_rate, n_segments * segment_seconds, seed=0) >> 8, -2 ** 15, 2 ** 15 - 1)
+        work_dir = tempfile.mkdtemp(prefix='hls_standin_')
+        try:
+            subprocess.run(['ffmpeg', '-hide_banner', '-loglevel', 'error', '-f', 's16le', '-ar', str(sample_rate), '-ac', '1',
+                            '-i', 'pipe:0', '-c:a', 'aac', '-f', 'hls', '-hls_time', str(segment_seconds), '-hls_list_size', '0',
+                            '-hls_segment_filename', os.path.join(work_dir, 'live%03d.ts'), os.path.join(work_dir, 'live.m3u8')],
+                           input=samples.astype('<i2').tobytes(), check=True)
+            with open(os.path.join(work_dir, 'live.m3u8'), 'r') as f:
+                playlist = f.read()
+            entries = re.findall(r'#EXTINF:([\d.]+),\s*\n(\S+)', playlist)
+            self.target_duration = int(re.search(r'#EXT-X-TARGETDURATION:(\d+)', playlist).group(1))
+            total = sum(float(duration) for duration, _ in entries)
+            self.folder = str(int(time.time() - total))
+
+            segments = []
+            offset = 0.0
+            for duration, name in entries:
+                with open(os.path.join(work_dir, name), 'rb') as f:
+                    body = f.read()
+                start_time = datetime.fromtimestamp(int(self.folder) + offset, tz=timezone.utc)
+                segments.append((start_time, name, body, float(duration)))
+                offset += float(duration)
+        finally:
+            shutil.rmtree(work_dir)
+
+        self.node = node
+        super().__init__(_Published(segments), latency=latency, host=host)
+
+    def _resolve(self, path: str) -> tuple:
+        prefix = f'/{self.node}/'
+        if path == prefix + 'latest.txt':
+            return 200, f'{self.folder}\n'.encode(), int(self.folder)
+        folder = f'{prefix}hls/{self.folder}/'
+        if not path.startswith(folder):
+            return 404, b'', None
+        rest = path[len(folder):]
+
+        visible = self.published.visible()
+        if rest == 'live.m3u8':
+            if len(visible) == 0:
+                return 404, b'', None
+            lines = ['#EXTM3U', '#EXT-X-VERSION:3', f'#EXT-X-TARGETDURATION:{self.target_duration}', '#EXT-X-MEDIA-SEQUENCE:0']
+            for _, name, _, duration in visible:
+                lines += [f'#EXTINF:{duration:.6f},', name]
+            return 200, ('\n'.join(lines) + '\n').encode(), self.published.released_at
+        for start_time, name, body, _ in visible:
+            if rest == name:
+                return 200, body, start_time.timestamp()
+        return 404, b'', None
+
+
+class FakeONC:
+    def __init__(self,
+                 out_path: str,
+                 device_code: str = 'ICLISTENHF6095',
+                 n_segments: int = 20,
+                 cadence: float = 300,
+                 sample_rate: int = 64000,
+                 seconds: float = 15,
+                 latency: float = 0.0,
+                 data_products: bool = False,
+                 working_options: dict = None,
+                 order_time: float = 0.5,
+                 ) -> None:
+        """
+        Stand-in for the `onc.ONC` client, answering from synthetic archive files.
+
+        Assign it to the `onc` attribute of an ONCStreamingClass.
+
+        Args:
+            out_path (str): Directory files are "downloaded" to, the save_dir of the station.
+            device_code (str): Device the archive belongs to.
+            n_segments (int): Segments generated, released with `release`.
+            cadence (float): Seconds between the start times of two segments.
+            sample_rate (int): Sampling rate of the synthetic audio.
+            seconds (float): Length of each segment.
+            latency (float): Seconds added to every call, to emulate a WAN link.
+            data_products (bool): Serve the files only as data products, the archive listing is empty.
+            working_options (dict): dpo_* options an order must carry to produce files,
+                defaults to {'dpo_hydrophoneChannel': 'All'}.
+            order_time (float): Seconds a data product order takes to generate.
+        """
+        segments = []
+        for i, start_time in enumerate(segment_times(n_segments, cadence)):
+            buffer = io.BytesIO()
+            sf.write(buffer, synthetic_samples(sample_rate, seconds, seed=i) >> 8, sample_rate,
+                     format='FLAC', subtype='PCM_24')
+            name = f"{device_code}_{start_time.strftime('%Y%m%dT%H%M%S')}.000Z.flac"
+            segments.append((start_time, name, buffer.getvalue()))
+
+        self.outPath = out_path
+        self.device_code = device_code
+        self.latency = latency
+        self.published = _Published(segments)
+        self.data_products = data_products
+        self.working_options = working_options if working_options is not None else {'dpo_hydrophoneChannel': 'All'}
+        self.order_time = order_time
+        self.location_code = 'FAKE'
+        self.requests = {} # dpRequestId -> filters
+        self.cancelled = set()
+        self._next_request_id = 1
+        self._lock = threading.Lock()
+
+    def release(self, n: int) -> int:
+        return self.published.release(n)
+
+    def _matching(self, filters: dict) -> list:
+        date_from = datetime.fromisoformat(filters['dateFrom'].replace('Z', '+00:00'))
+        date_to = datetime.fromisoformat(filters['dateTo'].replace('Z', '+00:00'))
+        device = filters.get('deviceCode', self.device_code if filters.get('locationCode') == self.location_code else None)
+        return [(name, body) for start_time, name, body in self.published.visible()
+                if device == self.device_code and date_from <= start_time <= date_to]
+
+    def _call(self) -> None:
+        if self.latency > 0:
+            time.sleep(self.latency)
+        self.published.count(0)
+
+    def getListByDevice(self, filters: dict = None, allPages: bool = False) -> dict:
+        self._call()
+        if self.data_products:
+            return {'files': []}
+        return {'files': [name for name, _ in self._matching(filters)]}
+
+    def getDeployments(self, filters: dict = None) -> list:
+        self._call()
+        return [{'deviceCode': self.device_code, 'locationCode': self.location_code, 'begin': '2020-01-01T00:00:00.000Z', 'end': None}]
+
+    def requestDataProduct(self, filters: dict) -> dict:
+        self._call()
+        with self._lock:
+            request_id = self._next_request_id
+            self._next_request_id += 1
+            self.requests[request_id] = dict(filters)
+        return {'dpRequestId': request_id}
+
+    def runDataProduct(self, dpRequestId: int, waitComplete: bool = True) -> dict:
+        self._call()
+        filters = self.requests[dpRequestId]
+        deadline = time.monotonic() + self.order_time
+        while time.monotonic() < deadline:
+            if dpRequestId in self.cancelled:
+                return {'runIds': [], 'fileCount': 0}
+            time.sleep(0.01)
+        works = all(filters.get(k) == v for k, v in self.working_options.items())
+        n_files = len(self._matching(filters)) if works else 0
+        return {'runIds': [dpRequestId] if n_files > 0 else [], 'fileCount': n_files}
+
+    def cancelDataProduct(self, dpRequestId: int) -> dict:
+        self._call()
+        self.cancelled.add(dpRequestId)
+        return {'status': 'cancelled'}
+
+    def downloadDataProduct(self, runId: int, maxRetries: int = 0, downloadResultsOnly: bool = False,
+                            includeMetadataFile: bool = True, overwrite: bool = False) -> list:
+        self._call()
+        files = []
+        for name, body in self._matching(self.requests[runId]):
+            path = os.path.join(self.outPath, name)
+            if not os.path.exists(path) or overwrite:
+                with open(path, 'wb') as f:
+                    f.write(body)
+                self.published.count(len(body))
+            files.append({'file': name, 'status': 'complete'})
+        return files
+
+    def getFile(self, filename: str = '', overwrite: bool = False) -> dict:
+        self._call()
+        for start_time, name, body in self.published.visible():
+            if name != filename:
+                continue
+            path = os.path.join(self.outPath, name)
+            # like onc's saveAsFile, only an empty or missing file may be written without overwrite
+            if not overwrite and os.path.exists(path) and os.path.getsize(path) != 0:
+                raise FileExistsError(path)
+            with open(path, 'wb') as f:
+                f.write(body)
+            self.published.count(len(body))
+            return {'status': 'completed', 'file': name}
+        raise ValueError(f"{filename} is not in the archive")
+
+    def getDirectFiles(self, filters: dict = None, overwrite: bool = False, allPages: bool = False) -> dict:
+        self._call()
+        downloaded = 0
+        for name, body in self._matching(filters):
+            path = os.path.join(self.outPath, name)
+            if os.path.exists(path) and not overwrite:
+                continue
+            with open(path, 'wb') as f:
+                f.write(body)
+            self.published.count(len(body))
+            downloaded += 1
+        return {'downloadResults': [], 'stats': {'fileCount': downloaded}}
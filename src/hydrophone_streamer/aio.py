@@ -0,0 +1,238 @@
+"""
+aio.py
+
+Non-blocking HTTP plumbing for the asyncio streaming classes, the counterpart of
+sessions.py and downloader.py on top of aiohttp (an optional dependency,
+`pip install hydrophone-streamer[async]`).
+
+One aiohttp.ClientSession is kept per event loop and shared by every station on
+it, requests to any one host are bounded by an asyncio semaphore, files are probed
+with HEAD, listings are fetched conditionally and downloads resume with Range and
+If-Range requests and are renamed into place once verified, as in the synchronous
+downloader. Blocking file writes are small and stay on the loop; anything CPU
+bound belongs in an executor.
+"""
+
+
+import asyncio
+import logging
+import re
+from contextlib import asynccontextmanager
+from typing import Callable, Optional, Tuple
+from urllib.parse import urlsplit
+
+from hydrophone_streamer.downloader import CHUNK_SIZE, IDENTITY, Listing, PartFile, RemoteFile
+from hydrophone_streamer.metrics import LISTING_REQUESTS, RETRIES
+from hydrophone_streamer.sessions import DEFAULT_POOL_SIZE
+
+
+logger = logging.getLogger(__name__)
+
+_sessions = {} # event loop -> aiohttp.ClientSession
+_host_limiters = {} # event loop -> AsyncHostLimiter
+
+
+def _aiohttp():
+    try:
+        import aiohttp
+    except ImportError as e:
+        raise ImportError("The asyncio streaming classes need aiohttp: pip install hydrophone-streamer[async]") from e
+    return aiohttp
+
+
+def get_client_session(pool_size: int = DEFAULT_POOL_SIZE):
+    """
+    Return the keep-alive aiohttp session of the running event loop, creating it on first use.
+
+    Args:
+        pool_size (int): Maximum number of pooled connections per host.
+    """
+    aiohttp = _aiohttp()
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0, limit_per_host=pool_size),
+                                        timeout=aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=60))
+        _sessions[loop] = session
+    return session
+
+
+async def close_client_session() -> None:
+    """
+    Close the session of the running event loop, call before the loop stops.
+    """
+    session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
+
+
+class AsyncHostLimiter:
+    def __init__(self, max_per_host: int = 4) -> None:
+        """
+        Bound the number of in-flight requests to any one host, see sessions.HostLimiter.
+
+        Args:
+            max_per_host (int): Concurrent requests allowed per host.
+        """
+        self.max_per_host = max_per_host
+        self._in_flight = {} # host -> requests holding a slot
+        self._condition = asyncio.Condition()
+
+    def restrict(self, max_per_host: int) -> None:
+        """
+        Lower the limit to `max_per_host` if it is tighter, see sessions.HostLimiter.restrict.
+        """
+        self.max_per_host = min(self.max_per_host, max_per_host)
+
+    @asynccontextmanager
+    async def limit(self, url: str):
+        """
+        Hold a slot for the host of `url` for the duration of the block.
+        """
+        host = urlsplit(url).netloc
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._in_flight.get(host, 0) < self.max_per_host)
+            self._in_flight[host] = self._in_flight.get(host, 0) + 1
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self._in_flight[host] -= 1
+                self._condition.notify_all()
+
+
+def get_host_limiter(max_per_host: int = 4) -> AsyncHostLimiter:
+    """
+    Return the per-host limiter of the running event loop, see sessions.get_host_limiter.
+    """
+    loop = asyncio.get_running_loop()
+    if loop not in _host_limiters:
+        _host_limiters[loop] = AsyncHostLimiter(max_per_host)
+    _host_limiters[loop].restrict(max_per_host)
+    return _host_limiters[loop]
+
+
+async def probe(url: str, session=None) -> RemoteFile:
+    """
+    Fetch the metadata of a remote file without downloading its body, see downloader.probe.
+    """
+    if session is None:
+        session = get_client_session()
+
+    async with session.head(url, headers=IDENTITY, allow_redirects=True) as response:
+        size = response.headers.get('Content-Length')
+        if response.status not in (403, 405, 501) and size is not None:
+            response.raise_for_status()
+            return RemoteFile(url=url, size=int(size), etag=response.headers.get('ETag'),
+                              last_modified=response.headers.get('Last-Modified'))
+
+    # HEAD not supported, ask for the first byte and read the total from Content-Range
+    async with session.get(url, headers={**IDENTITY, 'Range': 'bytes=0-0'}) as response:
+        response.raise_for_status()
+        content_range = re.search(r'/(\d+)$', response.headers.get('Content-Range', ''))
+        if content_range is not None:
+            size = content_range.group(1)
+        elif response.status == 200:
+            # range ignored, the full length is in Content-Length
+            size = response.headers.get('Content-Length')
+        return RemoteFile(url=url, size=int(size) if size is not None else None,
+                          etag=response.headers.get('ETag'), last_modified=response.headers.get('Last-Modified'))
+
+
+class AsyncListingFetcher:
+    def __init__(self, session=None) -> None:
+        """
+        Fetch listings with If-None-Match / If-Modified-Since, see downloader.ListingFetcher.
+
+        Args:
+            session (aiohttp.ClientSession, optional): Session to use, defaults to the loop's shared one.
+        """
+        self.session = session
+        self._cache = {} # url -> (etag, last_modified, text)
+
+    async def fetch(self, url: str) -> Listing:
+        """
+        Fetch a listing, reusing the cached body when the server reports it unchanged.
+        """
+        etag, last_modified, text = self._cache.get(url, (None, None, None))
+        headers = {}
+        if text is not None:
+            if etag is not None:
+                headers['If-None-Match'] = etag
+            if last_modified is not None:
+                headers['If-Modified-Since'] = last_modified
+
+        session = self.session if self.session is not None else get_client_session()
+        host = urlsplit(url).netloc
+        async with session.get(url, headers=headers) as response:
+            if response.status == 304 and text is not None:
+                LISTING_REQUESTS.inc(host=host, outcome='not_modified')
+                return Listing(url=url, status_code=200, text=text, modified=False)
+            if response.status == 200:
+                body = await response.text()
+                LISTING_REQUESTS.inc(host=host, outcome='modified')
+                self._cache[url] = (response.headers.get('ETag'), response.headers.get('Last-Modified'), body)
+                return Listing(url=url, status_code=200, text=body, modified=True)
+            LISTING_REQUESTS.inc(host=host, outcome=str(response.status))
+            return Listing(url=url, status_code=response.status, text=None, modified=True)
+
+    def forget(self, url: str) -> None:
+        """
+        Drop the cached copy of a listing.
+        """
+        self._cache.pop(url, None)
+
+
+async def download_file(url: str,
+                        local_path: str,
+                        session=None,
+                        chunk_size: int = CHUNK_SIZE,
+                        expected_size: Optional[int] = None,
+                        checksum: Optional[Tuple[str, str]] = None,
+                        etag: Optional[str] = None,
+                        retries: int = 5,
+                        retry_delay: float = 1,
+                        on_chunk: Optional[Callable[[bytes], None]] = None,
+                        ) -> int:
+    """
+    Stream a remote file to disk without blocking the event loop, resuming after
+    dropped connections. Takes the arguments of downloader.download_file and behaves
+    the same: `<local_path>.part` is resumed with Range (and If-Range when `etag` is
+    given) and only renamed into place once verified, and on_chunk sees every byte once.
+
+    Returns:
+        int: Size of the file.
+    """
+    aiohttp = _aiohttp()
+    if session is None:
+        session = get_client_session()
+
+    part = PartFile(url, local_path, chunk_size=chunk_size, expected_size=expected_size, etag=etag, on_chunk=on_chunk)
+    n_bytes = part.resume()
+    if n_bytes is not None:
+        # completed by an earlier call
+        return n_bytes
+
+    attempt = 0
+    while True:
+        headers = part.request_headers()
+        try:
+            async with session.get(url, headers=headers) as response:
+                if not part.complete(response.status):
+                    response.raise_for_status()
+                    with part.open(response.status, response.headers) as f:
+                        async for chunk in response.content.iter_chunked(chunk_size):
+                            part.write(f, chunk)
+            part.received()
+            break
+        except aiohttp.ClientResponseError:
+            raise
+        except (aiohttp.ClientError, asyncio.TimeoutError, IOError) as e:
+            if attempt >= retries:
+                raise
+            logger.warning('download of %s interrupted (%r), resuming in %.0fs', url, e, retry_delay * 2 ** attempt)
+            RETRIES.inc(host=urlsplit(url).netloc)
+            await asyncio.sleep(retry_delay * 2 ** attempt)
+            attempt += 1
+
+    return part.publish(checksum)
@@ -0,0 +1,429 @@
+"""
+archive.py
+
+Time-indexed continuous archive.
+
+Next to the per-segment FLAC files, the decoded samples of every segment can be
+appended to a continuous archive in `<save_dir>/archive`. Each UTC day is a
+directory of fixed length chunk files holding raw int32 PCM, and a sample's
+position is derived from its timestamp (offset = (t - midnight) * sample rate),
+so any instant maps to a chunk and an offset in O(1) without reading anything.
+Chunk files are sparse: time that was never written costs no disk and reads
+back as zeros.
+
+What was actually written is tracked in `archive.sqlite`: merged coverage
+intervals per day (their complement is the gap table) and every overlap between
+segments, so gaps are explicit instead of silently zero-filled. Gaps inside a
+segment, which the decoder fills with zeros, are not written either. Retention
+deletes whole chunks from before the oldest segment kept, see ContinuousArchive.prune.
+
+    from hydrophone_streamer.archive import ArchiveReader
+
+    reader = ArchiveReader('/data')
+    piece = reader.read('ooi_stream', '2025-05-24T03:14:07', '2025-05-24T03:16:30')
+    piece.samples, piece.sample_rate, piece.gaps
+"""
+
+
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, timedelta, timezone
+from typing import List, NamedTuple, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+
+ARCHIVE_DIRNAME = 'archive'
+INDEX_FILENAME = 'archive.sqlite'
+SAMPLE_DTYPE = np.dtype('<i4')
+FULL_SCALE = 2 ** 31 # int32 full scale, as pcm_to_float in ring_buffer.py
+DAY_SECONDS = 86400
+
+
+class ArchiveSlice(NamedTuple):
+    samples: np.ndarray # float32, full scale = 1.0, zeros where nothing was recorded
+    sample_rate: float
+    start_time: datetime
+    gaps: List[Tuple[datetime, datetime]] # spans inside the slice with no data
+
+
+def _utc(time: Union[str, datetime]) -> datetime:
+    if not isinstance(time, datetime):
+        time = datetime.fromisoformat(str(time).replace('Z', '+00:00'))
+    if time.tzinfo is None:
+        time = time.replace(tzinfo=timezone.utc)
+    return time
+
+
+def _midnight(day: date) -> float:
+    return datetime.combine(day, datetime.min.time(), tzinfo=timezone.utc).timestamp()
+
+
+def _as_int32(samples: np.ndarray) -> np.ndarray:
+    """
+    int32 PCM is stored as is, int16 is shifted up and float samples (full scale 1.0) are scaled to int32.
+    """
+    samples = np.asarray(samples)
+    if samples.dtype == np.int16:
+        return samples.astype(SAMPLE_DTYPE) << 16
+    if np.issubdtype(samples.dtype, np.integer):
+        return samples.astype(SAMPLE_DTYPE, copy=False)
+    return np.clip(np.round(samples.astype(np.float64) * FULL_SCALE), -FULL_SCALE, FULL_SCALE - 1).astype(SAMPLE_DTYPE)
+
+
+class ContinuousArchive:
+    def __init__(self,
+                 save_dir: str,
+                 chunk_seconds: float = 60,
+                 tolerance: float = 0.01,
+                 cache_chunks: int = 8,
+                 ) -> None:
+        """
+        Continuous archive of one station, usable as a sample sink.
+
+        Args:
+            save_dir (str): Directory of the station, the archive lives in save_dir/archive.
+            chunk_seconds (float): Length of the chunk files of new days.
+            tolerance (float): Seconds of jitter between consecutive segments that is
+                neither reported as a gap nor as an overlap.
+            cache_chunks (int): Decoded chunks kept in memory for repeated reads.
+        """
+        self.path = os.path.join(save_dir, ARCHIVE_DIRNAME)
+        os.makedirs(self.path, exist_ok=True)
+        self.chunk_seconds = chunk_seconds
+        self.tolerance = tolerance
+        self.cache_chunks = cache_chunks
+        self._cache = OrderedDict() # (day, chunk, mtime) -> float32 samples
+        self._days = {} # day -> (sample_rate, chunk_samples)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(self.path, INDEX_FILENAME), check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS days (
+                                day TEXT PRIMARY KEY,
+                                sample_rate REAL NOT NULL,
+                                chunk_samples INTEGER NOT NULL)""")
+        # merged [start, end) sample offsets within the day that hold data
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS coverage (
+                                day TEXT NOT NULL,
+                                start INTEGER NOT NULL,
+                                end INTEGER NOT NULL)""")
+        self._conn.execute('CREATE INDEX IF NOT EXISTS coverage_day_start ON coverage (day, start)')
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS overlaps (
+                                day TEXT NOT NULL,
+                                start INTEGER NOT NULL,
+                                end INTEGER NOT NULL,
+                                recorded REAL NOT NULL)""")
+
+    def _execute(self, query: str, parameters: tuple = ()) -> list:
+        with self._lock:
+            return self._conn.execute(query, parameters).fetchall()
+
+    def _day_layout(self, day: date, sample_rate: Optional[float] = None) -> Optional[Tuple[float, int]]:
+        """
+        (sample rate, chunk length in samples) of a day, created on the first write.
+        """
+        key = day.isoformat()
+        if key not in self._days:
+            rows = self._execute('SELECT sample_rate, chunk_samples FROM days WHERE day = ?', (key,))
+            if len(rows) > 0:
+                self._days[key] = (rows[0][0], rows[0][1])
+            elif sample_rate is not None:
+                layout = (float(sample_rate), int(round(self.chunk_seconds * sample_rate)))
+                self._execute('INSERT OR IGNORE INTO days VALUES (?, ?, ?)', (key, *layout))
+                os.makedirs(os.path.join(self.path, key), exist_ok=True)
+                self._days[key] = layout
+            else:
+                return None
+        return self._days[key]
+
+    def _chunk_path(self, day: date, chunk: int) -> str:
+        return os.path.join(self.path, day.isoformat(), f'chunk_{chunk:05d}.i32')
+
+    def _open_chunk(self, day: date, chunk: int, chunk_samples: int, mode: str) -> Optional[np.memmap]:
+        path = self._chunk_path(day, chunk)
+        if not os.path.exists(path):
+            if mode == 'r':
+                return None
+            with open(path, 'wb') as f:
+                f.truncate(chunk_samples * SAMPLE_DTYPE.itemsize) # sparse until written
+        return np.memmap(path, dtype=SAMPLE_DTYPE, mode=mode, shape=(chunk_samples,))
+
+    def write(self, samples: np.ndarray, sample_rate: float, start_time: datetime, gaps: Sequence[Tuple[int, int]] = ()) -> None:
+        """
+        Store the samples of a segment at the position given by its start time.
+
+        Args:
+            samples (np.ndarray): PCM samples, integer or float.
+            sample_rate (float): Sampling rate in Hz.
+            start_time (datetime): Time of the first sample.
+            gaps (Sequence[Tuple[int, int]]): (first, end) samples the decoder filled with
+                zeros. They are not written, so they stay gaps in the coverage.
+        """
+        samples = _as_int32(samples)
+        t0 = _utc(start_time).timestamp()
+        position = 0
+        for first, end in sorted(gaps) + [(len(samples), len(samples))]:
+            if first > position:
+                self._write_run(samples[position:first], sample_rate, t0 + position / sample_rate)
+            position = max(position, end)
+
+    def _write_run(self, samples: np.ndarray, sample_rate: float, t0: float) -> None:
+        """
+        Store contiguous samples starting at the unix time t0.
+        """
+        position = 0
+        while position < len(samples):
+            # a segment crossing midnight is split between two days
+            t = t0 + position / sample_rate
+            # the day of the sample slot t rounds to, so a time just before midnight maps to offset 0 of the next day
+            day = datetime.fromtimestamp(t + 0.5 / sample_rate, tz=timezone.utc).date()
+            layout_rate, chunk_samples = self._day_layout(day, sample_rate)
+            if layout_rate != float(sample_rate):
+                raise ValueError(f"{day} is archived at {layout_rate} Hz, got samples at {sample_rate} Hz")
+            offset = int(round((t - _midnight(day)) * sample_rate))
+            day_samples = int(round(DAY_SECONDS * sample_rate))
+            count = min(len(samples) - position, day_samples - offset)
+            self._write_day(day, offset, samples[position:position + count], sample_rate, chunk_samples)
+            position += count
+
+    def _write_day(self, day: date, offset: int, samples: np.ndarray, sample_rate: float, chunk_samples: int) -> None:
+        end = offset + len(samples)
+        first_chunk, last_chunk = offset // chunk_samples, (end - 1) // chunk_samples
+        for chunk in range(first_chunk, last_chunk + 1):
+            chunk_start = chunk * chunk_samples
+            lo, hi = max(offset, chunk_start), min(end, chunk_start + chunk_samples)
+            data = self._open_chunk(day, chunk, chunk_samples, mode='r+')
+            data[lo - chunk_start:hi - chunk_start] = samples[lo - offset:hi - offset]
+            data.flush()
+            del data
+        self._update_coverage(day, offset, end, sample_rate)
+
+    def _update_coverage(self, day: date, start: int, end: int, sample_rate: float) -> None:
+        """
+        Merge [start, end) into the coverage of the day and record any overlap.
+        """
+        key = day.isoformat()
+        slack = int(round(self.tolerance * sample_rate))
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                rows = self._conn.execute('SELECT start, end FROM coverage WHERE day = ? AND start <= ? AND end >= ?',
+                                          (key, end + slack, start - slack)).fetchall()
+                merged_start, merged_end = start, end
+                for row_start, row_end in rows:
+                    overlap = min(end, row_end) - max(start, row_start)
+                    if overlap > slack:
+                        self._conn.execute('INSERT INTO overlaps VALUES (?, ?, ?, ?)',
+                                           (key, max(start, row_start), min(end, row_end), datetime.now(timezone.utc).timestamp()))
+                    merged_start, merged_end = min(merged_start, row_start), max(merged_end, row_end)
+                self._conn.execute('DELETE FROM coverage WHERE day = ? AND start <= ? AND end >= ?',
+                                   (key, end + slack, start - slack))
+                self._conn.execute('INSERT INTO coverage VALUES (?, ?, ?)', (key, merged_start, merged_end))
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    def _days_between(self, start: datetime, end: datetime) -> List[date]:
+        days = []
+        day = start.date()
+        while _midnight(day) < end.timestamp():
+            days.append(day)
+            day += timedelta(days=1)
+        return days
+
+    def _decoded_chunk(self, day: date, chunk: int, chunk_samples: int) -> Optional[np.ndarray]:
+        """
+        A chunk as float32, through the LRU cache. The cache key includes the file's
+        modification time, so chunks rewritten by the streamer are read again.
+        """
+        path = self._chunk_path(day, chunk)
+        try:
+            key = (day, chunk, os.stat(path).st_mtime_ns)
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        data = self._open_chunk(day, chunk, chunk_samples, mode='r')
+        decoded = data.astype(np.float32) / FULL_SCALE
+        del data
+        with self._lock:
+            self._cache[key] = decoded
+            while len(self._cache) > self.cache_chunks:
+                self._cache.popitem(last=False)
+        return decoded
+
+    def read(self, start: Union[str, datetime], end: Union[str, datetime]) -> ArchiveSlice:
+        """
+        Samples between start and end, reading only the chunks that overlap them.
+
+        Returns:
+            ArchiveSlice: The samples (zeros in gaps), their rate, the time of the first
+                sample and the gaps inside the requested span.
+        """
+        start, end = _utc(start), _utc(end)
+        assert start < end, f"start {start} must be before end {end}"
+
+        sample_rate = None
+        pieces = []
+        for day in self._days_between(start, end):
+            layout = self._day_layout(day)
+            if layout is None:
+                pieces.append((day, None))
+                continue
+            if sample_rate is not None and layout[0] != sample_rate:
+                raise ValueError(f"sample rate changes from {sample_rate} to {layout[0]} Hz on {day}, read the days separately")
+            sample_rate = layout[0]
+            pieces.append((day, layout))
+
+        if sample_rate is None:
+            return ArchiveSlice(np.zeros(0, dtype=np.float32), None, start, [(start, end)])
+
+        first = int(np.floor((start.timestamp() - _midnight(start.date())) * sample_rate))
+        n_samples = int(round((end - start).total_seconds() * sample_rate))
+        out = np.zeros(n_samples, dtype=np.float32)
+
+        written = 0
+        offset = first
+        for day, layout in pieces:
+            day_samples = int(round(DAY_SECONDS * sample_rate))
+            count = min(n_samples - written, day_samples - offset)
+            if layout is not None:
+                chunk_samples = layout[1]
+                for chunk in range(offset // chunk_samples, (offset + count - 1) // chunk_samples + 1):
+                    chunk_start = chunk * chunk_samples
+                    lo, hi = max(offset, chunk_start), min(offset + count, chunk_start + chunk_samples)
+                    decoded = self._decoded_chunk(day, chunk, chunk_samples)
+                    if decoded is not None:
+                        out[written + lo - offset:written + hi - offset] = decoded[lo - chunk_start:hi - chunk_start]
+            written += count
+            offset = 0
+
+        first_time = datetime.fromtimestamp(_midnight(start.date()) + first / sample_rate, tz=timezone.utc)
+        return ArchiveSlice(out, sample_rate, first_time, self.gaps(start, end))
+
+    def _intervals(self, table: str, start: datetime, end: datetime) -> List[Tuple[datetime, datetime]]:
+        intervals = []
+        for day in self._days_between(start, end):
+            layout = self._day_layout(day)
+            if layout is None:
+                continue
+            midnight = _midnight(day)
+            rows = self._execute(f'SELECT start, end FROM {table} WHERE day = ? ORDER BY start', (day.isoformat(),))
+            for row_start, row_end in rows:
+                intervals.append((datetime.fromtimestamp(midnight + row_start / layout[0], tz=timezone.utc),
+                                  datetime.fromtimestamp(midnight + row_end / layout[0], tz=timezone.utc)))
+        return [(max(a, start), min(b, end)) for a, b in intervals if a < end and b > start]
+
+    def coverage(self, start: Union[str, datetime], end: Union[str, datetime]) -> List[Tuple[datetime, datetime]]:
+        """
+        Spans between start and end that hold data.
+        """
+        return self._intervals('coverage', _utc(start), _utc(end))
+
+    def gaps(self, start: Union[str, datetime], end: Union[str, datetime]) -> List[Tuple[datetime, datetime]]:
+        """
+        Spans between start and end with no data, the complement of the coverage.
+        """
+        start, end = _utc(start), _utc(end)
+        gaps = []
+        cursor = start
+        for a, b in self.coverage(start, end):
+            if (a - cursor).total_seconds() > self.tolerance:
+                gaps.append((cursor, a))
+            cursor = max(cursor, b)
+        if (end - cursor).total_seconds() > self.tolerance:
+            gaps.append((cursor, end))
+        return gaps
+
+    def overlaps(self, start: Union[str, datetime], end: Union[str, datetime]) -> List[Tuple[datetime, datetime]]:
+        """
+        Spans between start and end that were written more than once, the later write won.
+        """
+        return self._intervals('overlaps', _utc(start), _utc(end))
+
+    def prune(self, before: Union[str, datetime]) -> List[str]:
+        """
+        Delete the chunk files that end before `before` and drop them from the coverage
+        and overlaps, i.e. to follow the retention of the segments.
+
+        Returns:
+            List[str]: Paths of the deleted chunk files.
+        """
+        before = _utc(before)
+        removed = []
+        for key, sample_rate, chunk_samples in self._execute('SELECT day, sample_rate, chunk_samples FROM days WHERE day <= ?',
+                                                             (before.date().isoformat(),)):
+            day = date.fromisoformat(key)
+            day_samples = int(round(DAY_SECONDS * sample_rate))
+            # start of the first chunk that is kept
+            cut = min(int((before.timestamp() - _midnight(day)) * sample_rate) // chunk_samples * chunk_samples, day_samples)
+            if cut <= 0:
+                continue
+            day_path = os.path.join(self.path, key)
+            for name in sorted(os.listdir(day_path)) if os.path.isdir(day_path) else []:
+                if name.startswith('chunk_') and (int(name[len('chunk_'):-len('.i32')]) + 1) * chunk_samples <= cut:
+                    os.remove(os.path.join(day_path, name))
+                    removed.append(os.path.join(day_path, name))
+
+            with self._lock:
+                self._conn.execute('BEGIN IMMEDIATE')
+                try:
+                    if cut >= day_samples:
+                        for table in ('coverage', 'overlaps', 'days'):
+                            self._conn.execute(f'DELETE FROM {table} WHERE day = ?', (key,))
+                    else:
+                        for table in ('coverage', 'overlaps'):
+                            self._conn.execute(f'DELETE FROM {table} WHERE day = ? AND end <= ?', (key, cut))
+                            self._conn.execute(f'UPDATE {table} SET start = ? WHERE day = ? AND start < ?', (cut, key, cut))
+                    self._conn.execute('COMMIT')
+                except BaseException:
+                    self._conn.execute('ROLLBACK')
+                    raise
+                if cut >= day_samples:
+                    self._days.pop(key, None)
+            if cut >= day_samples and os.path.isdir(day_path) and len(os.listdir(day_path)) == 0:
+                os.rmdir(day_path)
+        return removed
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class ArchiveReader:
+    def __init__(self, root: str, cache_chunks: int = 8) -> None:
+        """
+        Read the continuous archives of the stations below a common directory.
+
+        Args:
+            root (str): Directory holding the save_dir of every station.
+            cache_chunks (int): Decoded chunks kept in memory per station.
+        """
+        self.root = root
+        self.cache_chunks = cache_chunks
+        self._archives = {}
+        self._lock = threading.Lock()
+
+    def archive(self, station: str) -> ContinuousArchive:
+        with self._lock:
+            if station not in self._archives:
+                save_dir = os.path.join(self.root, station)
+                assert os.path.isdir(os.path.join(save_dir, ARCHIVE_DIRNAME)), f"no continuous archive in {save_dir}"
+                self._archives[station] = ContinuousArchive(save_dir, cache_chunks=self.cache_chunks)
+            return self._archives[station]
+
+    def read(self, station: str, start: Union[str, datetime], end: Union[str, datetime]) -> ArchiveSlice:
+        """
+        Samples of a station between start and end, see ContinuousArchive.read.
+
+        Args:
+            station (str): Name of the station's save_dir below root.
+        """
+        return self.archive(station).read(start, end)
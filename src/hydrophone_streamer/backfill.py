@@ -0,0 +1,171 @@
+"""
+backfill.py
+
+Fill an archive with historical data.
+
+The requested period is cut into shards by the streaming class (one day directory
+for OOI, a fixed time window for ONC) and the shards are fetched in parallel.
+Every finished shard is recorded in `backfill_checkpoint.json` in the save_dir, so
+an interrupted backfill picks up where it stopped when it is run again with the
+same period.
+
+    hydrophone-streamer-backfill save_dir=/data/ooi_stream hydrophone_network=ooi \
+        stream_setting={'url':'https://rawdata.oceanobservatories.org/files/CE02SHBP/LJ01D/HYDBBA106/'} \
+        start=2025-05-01 end=2025-06-01
+"""
+
+
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from typing import Union
+
+from tqdm import tqdm
+
+from hydrophone_streamer.notifications import write_atomic
+from hydrophone_streamer.registry import get_network_class
+from hydrophone_streamer.streamer import build_streaming_class
+
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_FILENAME = 'backfill_checkpoint.json'
+
+
+def parse_time(value: Union[str, datetime]) -> datetime:
+    """
+    Parse an ISO 8601 date or time, naive values are taken as UTC.
+    """
+    if not isinstance(value, datetime):
+        value = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def shard_key(start: datetime, end: datetime) -> str:
+    return f'{start.isoformat()}/{end.isoformat()}'
+
+
+class BackfillCheckpoint:
+    def __init__(self, save_dir: str, filename: str = CHECKPOINT_FILENAME) -> None:
+        """
+        Shards of a backfill that are complete, persisted in the save_dir.
+
+        Args:
+            save_dir (str): Directory of the station.
+            filename (str): Name of the checkpoint file inside save_dir.
+        """
+        self.path = os.path.join(save_dir, filename)
+        self._lock = threading.Lock()
+        self.shards = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                self.shards = json.load(f).get('shards', {})
+
+    def is_done(self, start: datetime, end: datetime) -> bool:
+        return shard_key(start, end) in self.shards
+
+    def mark_done(self, start: datetime, end: datetime, n_files: int) -> None:
+        """
+        Record a finished shard, the file is replaced atomically so a crash never corrupts it.
+        """
+        with self._lock:
+            self.shards[shard_key(start, end)] = {'files': n_files,
+                                                  'completed': datetime.now(timezone.utc).isoformat()}
+            write_atomic(self.path, json.dumps({'shards': self.shards}, indent=1))
+
+
+def run_backfill(streaming_class,
+                 start: Union[str, datetime],
+                 end: Union[str, datetime],
+                 shard_workers: int = 4,
+                 ) -> list:
+    """
+    Fetch every segment between start and end that is not in the archive yet.
+
+    Shards that end within the built in delay of the network are fetched but not
+    checkpointed, since more segments may still be published for them.
+
+    Args:
+        streaming_class (BaseStreamingClass): The station to backfill.
+        start (Union[str, datetime]): Start of the period, ISO 8601.
+        end (Union[str, datetime]): End of the period, ISO 8601.
+        shard_workers (int): Shards fetched at the same time.
+
+    Returns:
+        list: Files written by the backfill.
+    """
+    if not type(streaming_class).supports_backfill():
+        raise ValueError(f"{streaming_class.network} stations can only be followed live, they cannot be backfilled")
+    start, end = parse_time(start), parse_time(end)
+    assert start < end, f"backfill start {start} must be before end {end}"
+
+    checkpoint = BackfillCheckpoint(streaming_class.save_dir)
+    shards = streaming_class.backfill_shards(start, end)
+    pending = [shard for shard in shards if not checkpoint.is_done(*shard)]
+    settled = datetime.now(timezone.utc) - timedelta(minutes=streaming_class.built_in_delay)
+
+    fetched_results = []
+    failed = []
+    with tqdm(total=len(shards), initial=len(shards) - len(pending), unit='shard',
+              desc=f'backfill {streaming_class.save_dir}') as progress:
+        with ThreadPoolExecutor(max_workers=shard_workers) as executor:
+            futures = {executor.submit(streaming_class.backfill_shard, *shard): shard for shard in pending}
+            for future in as_completed(futures):
+                shard = futures[future]
+                try:
+                    files = future.result()
+                except Exception as e:
+                    # left out of the checkpoint, so the next run retries it
+                    failed.append(shard)
+                    tqdm.write(f'shard {shard_key(*shard)} failed: {e!r}')
+                    continue
+                if shard[1] <= settled:
+                    checkpoint.mark_done(*shard, len(files))
+                fetched_results.extend(files)
+                progress.update(1)
+                progress.set_postfix(files=len(fetched_results))
+
+    if len(fetched_results) > 0:
+        streaming_class.latest_file()
+
+    if len(failed) > 0:
+        logger.warning('%d of %d shards failed, run the backfill again to retry them', len(failed), len(shards))
+
+    return fetched_results
+
+
+def backfill(hydrophone_network: str,
+             stream_setting: Union[str, dict],
+             save_dir: str,
+             start: Union[str, datetime],
+             end: Union[str, datetime],
+             shard_workers: int = 4,
+             **options,
+             ) -> list:
+    """
+    Backfill a station between start and end.
+
+    Args:
+        hydrophone_network (str): A network that can be backfilled, i.e. 'onc' or 'ooi'.
+        stream_setting (Union[str, dict]): Settings of the hydrophone, or the path to a json file holding them.
+        save_dir (str): Directory the segments are written to.
+        start (Union[str, datetime]): Start of the period, ISO 8601.
+        end (Union[str, datetime]): End of the period, ISO 8601.
+        shard_workers (int): Shards fetched at the same time.
+        **options: Passed on to the streaming class (i.e. max_workers).
+
+    Returns:
+        list: Files written by the backfill.
+    """
+    if not get_network_class(hydrophone_network).supports_backfill():
+        raise ValueError(f"{hydrophone_network} stations can only be followed live, they cannot be backfilled")
+    streaming_class = build_streaming_class(hydrophone_network, stream_setting, save_dir=save_dir, **options)
+    try:
+        return run_backfill(streaming_class, start, end, shard_workers=shard_workers)
+    finally:
+        streaming_class.close()
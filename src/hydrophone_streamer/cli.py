@@ -4,39 +4,78 @@ cli.py
 
 
 import hydra
-from omegaconf import DictConfig
-from dotenv import load_dotenv, set_key
+from omegaconf import DictConfig, OmegaConf
 import os
 
 
-from hydrophone_streamer.streamer import stream_data
+# the streaming classes and their dependencies are imported by the command that needs them
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'configs')
 
 
+def _setup_observability(cfg: DictConfig) -> None:
+    from hydrophone_streamer.log import configure_logging
+    from hydrophone_streamer.metrics import start_exporters
 
-# # Load .env file to get API token
-# load_dotenv()
-# token = os.getenv("ONC_TOKEN")
-
-LOCAL_PATH = os.path.abspath(__file__)
-print(LOCAL_PATH)
-CONFIG_PATH = os.path.join(os.path.dirname(os.path.dirname(LOCAL_PATH)), 'hydrophone_streamer','configs')
-
-print(CONFIG_PATH)
+    configure_logging(cfg.log_level, cfg.log_format)
+    start_exporters(port=cfg.metrics_port, path=cfg.metrics_file)
 
 
 @hydra.main(config_path=CONFIG_PATH, config_name="config", version_base="1.3")
 def main(cfg: DictConfig):
-    
-    
+    from hydrophone_streamer.streamer import stream_data
+
+    _setup_observability(cfg)
+
     stream_data(
         hydrophone_network=cfg.hydrophone_network,
         stream_setting=cfg.stream_setting,
         save_dir=cfg.save_dir,
+        max_workers=cfg.max_workers,
+        max_connections_per_host=cfg.max_connections_per_host,
+        retention=OmegaConf.to_container(cfg.retention, resolve=True),
+        ring_buffer_seconds=cfg.ring_buffer_seconds,
+        continuous_archive=cfg.continuous_archive,
+        spectrogram=cfg.spectrogram,
+        transcode_workers=cfg.transcode_workers,
+        max_pending=cfg.max_pending,
+        streaming_decode=cfg.streaming_decode,
+        coordination=cfg.coordination,
+        output=OmegaConf.to_container(cfg.output, resolve=True) if cfg.output is not None else None,
     )
 
+# Command to fill an archive with historical data
+@hydra.main(config_path=CONFIG_PATH, config_name="backfill_config", version_base="1.3")
+def backfill(cfg: DictConfig):
+    from hydrophone_streamer.backfill import backfill
+
+    _setup_observability(cfg)
+    backfill(
+        hydrophone_network=cfg.hydrophone_network,
+        stream_setting=cfg.stream_setting,
+        save_dir=cfg.save_dir,
+        start=str(cfg.start),
+        end=str(cfg.end),
+        shard_workers=cfg.shard_workers,
+        max_workers=cfg.max_workers,
+        max_connections_per_host=cfg.max_connections_per_host,
+        transcode_workers=cfg.transcode_workers,
+        max_pending=cfg.max_pending,
+        streaming_decode=cfg.streaming_decode,
+    )
+
+# Command to stream many stations from one process
+@hydra.main(config_path=CONFIG_PATH, config_name="supervisor_config", version_base="1.3")
+def supervise(cfg: DictConfig):
+    from hydrophone_streamer.supervisor import supervise
+
+    _setup_observability(cfg)
+    supervise(cfg.config_file, max_workers=cfg.max_workers, use_asyncio=cfg.use_asyncio, coordination=cfg.coordination)
+
 # Command to set the API token and store it in .env file
-@hydra.main(config_path=CONFIG_PATH, config_name="token_config")
+@hydra.main(config_path=CONFIG_PATH, config_name="token_config", version_base="1.3")
 def set_token(cfg: DictConfig):
+    from dotenv import set_key
+
     # get project root directory
     dotenv_file = os.path.join(os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir)), '.env')
 
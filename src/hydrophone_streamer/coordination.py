@@ -0,0 +1,420 @@
+"""
+coordination.py
+
+Share the stations of one configuration between workers on several hosts.
+
+Every worker holds a lease on each station it streams. Leases live in a backend
+every worker can reach, by default an SQLite file on shared storage
+(SQLiteLeaseBackend), and expire unless their holder renews them. A Coordinator
+runs the heartbeat of one worker: it renews its leases, publishes that the worker
+is alive and moves leases so every live worker holds its share of the stations.
+When a worker dies its leases expire and the others claim them.
+
+A lease handed to another worker is only released once the poll running under it
+has finished (see Coordinator.begin and Coordinator.end). Every lease carries an
+epoch, bumped each time the lease is taken, which fences the writes of a worker
+that lost its lease mid-poll (i.e. its heartbeat stalled for longer than the ttl):
+before a segment is registered or latest.txt is written, Coordinator.check
+compares the epoch the poll started under with the lease in the backend and
+raises LeaseLost if another worker may have taken the station over.
+
+Leases expire by wall clock time, so the clocks of the hosts must agree to well
+within the lease ttl (i.e. NTP).
+"""
+
+
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set
+
+from hydrophone_streamer.metrics import LEASE_CHANGES, LEASES_HELD
+
+
+logger = logging.getLogger(__name__)
+
+LEASE_FILENAME = 'leases.sqlite'
+
+
+class Lease(NamedTuple):
+    station: str
+    owner: str # worker id
+    expires: float # unix time
+    epoch: int # incremented every time the lease is taken, fences the writes made under it
+
+
+class LeaseLost(RuntimeError):
+    """
+    This worker no longer holds the lease a poll started under, it must stop writing.
+    """
+
+
+def default_worker_id() -> str:
+    """
+    A worker id unique across hosts and restarts: host, pid and a random suffix.
+    """
+    return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+
+class LeaseBackend:
+    """
+    Storage for leases and worker heartbeats, shared by every worker.
+
+    Implementations must make `acquire` and `renew` atomic across processes and hosts.
+    """
+    def acquire(self, station: str, owner: str, ttl: float) -> Optional[Lease]:
+        """
+        Take the lease of a station if it is free, expired or already held by `owner`.
+
+        Returns:
+            Lease: The lease now held by `owner`, or None if another worker holds it.
+        """
+        raise NotImplementedError("This method should be implemented in the subclass.")
+
+    def renew(self, station: str, owner: str, ttl: float) -> bool:
+        """
+        Extend a lease held by `owner`, returns False if it was lost.
+        """
+        raise NotImplementedError("This method should be implemented in the subclass.")
+
+    def release(self, station: str, owner: str) -> None:
+        """
+        Give up a lease held by `owner`. Its epoch must survive, so the next holder gets a higher one.
+        """
+        raise NotImplementedError("This method should be implemented in the subclass.")
+
+    def lease(self, station: str) -> Optional[Lease]:
+        """
+        The lease of a station, or None if it is free or expired.
+        """
+        raise NotImplementedError("This method should be implemented in the subclass.")
+
+    def leases(self) -> Dict[str, Lease]:
+        """
+        Every lease that has not expired, by station.
+        """
+        raise NotImplementedError("This method should be implemented in the subclass.")
+
+    def heartbeat(self, worker: str, ttl: float) -> None:
+        """
+        Record that a worker is alive for the next `ttl` seconds.
+        """
+        raise NotImplementedError("This method should be implemented in the subclass.")
+
+    def workers(self) -> List[str]:
+        """
+        Ids of the workers whose heartbeat has not expired, sorted.
+        """
+        raise NotImplementedError("This method should be implemented in the subclass.")
+
+    def leave(self, worker: str) -> None:
+        """
+        Forget a worker that stops, and release its leases.
+        """
+        raise NotImplementedError("This method should be implemented in the subclass.")
+
+
+class SQLiteLeaseBackend(LeaseBackend):
+    def __init__(self, path: str, timeout: float = 30) -> None:
+        """
+        Leases in an SQLite file, i.e. on storage shared by the workers.
+
+        The rollback journal is kept (no WAL), which needs shared memory and does not
+        work across hosts; on a network file system the file system must support locks.
+
+        Args:
+            path (str): The SQLite file, or a directory to create leases.sqlite in.
+            timeout (float): Seconds to wait for another worker's write to finish.
+        """
+        if os.path.isdir(path):
+            path = os.path.join(path, LEASE_FILENAME)
+        self.path = path
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=timeout, check_same_thread=False, isolation_level=None)
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS leases (
+                                station TEXT PRIMARY KEY,
+                                owner TEXT NOT NULL,
+                                expires REAL NOT NULL,
+                                epoch INTEGER NOT NULL)""")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS workers (
+                                worker TEXT PRIMARY KEY,
+                                expires REAL NOT NULL)""")
+
+    def _execute(self, query: str, parameters: tuple = ()) -> sqlite3.Cursor:
+        with self._lock:
+            return self._conn.execute(query, parameters)
+
+    def acquire(self, station: str, owner: str, ttl: float) -> Optional[Lease]:
+        now = time.time()
+        # one statement, so the check and the write are atomic across processes; the epoch
+        # stays the same only while `owner` holds the lease without interruption
+        cursor = self._execute("""INSERT INTO leases VALUES (?, ?, ?, 1)
+                                  ON CONFLICT (station) DO UPDATE SET
+                                    epoch = leases.epoch + (leases.owner != excluded.owner OR leases.expires < ?),
+                                    owner = excluded.owner,
+                                    expires = excluded.expires
+                                  WHERE leases.owner = excluded.owner OR leases.expires < ?""",
+                               (station, owner, now + ttl, now, now))
+        if cursor.rowcount != 1:
+            return None
+        rows = self._execute('SELECT * FROM leases WHERE station = ? AND owner = ?', (station, owner)).fetchall()
+        return Lease(*rows[0]) if rows else None
+
+    def renew(self, station: str, owner: str, ttl: float) -> bool:
+        # an expired lease nobody took over is still ours
+        cursor = self._execute('UPDATE leases SET expires = ? WHERE station = ? AND owner = ?',
+                               (time.time() + ttl, station, owner))
+        return cursor.rowcount == 1
+
+    def release(self, station: str, owner: str) -> None:
+        # expire rather than delete, the row keeps the epoch
+        self._execute('UPDATE leases SET expires = 0 WHERE station = ? AND owner = ?', (station, owner))
+
+    def lease(self, station: str) -> Optional[Lease]:
+        rows = self._execute('SELECT * FROM leases WHERE station = ? AND expires >= ?', (station, time.time())).fetchall()
+        return Lease(*rows[0]) if rows else None
+
+    def leases(self) -> Dict[str, Lease]:
+        rows = self._execute('SELECT * FROM leases WHERE expires >= ?', (time.time(),)).fetchall()
+        return {row[0]: Lease(*row) for row in rows}
+
+    def heartbeat(self, worker: str, ttl: float) -> None:
+        self._execute('INSERT OR REPLACE INTO workers VALUES (?, ?)', (worker, time.time() + ttl))
+
+    def workers(self) -> List[str]:
+        now = time.time()
+        self._execute('DELETE FROM workers WHERE expires < ?', (now,))
+        return [row[0] for row in self._execute('SELECT worker FROM workers ORDER BY worker').fetchall()]
+
+    def leave(self, worker: str) -> None:
+        self._execute('UPDATE leases SET expires = 0 WHERE owner = ?', (worker,))
+        self._execute('DELETE FROM workers WHERE worker = ?', (worker,))
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def fair_share(n_stations: int, workers: List[str], worker: str) -> int:
+    """
+    Stations `worker` should hold when they are spread evenly over the live workers.
+    """
+    if worker not in workers:
+        return 0
+    n_workers = len(workers)
+    return n_stations // n_workers + (1 if workers.index(worker) < n_stations % n_workers else 0)
+
+
+class Coordinator:
+    def __init__(self,
+                 backend: LeaseBackend,
+                 stations: Iterable[str],
+                 worker_id: Optional[str] = None,
+                 ttl: float = 30,
+                 heartbeat_interval: Optional[float] = None,
+                 ) -> None:
+        """
+        Claim and hold the leases of this worker's share of the stations.
+
+        Args:
+            backend (LeaseBackend): Where the leases are kept, shared by every worker.
+            stations (Iterable[str]): Names of all the stations, the same list on every worker.
+            worker_id (str, optional): Unique id of this worker, defaults to host:pid:random.
+            ttl (float): Seconds a lease or heartbeat lasts without being renewed, i.e. how long
+                the stations of a dead worker go unstreamed.
+            heartbeat_interval (float, optional): Seconds between two heartbeats, defaults to a third of the ttl.
+        """
+        self.backend = backend
+        self.stations = sorted(set(stations))
+        self.worker_id = worker_id if worker_id is not None else default_worker_id()
+        self.ttl = ttl
+        self.heartbeat_interval = heartbeat_interval if heartbeat_interval is not None else ttl / 3
+        assert self.heartbeat_interval < ttl, "The heartbeat must come more often than the leases expire."
+
+        self._owned = {} # station -> Lease, the stations this worker polls
+        self._draining = {} # station -> Lease handed back, kept until the polls under it finish
+        self._busy = {} # station -> polls in flight
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @property
+    def owned(self) -> Set[str]:
+        """
+        Stations this worker holds the lease of.
+        """
+        with self._lock:
+            return set(self._owned)
+
+    def owns(self, station: str) -> bool:
+        with self._lock:
+            return station in self._owned
+
+    def begin(self, station: str) -> Optional[Lease]:
+        """
+        Start a poll of a station. The lease is not released before the matching `end`.
+
+        Returns:
+            Lease: The lease the poll runs under, its epoch goes to `check`. None if this
+                worker does not hold the station, the poll must not start.
+        """
+        with self._lock:
+            lease = self._owned.get(station)
+            if lease is not None:
+                self._busy[station] = self._busy.get(station, 0) + 1
+            return lease
+
+    def end(self, station: str) -> None:
+        """
+        Finish a poll started with `begin`, and release the lease if it was handed back meanwhile.
+        """
+        with self._lock:
+            self._busy[station] -= 1
+            if self._busy[station] == 0:
+                del self._busy[station]
+            lease = self._draining.pop(station, None) if station not in self._busy else None
+        if lease is not None:
+            self._release(station)
+
+    def check(self, station: str, epoch: int) -> None:
+        """
+        Raise LeaseLost unless this worker still holds the lease of a station under the given epoch.
+        Call it before every write to the station's save_dir.
+        """
+        lease = self.backend.lease(station)
+        if lease is None or lease.owner != self.worker_id or lease.epoch != epoch:
+            raise LeaseLost(f"worker {self.worker_id} no longer holds the lease of {station} (epoch {epoch})")
+
+    def _lose(self, station: str) -> None:
+        with self._lock:
+            self._owned.pop(station, None)
+            self._draining.pop(station, None)
+        LEASE_CHANGES.inc(station=station, change='lost')
+        logger.info('worker %s lost the lease of %s', self.worker_id, station)
+
+    def _hand_back(self, station: str) -> None:
+        """
+        Stop polling a station, then release its lease once the poll in flight has finished.
+        """
+        with self._lock:
+            lease = self._owned.pop(station)
+            if station in self._busy:
+                self._draining[station] = lease
+                return
+        self._release(station)
+
+    def _release(self, station: str) -> None:
+        self.backend.release(station, self.worker_id)
+        LEASE_CHANGES.inc(station=station, change='released')
+        logger.info('worker %s released the lease of %s', self.worker_id, station)
+
+    def step(self) -> Set[str]:
+        """
+        One heartbeat: renew the held leases, then hand back or claim leases until
+        this worker holds its share of the stations.
+
+        Returns:
+            set: Stations held afterwards.
+        """
+        self.backend.heartbeat(self.worker_id, self.ttl)
+
+        with self._lock:
+            held = sorted(set(self._owned) | set(self._draining))
+        for station in held:
+            if not self.backend.renew(station, self.worker_id, self.ttl):
+                self._lose(station)
+
+        workers = self.backend.workers()
+        target = fair_share(len(self.stations), workers, self.worker_id)
+        owned = sorted(self.owned)
+
+        # surplus goes back from the end, so the same stations stay put when a worker joins
+        for station in owned[target:]:
+            self._hand_back(station)
+
+        if len(owned) < target:
+            leases = self.backend.leases()
+            with self._lock:
+                # a poll from a lost lease may still be running, wait for it before claiming the station again
+                busy = set(self._busy)
+            free = [station for station in self.stations if station not in leases and station not in busy]
+            # start at a different station on every worker so they do not all race for the same lease
+            offset = workers.index(self.worker_id) * len(free) // max(len(workers), 1)
+            for station in free[offset:] + free[:offset]:
+                if len(self.owned) >= target:
+                    break
+                lease = self.backend.acquire(station, self.worker_id, self.ttl)
+                if lease is not None:
+                    with self._lock:
+                        self._owned[station] = lease
+                    LEASE_CHANGES.inc(station=station, change='acquired')
+                    logger.info('worker %s acquired the lease of %s (epoch %d)', self.worker_id, station, lease.epoch)
+
+        owned = self.owned
+        LEASES_HELD.set(len(owned), worker=self.worker_id)
+        return owned
+
+    def _run(self) -> None:
+        while not self._stop_event.is_set():
+            try:
+                self.step()
+            except Exception as e:
+                # keep the leases we have, they are only lost once they expire
+                logger.warning('heartbeat of worker %s failed: %r', self.worker_id, e)
+            self._stop_event.wait(self.heartbeat_interval)
+
+    def start(self):
+        """
+        Take a first share of the stations, then keep heartbeating on a background thread.
+        """
+        self.step()
+        self._thread = threading.Thread(target=self._run, name='lease-heartbeat', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """
+        Stop heartbeating and release every lease, so other workers take over right away.
+        """
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.backend.leave(self.worker_id)
+        with self._lock:
+            self._owned.clear()
+            self._draining.clear()
+        LEASES_HELD.set(0, worker=self.worker_id)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def build_coordinator(config: Optional[dict], stations: Iterable[str]) -> Optional[Coordinator]:
+    """
+    Coordinator from the `coordination` entry of a supervisor configuration, None if it is not set.
+
+    Args:
+        config (dict, optional): `backend` (a path for SQLiteLeaseBackend), and optionally
+            `ttl`, `heartbeat_interval` and `worker_id`.
+        stations (Iterable[str]): Names of all the stations.
+    """
+    if config is None:
+        return None
+    if isinstance(config, str):
+        config = {'backend': config}
+    assert 'backend' in config, "coordination must name the lease backend, i.e. a path on shared storage."
+    backend = config['backend']
+    if isinstance(backend, str):
+        backend = SQLiteLeaseBackend(backend)
+    return Coordinator(backend, stations,
+                       worker_id=config.get('worker_id'),
+                       ttl=config.get('ttl', 30),
+                       heartbeat_interval=config.get('heartbeat_interval'))
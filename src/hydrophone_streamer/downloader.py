@@ -0,0 +1,379 @@
+"""
+downloader.py
+
+Download segments over the shared keep-alive session.
+
+Remote files are probed with HEAD (or a one byte ranged GET when HEAD is not
+allowed) so size filters never pull the body, and directory listings are fetched
+conditionally so an unchanged listing costs a single 304. Downloads resume with
+Range requests and are only renamed into place once verified.
+"""
+
+
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from typing import Callable, NamedTuple, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+
+from hydrophone_streamer.metrics import LISTING_REQUESTS, RETRIES
+from hydrophone_streamer.sessions import get_session
+
+
+logger = logging.getLogger(__name__)
+
+
+CHUNK_SIZE = 1 << 16 # bytes, at most this much is lost and re-requested when a connection drops
+IDENTITY = {'Accept-Encoding': 'identity'} # so Content-Length is the size on disk
+
+
+class RemoteFile(NamedTuple):
+    url: str
+    size: Optional[int]
+    etag: Optional[str]
+    last_modified: Optional[str]
+
+
+class Listing(NamedTuple):
+    url: str
+    status_code: int
+    text: Optional[str]
+    modified: bool # False when the server answered 304 and the cached body was reused
+
+
+def probe(url: str,
+          session: Optional[requests.Session] = None,
+          timeout: float = 30,
+          ) -> RemoteFile:
+    """
+    Fetch the metadata of a remote file without downloading its body.
+
+    Args:
+        url (str): Remote file.
+        session (requests.Session, optional): Session to use, defaults to the shared one.
+        timeout (float): Connect/read timeout in seconds.
+
+    Returns:
+        RemoteFile: Size (None if the server does not say), ETag and Last-Modified.
+    """
+    if session is None:
+        session = get_session()
+
+    response = session.head(url, headers=IDENTITY, allow_redirects=True, timeout=timeout)
+    size = response.headers.get('Content-Length')
+
+    if response.status_code in (403, 405, 501) or size is None:
+        # HEAD not supported, ask for the first byte and read the total from Content-Range
+        with session.get(url, headers={**IDENTITY, 'Range': 'bytes=0-0'}, stream=True, timeout=timeout) as response:
+            content_range = re.search(r'/(\d+)$', response.headers.get('Content-Range', ''))
+            if content_range is not None:
+                size = content_range.group(1)
+            elif response.status_code == 200:
+                # range ignored, the full length is in Content-Length
+                size = response.headers.get('Content-Length')
+
+    response.raise_for_status()
+
+    return RemoteFile(url=url,
+                      size=int(size) if size is not None else None,
+                      etag=response.headers.get('ETag'),
+                      last_modified=response.headers.get('Last-Modified'))
+
+
+class ListingFetcher:
+    def __init__(self, session: Optional[requests.Session] = None) -> None:
+        """
+        Fetch directory listings with If-None-Match / If-Modified-Since.
+
+        Args:
+            session (requests.Session, optional): Session to use, defaults to the shared one.
+        """
+        self.session = session if session is not None else get_session()
+        self._cache = {} # url -> (etag, last_modified, text)
+        self._lock = threading.Lock()
+
+    def fetch(self, url: str, timeout: float = 30) -> Listing:
+        """
+        Fetch a listing, reusing the cached body when the server reports it unchanged.
+        """
+        with self._lock:
+            etag, last_modified, text = self._cache.get(url, (None, None, None))
+
+        headers = {}
+        if text is not None:
+            if etag is not None:
+                headers['If-None-Match'] = etag
+            if last_modified is not None:
+                headers['If-Modified-Since'] = last_modified
+
+        response = self.session.get(url, headers=headers, timeout=timeout)
+
+        host = urlsplit(url).netloc
+        if response.status_code == 304 and text is not None:
+            LISTING_REQUESTS.inc(host=host, outcome='not_modified')
+            return Listing(url=url, status_code=200, text=text, modified=False)
+
+        if response.status_code == 200:
+            LISTING_REQUESTS.inc(host=host, outcome='modified')
+            with self._lock:
+                self._cache[url] = (response.headers.get('ETag'), response.headers.get('Last-Modified'), response.text)
+            return Listing(url=url, status_code=200, text=response.text, modified=True)
+
+        LISTING_REQUESTS.inc(host=host, outcome=str(response.status_code))
+        return Listing(url=url, status_code=response.status_code, text=None, modified=True)
+
+    def forget(self, url: str) -> None:
+        """
+        Drop the cached copy of a listing.
+        """
+        with self._lock:
+            self._cache.pop(url, None)
+
+
+def file_digest(path: str, algorithm: str) -> str:
+    """
+    Hex digest of a file on disk with a hashlib algorithm.
+    """
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def replay(path: str, on_chunk: Callable[[bytes], None], chunk_size: int) -> int:
+    """
+    Pass the bytes of a file on disk to on_chunk, returns how many were passed.
+    """
+    n_bytes = 0
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk_size), b''):
+            on_chunk(block)
+            n_bytes += len(block)
+    return n_bytes
+
+
+def total_size(status_code: int, headers) -> Optional[int]:
+    """
+    Full size of the remote file from the headers of a 200 or 206 response.
+    """
+    content_range = re.search(r'/(\d+)$', headers.get('Content-Range', ''))
+    if content_range is not None:
+        return int(content_range.group(1))
+    if status_code == 200 and 'Content-Length' in headers:
+        return int(headers['Content-Length'])
+    return None
+
+
+class PartFile:
+    def __init__(self,
+                 url: str,
+                 local_path: str,
+                 chunk_size: int = CHUNK_SIZE,
+                 expected_size: Optional[int] = None,
+                 etag: Optional[str] = None,
+                 on_chunk: Optional[Callable[[bytes], None]] = None,
+                 ) -> None:
+        """
+        The steps of a resumable download that do not depend on the HTTP client.
+
+        download_file and aio.download_file only send the requests and pass the
+        response status, headers and body chunks here.
+
+        Args:
+            url (str): Remote file.
+            local_path (str): Destination path, the body goes to `<local_path>.part` first.
+            chunk_size (int): Bytes read back from disk at a time.
+            expected_size (int, optional): Size reported by `probe`, defaults to the size the server reports.
+            etag (str, optional): ETag reported by `probe`; a resumed transfer restarts if the file changed.
+            on_chunk (Callable, optional): Called with every byte of the file once, in order.
+        """
+        self.url = url
+        self.local_path = local_path
+        self.part_path = local_path + '.part'
+        self.chunk_size = chunk_size
+        self.expected_size = expected_size
+        self.etag = etag
+        self.on_chunk = on_chunk
+        self.delivered = 0 # bytes passed to on_chunk
+        self._offset = 0
+        self._position = 0
+        self._if_range = False
+
+    def resume(self) -> Optional[int]:
+        """
+        Pick up what an earlier call left on disk.
+
+        Returns:
+            Optional[int]: Size of the file if it is already in place (its bytes are
+            replayed to on_chunk), otherwise None after replaying the part file.
+        """
+        if os.path.exists(self.local_path) and (self.expected_size is None or os.path.getsize(self.local_path) == self.expected_size):
+            if self.on_chunk is not None:
+                replay(self.local_path, self.on_chunk, self.chunk_size)
+            return os.path.getsize(self.local_path)
+        if self.on_chunk is not None and os.path.exists(self.part_path):
+            self.delivered = replay(self.part_path, self.on_chunk, self.chunk_size)
+        return None
+
+    def request_headers(self) -> dict:
+        """
+        Headers of the next request, a Range (and If-Range) from the bytes already on disk.
+        """
+        self._offset = os.path.getsize(self.part_path) if os.path.exists(self.part_path) else 0
+        headers = dict(IDENTITY)
+        self._if_range = False
+        if self._offset > 0:
+            headers['Range'] = f'bytes={self._offset}-'
+            if self.etag is not None:
+                headers['If-Range'] = self.etag
+                self._if_range = True
+        return headers
+
+    def complete(self, status_code: int) -> bool:
+        """
+        True when the server refused the range because the part file already holds everything.
+        """
+        return status_code == 416 and self.expected_size is not None and self._offset == self.expected_size
+
+    def open(self, status_code: int, headers):
+        """
+        Open the part file for the body of a successful response.
+
+        Args:
+            status_code (int): 206 continues the part file, 200 means the server sent everything again.
+            headers: Response headers.
+
+        Returns:
+            The part file, pass each chunk of the body to `write` with it.
+        """
+        if self.expected_size is None:
+            self.expected_size = total_size(status_code, headers)
+        self._position = self._offset if status_code == 206 else 0
+        if self.on_chunk is not None and self._position < self.delivered and self._if_range:
+            # the file changed since the bytes already passed on were sent
+            os.remove(self.part_path)
+            raise ValueError(f"{self.url} changed while it was being downloaded")
+        return open(self.part_path, 'ab' if status_code == 206 else 'wb')
+
+    def write(self, f, chunk: bytes) -> None:
+        """
+        Append a chunk of the body, passing on the bytes on_chunk has not seen yet.
+        """
+        f.write(chunk)
+        if self.on_chunk is not None and self._position + len(chunk) > self.delivered:
+            self.on_chunk(chunk[max(self.delivered - self._position, 0):])
+            self.delivered = self._position + len(chunk)
+        self._position += len(chunk)
+
+    def received(self) -> int:
+        """
+        Bytes on disk after a response, raises IOError when the connection closed early.
+        """
+        n_bytes = os.path.getsize(self.part_path)
+        if self.expected_size is not None and n_bytes < self.expected_size:
+            raise IOError(f"Connection to {self.url} closed after {n_bytes} of {self.expected_size} bytes")
+        return n_bytes
+
+    def publish(self, checksum: Optional[Tuple[str, str]] = None) -> int:
+        """
+        Verify the length (and optionally the checksum) and rename the part file into place.
+
+        Args:
+            checksum (Tuple[str, str], optional): (hashlib algorithm, hex digest) the file must match.
+
+        Returns:
+            int: Size of the file.
+        """
+        n_bytes = os.path.getsize(self.part_path)
+        if self.expected_size is not None and n_bytes != self.expected_size:
+            os.remove(self.part_path)
+            raise IOError(f"Downloaded {n_bytes} bytes from {self.url}, expected {self.expected_size}")
+
+        if checksum is not None:
+            algorithm, digest = checksum
+            if file_digest(self.part_path, algorithm) != digest.lower():
+                os.remove(self.part_path)
+                raise IOError(f"{algorithm} checksum mismatch for {self.url}")
+
+        os.replace(self.part_path, self.local_path)
+        return n_bytes
+
+
+def download_file(url: str,
+                  local_path: str,
+                  session: Optional[requests.Session] = None,
+                  chunk_size: int = CHUNK_SIZE,
+                  timeout: float = 60,
+                  expected_size: Optional[int] = None,
+                  checksum: Optional[Tuple[str, str]] = None,
+                  etag: Optional[str] = None,
+                  retries: int = 5,
+                  retry_delay: float = 1,
+                  on_chunk: Optional[Callable[[bytes], None]] = None,
+                  ) -> int:
+    """
+    Stream a remote file to disk, resuming after dropped connections.
+
+    The body is written to `<local_path>.part`. When the transfer fails, it is
+    resumed with a Range request from the bytes already on disk. This also happens
+    on the next call if the retries run out. Once the length (and optionally the
+    checksum) is verified, the file is renamed into place, so `local_path` only
+    ever holds complete files.
+
+    Args:
+        url (str): Remote file.
+        local_path (str): Destination path.
+        session (requests.Session, optional): Session to use, defaults to the shared one.
+        chunk_size (int): Bytes read from the socket at a time.
+        timeout (float): Connect/read timeout in seconds.
+        expected_size (int, optional): Size reported by `probe`, defaults to the size the server reports.
+        checksum (Tuple[str, str], optional): (hashlib algorithm, hex digest) the file must match.
+        etag (str, optional): ETag reported by `probe`; a resumed transfer restarts if the file changed.
+        retries (int): Attempts after the first failure.
+        retry_delay (float): Seconds before the first retry, doubled on every attempt.
+        on_chunk (Callable, optional): Called with the bytes of the file in order as they
+            arrive, i.e. to decode while downloading. Each byte is passed once: bytes left
+            on disk by an earlier call are read back first, and bytes sent again after a
+            retry are not repeated.
+
+    Returns:
+        int: Size of the file.
+    """
+    if session is None:
+        session = get_session()
+
+    part = PartFile(url, local_path, chunk_size=chunk_size, expected_size=expected_size, etag=etag, on_chunk=on_chunk)
+    n_bytes = part.resume()
+    if n_bytes is not None:
+        # completed by an earlier call
+        return n_bytes
+
+    attempt = 0
+    while True:
+        headers = part.request_headers()
+        try:
+            with session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+                if not part.complete(response.status_code):
+                    response.raise_for_status()
+                    with part.open(response.status_code, response.headers) as f:
+                        for chunk in response.iter_content(chunk_size=chunk_size):
+                            part.write(f, chunk)
+            part.received()
+            break
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError, IOError) as e:
+            if isinstance(e, requests.HTTPError):
+                raise
+            if attempt >= retries:
+                raise
+            logger.warning('download of %s interrupted (%r), resuming in %.0fs', url, e, retry_delay * 2 ** attempt)
+            RETRIES.inc(host=urlsplit(url).netloc)
+            time.sleep(retry_delay * 2 ** attempt)
+            attempt += 1
+
+    return part.publish(checksum)
@@ -0,0 +1,130 @@
+"""
+listing.py
+
+Incremental parsing of HTTP directory listings.
+
+Links are pulled out with a small streaming html.parser subclass instead of a
+full DOM, and every directory remembers the entries it has already seen so a
+repeat poll only parses the tail of the listing that was appended since.
+"""
+
+
+import bisect
+import threading
+from datetime import datetime
+from html.parser import HTMLParser
+from typing import Callable, List, Tuple
+from urllib.parse import urljoin
+
+
+class HrefExtractor(HTMLParser):
+    """
+    Collect the href of every <a> tag fed to the parser.
+    """
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.hrefs = []
+
+    def handle_starttag(self, tag, attrs) -> None:
+        if tag != 'a':
+            return
+        for name, value in attrs:
+            if name == 'href' and value is not None:
+                self.hrefs.append(value)
+
+
+def extract_hrefs(text: str) -> List[str]:
+    """
+    Return the link targets of an html page, in document order.
+    """
+    parser = HrefExtractor()
+    parser.feed(text)
+    parser.close()
+    return parser.hrefs
+
+
+class _Directory:
+    def __init__(self) -> None:
+        self.seen = set()
+        self.last_href = None
+        self.times = [] # sorted segment start times
+        self.urls = [] # absolute urls, in the same order as times
+
+
+class ListingCache:
+    def __init__(self, parse_time: Callable[[str], datetime], suffix: str = '.mseed') -> None:
+        """
+        Remember the entries of directory listings between polls.
+
+        Args:
+            parse_time (Callable[[str], datetime]): Extracts the segment start time from a link.
+            suffix (str): Only links ending in this suffix are kept.
+        """
+        self.parse_time = parse_time
+        self.suffix = suffix
+        self._directories = {}
+        self._lock = threading.Lock()
+
+    def update(self, url: str, text: str) -> int:
+        """
+        Parse the part of a listing that is new since the last call.
+
+        Listings are sorted by name, and segment names sort by time, so new entries
+        are appended after the last link seen. Parsing resumes from there, falling
+        back to the whole page if that link has disappeared.
+
+        Args:
+            url (str): Url of the directory.
+            text (str): Body of the listing.
+
+        Returns:
+            int: Number of new entries.
+        """
+        with self._lock:
+            directory = self._directories.setdefault(url, _Directory())
+
+            start = 0
+            if directory.last_href is not None:
+                start = max(text.find(directory.last_href), 0)
+
+            n_new = 0
+            for href in extract_hrefs(text[start:]):
+                if not href.endswith(self.suffix) or href in directory.seen:
+                    continue
+                directory.seen.add(href)
+                directory.last_href = href
+                try:
+                    this_time = self.parse_time(href)
+                except (AttributeError, ValueError):
+                    continue
+                i = bisect.bisect_right(directory.times, this_time)
+                directory.times.insert(i, this_time)
+                directory.urls.insert(i, urljoin(url, href))
+                n_new += 1
+
+            return n_new
+
+    def entries(self, url: str, start: datetime, end: datetime) -> List[Tuple[datetime, str]]:
+        """
+        Return the (start time, absolute url) of entries with start < time <= end.
+        """
+        with self._lock:
+            directory = self._directories.get(url)
+            if directory is None:
+                return []
+            lo = bisect.bisect_right(directory.times, start)
+            hi = bisect.bisect_right(directory.times, end)
+            return list(zip(directory.times[lo:hi], directory.urls[lo:hi]))
+
+    def retain(self, urls) -> List[str]:
+        """
+        Forget every directory not in `urls`.
+
+        Returns:
+            list: The urls that were dropped.
+        """
+        with self._lock:
+            dropped = [url for url in self._directories.keys() if url not in urls]
+            for url in dropped:
+                del self._directories[url]
+            return dropped
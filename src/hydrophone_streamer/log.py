@@ -0,0 +1,69 @@
+"""
+log.py
+
+Logging setup shared by the command line entry points.
+
+Modules log through `logging.getLogger(__name__)`, and the streaming classes
+attach their station and network to every record. With `log_format=json` each
+record is written as one JSON object per line, including those fields, so logs
+can be filtered per station.
+"""
+
+
+import json
+import logging
+from datetime import datetime, timezone
+
+
+TEXT_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+# attributes every LogRecord has, anything else was passed through `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None)).keys()) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Format records as single line JSON objects.
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {'time': datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+                 'level': record.levelname,
+                 'logger': record.name,
+                 'message': record.getMessage()}
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level: str = 'INFO', fmt: str = 'text') -> None:
+    """
+    Set the level and format of the root logger.
+
+    Handlers installed by hydra (console and the run's log file) are kept and only
+    get the new formatter; a console handler is added if there are none.
+
+    Args:
+        level (str): Name of the minimum level, i.e. 'DEBUG'.
+        fmt (str): 'text' or 'json'.
+    """
+    assert fmt in ('text', 'json'), f"Unsupported log format: {fmt}"
+    root = logging.getLogger()
+    root.setLevel(level.upper())
+    if len(root.handlers) == 0:
+        root.addHandler(logging.StreamHandler())
+
+    formatter = JsonFormatter() if fmt == 'json' else logging.Formatter(TEXT_FORMAT)
+    for handler in root.handlers:
+        handler.setFormatter(formatter)
+
+
+class StationLogger(logging.LoggerAdapter):
+    """
+    Prefix messages with the station name and attach the station and network to the record.
+    """
+    def process(self, msg, kwargs):
+        kwargs['extra'] = {**self.extra, **kwargs.get('extra', {})}
+        return f"[{self.extra['station']}] {msg}", kwargs
@@ -0,0 +1,298 @@
+"""
+metrics.py
+
+In-process metrics with a Prometheus text exporter.
+
+The hot paths record into the module level registry: histograms of the time
+spent in every stage of a poll, counters for bytes, segments, retries and
+skipped files, and gauges for the data latency (wall clock minus the end of the
+newest segment) and the backlog of segments still to be written. The registry
+is exposed over HTTP (`start_http_server`) or written periodically to a file in
+the Prometheus text format (`start_file_exporter`), i.e. for node_exporter's
+textfile collector.
+
+    from hydrophone_streamer.metrics import STAGE_SECONDS
+
+    with STAGE_SECONDS.time(station='ooi_stream', stage='listing'):
+        fetch_listing()
+"""
+
+
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Sequence, Tuple
+
+from hydrophone_streamer.notifications import write_atomic
+
+
+# seconds, from a cached listing up to the catch-up of a long outage
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        assert set(labels.keys()) == set(self.labelnames), f"{self.name} takes the labels {self.labelnames}, got {tuple(labels.keys())}"
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: Tuple[str, ...], extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if len(pairs) == 0:
+            return ''
+        return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+    def _samples(self):
+        """
+        Yield (suffix, label string, value) for every series.
+        """
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield '', self._labels(key), value
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        for suffix, labels, value in self._samples():
+            lines.append(f'{self.name}{suffix}{labels} {_format_value(value)}')
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    """
+    A value that only goes up, i.e. bytes downloaded.
+    """
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        assert amount >= 0, "counters can only be incremented"
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    """
+    A value that goes up and down, i.e. the backlog of segments.
+    """
+    type = 'gauge'
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def get(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class _HistogramValue:
+    def __init__(self, n_buckets: int) -> None:
+        self.counts = [0] * n_buckets # not cumulative, the bucket each observation fell in
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observations in fixed buckets, i.e. stage durations.
+    """
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = _HistogramValue(len(self.buckets))
+            series.counts[i] += 1
+            series.sum += value
+            series.count += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observe the wall time of the block, also when it raises.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def get(self, **labels) -> Tuple[int, float]:
+        """
+        (count, sum) of the observations of a series.
+        """
+        with self._lock:
+            series = self._values.get(self._key(labels))
+            if series is None:
+                return 0, 0.0
+            return series.count, series.sum
+
+    def _samples(self):
+        with self._lock:
+            items = [(key, list(series.counts), series.sum, series.count) for key, series in self._values.items()]
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                yield '_bucket', self._labels(key, (('le', _format_value(bound)),)), cumulative
+            yield '_sum', self._labels(key), total
+            yield '_count', self._labels(key), count
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        """
+        A named collection of metrics rendered together.
+        """
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name: str, documentation: str, labelnames: Sequence[str], **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            assert isinstance(metric, cls) and metric.labelnames == tuple(labelnames), f"metric {name} is already registered differently"
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self) -> str:
+        """
+        Every metric in the Prometheus text exposition format.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.histogram('hydrophone_stage_seconds', 'Time spent in each stage of a poll.', ('station', 'stage'))
+SEGMENTS = REGISTRY.counter('hydrophone_segments_total', 'Segments written to the archive.', ('station',))
+DOWNLOADED_BYTES = REGISTRY.counter('hydrophone_downloaded_bytes_total', 'Bytes of segment data downloaded.', ('station',))
+SKIPPED_FILES = REGISTRY.counter('hydrophone_skipped_files_total', 'Remote files that were not downloaded.', ('station', 'reason'))
+SEGMENT_ERRORS = REGISTRY.counter('hydrophone_segment_errors_total', 'Segments that failed to download or transcode.', ('station',))
+POLL_ERRORS = REGISTRY.counter('hydrophone_poll_errors_total', 'Polls that raised.', ('station',))
+RETRIES = REGISTRY.counter('hydrophone_download_retries_total', 'Interrupted downloads that were resumed.', ('host',))
+LISTING_REQUESTS = REGISTRY.counter('hydrophone_listing_requests_total', 'Directory listing requests by outcome.', ('host', 'outcome'))
+DATA_LATENCY = REGISTRY.gauge('hydrophone_data_latency_seconds', 'Wall clock minus the end of the newest segment.', ('station',))
+BACKLOG = REGISTRY.gauge('hydrophone_backlog_segments', 'Segments found upstream but not yet written.', ('station',))
+LAST_POLL = REGISTRY.gauge('hydrophone_last_poll_timestamp_seconds', 'Unix time the last poll finished.', ('station',))
+STATION_RESTARTS = REGISTRY.counter('hydrophone_station_restarts_total', 'Stations torn down by the supervisor after a failure.', ('station',))
+UPLOADED_BYTES = REGISTRY.counter('hydrophone_uploaded_bytes_total', 'Bytes written to output sinks.', ('station',))
+UPLOAD_ERRORS = REGISTRY.counter('hydrophone_upload_errors_total', 'Uploads that failed after their retries.', ('station',))
+UPLOAD_QUEUE = REGISTRY.gauge('hydrophone_upload_queue_files', 'Files waiting for an upload worker.', ('station',))
+SPOOLED_FILES = REGISTRY.gauge('hydrophone_spooled_files', 'Files spooled locally until the output store is reachable.', ('station',))
+LEASES_HELD = REGISTRY.gauge('hydrophone_leases_held', 'Stations whose lease this worker holds.', ('worker',))
+LEASE_CHANGES = REGISTRY.counter('hydrophone_lease_changes_total', 'Station leases acquired, released or lost by this worker.', ('station', 'change'))
+
+
+def start_http_server(port: int, addr: str = '', registry: MetricsRegistry = REGISTRY) -> ThreadingHTTPServer:
+    """
+    Serve the registry at http://addr:port/metrics from a daemon thread.
+
+    Returns:
+        ThreadingHTTPServer: Call .shutdown() to stop it.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args) -> None:
+            pass
+
+        def do_GET(self) -> None:
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((addr, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def write_metrics(path: str, registry: MetricsRegistry = REGISTRY) -> None:
+    """
+    Replace `path` with the current metrics, atomically.
+    """
+    write_atomic(path, registry.render())
+
+
+def start_file_exporter(path: str, interval: float = 15, registry: MetricsRegistry = REGISTRY) -> threading.Thread:
+    """
+    Rewrite `path` with the current metrics every `interval` seconds from a daemon thread.
+    """
+    def run() -> None:
+        while True:
+            write_metrics(path, registry)
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, daemon=True, name='metrics-file-exporter')
+    thread.start()
+    return thread
+
+
+def start_exporters(port: Optional[int] = None, path: Optional[str] = None, interval: float = 15) -> None:
+    """
+    Start whichever exporters are configured, none by default.
+    """
+    if port is not None:
+        start_http_server(port)
+    if path is not None:
+        start_file_exporter(path, interval=interval)
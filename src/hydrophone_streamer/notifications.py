@@ -0,0 +1,227 @@
+"""
+notifications.py
+
+Push based notification of new segments.
+
+Every new segment is appended to `segments.jsonl` in the save_dir with a sequence
+number, latest.txt is replaced atomically (write then rename), and any process
+following the save_dir is woken up through a Unix datagram socket. Consumers use
+`follow(save_dir)` instead of polling latest.txt:
+
+    from hydrophone_streamer.notifications import follow
+
+    for segment in follow('/data/ooi_stream', cursor=last_seq):
+        process(segment['path'])
+        last_seq = segment['seq']
+"""
+
+
+import errno
+import glob
+import hashlib
+import json
+import os
+import select
+import socket
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Iterator, Optional
+
+
+FEED_FILENAME = 'segments.jsonl'
+LATEST_FILENAME = 'latest.txt'
+
+
+def write_atomic(path: str, text: str) -> None:
+    """
+    Replace the content of a file so readers see either the old or the new text, never a mix.
+    """
+    directory = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def write_latest(save_dir: str, filename: str) -> None:
+    """
+    Atomically point latest.txt at a segment in the save_dir.
+    """
+    write_atomic(os.path.join(save_dir, LATEST_FILENAME), os.path.basename(filename))
+
+
+def _socket_dir(save_dir: str) -> str:
+    """
+    Directory holding the sockets of the followers of a save_dir. It lives in the
+    temp dir, keyed on the save_dir, since socket paths are limited to ~100 bytes.
+    """
+    key = hashlib.sha1(os.path.realpath(save_dir).encode()).hexdigest()[:12]
+    return os.path.join(tempfile.gettempdir(), f'hydrophone_streamer-{key}')
+
+
+def _has_unix_sockets() -> bool:
+    return hasattr(socket, 'AF_UNIX')
+
+
+class SegmentFeed:
+    def __init__(self, save_dir: str) -> None:
+        """
+        Append-only feed of the segments written to a save_dir.
+
+        Args:
+            save_dir (str): Directory holding the segments and the feed.
+        """
+        self.save_dir = save_dir
+        self.path = os.path.join(save_dir, FEED_FILENAME)
+        self._lock = threading.Lock()
+        self.seq = self._last_seq()
+
+    def _last_seq(self) -> int:
+        """
+        Sequence number of the last entry in the feed, read from its tail.
+        """
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return 0
+        with open(self.path, 'rb') as f:
+            f.seek(max(os.path.getsize(self.path) - 4096, 0))
+            lines = [line for line in f.read().splitlines() if line.strip()]
+        for line in reversed(lines):
+            try:
+                return json.loads(line)['seq']
+            except (ValueError, KeyError):
+                continue
+        return 0
+
+    def publish(self, filename: str, start_time: datetime, duration: Optional[float] = None) -> dict:
+        """
+        Append a new segment to the feed and wake up the followers.
+
+        Returns:
+            dict: The feed entry.
+        """
+        with self._lock:
+            self.seq += 1
+            entry = {'seq': self.seq,
+                     'file': os.path.basename(filename),
+                     'start_time': start_time.isoformat(),
+                     'duration': duration,
+                     'published': datetime.now(timezone.utc).isoformat()}
+            line = json.dumps(entry) + '\n'
+            with open(self.path, 'a') as f:
+                f.write(line)
+                f.flush()
+
+        self._notify(line.encode())
+        return entry
+
+    def _notify(self, payload: bytes) -> None:
+        """
+        Send the entry to every follower socket, removing the ones nobody listens on.
+        """
+        if not _has_unix_sockets():
+            return
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.setblocking(False)
+            for path in glob.glob(os.path.join(_socket_dir(self.save_dir), '*.sock')):
+                try:
+                    sock.sendto(payload, path)
+                except (ConnectionRefusedError, FileNotFoundError):
+                    # follower exited without cleaning up
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                except OSError as e:
+                    if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.ENOBUFS):
+                        raise
+                    # follower is behind, it re-reads the feed anyway
+
+
+def _open_listener(save_dir: str):
+    if not _has_unix_sockets():
+        return None, None
+    directory = _socket_dir(save_dir)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{os.getpid()}-{threading.get_ident()}-{time.monotonic_ns()}.sock')
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.bind(path)
+    sock.setblocking(False)
+    return sock, path
+
+
+def follow(save_dir: str,
+           cursor: int = 0,
+           timeout: Optional[float] = None,
+           poll_interval: float = 5.0,
+           ) -> Iterator[dict]:
+    """
+    Yield every segment published to a save_dir after `cursor`, as it arrives.
+
+    The generator wakes up as soon as the streamer publishes a segment (through a
+    Unix datagram socket) and falls back to re-reading the feed every
+    `poll_interval` seconds, so no segment is ever missed.
+
+    Args:
+        save_dir (str): Directory the streamer writes to.
+        cursor (int): Sequence number of the last segment already processed, 0 for all of them.
+        timeout (float, optional): Stop after this many seconds without a new segment.
+        poll_interval (float): Seconds between feed re-reads when no notification arrives.
+
+    Yields:
+        dict: Feed entries with 'seq', 'file', 'path', 'start_time', 'duration' and 'published'.
+    """
+    feed_path = os.path.join(save_dir, FEED_FILENAME)
+    sock, sock_path = _open_listener(save_dir)
+    offset = 0
+    last_activity = time.monotonic()
+    try:
+        while True:
+            # read whatever was appended since the last pass
+            if os.path.exists(feed_path):
+                with open(feed_path, 'r') as f:
+                    f.seek(offset)
+                    while True:
+                        line = f.readline()
+                        if not line.endswith('\n'):
+                            break # partial line, picked up on the next pass
+                        offset = f.tell()
+                        entry = json.loads(line)
+                        if entry['seq'] <= cursor:
+                            continue
+                        cursor = entry['seq']
+                        entry['path'] = os.path.join(save_dir, entry['file'])
+                        last_activity = time.monotonic()
+                        yield entry
+
+            wait = poll_interval
+            if timeout is not None:
+                remaining = timeout - (time.monotonic() - last_activity)
+                if remaining <= 0:
+                    return
+                wait = min(wait, remaining)
+
+            if sock is None:
+                time.sleep(wait)
+                continue
+            readable, _, _ = select.select([sock], [], [], wait)
+            if readable:
+                # drain, the payloads are only a wake-up call
+                try:
+                    while True:
+                        sock.recv(65536)
+                except BlockingIOError:
+                    pass
+    finally:
+        if sock is not None:
+            sock.close()
+            if os.path.exists(sock_path):
+                os.remove(sock_path)
@@ -0,0 +1,237 @@
+"""
+pipeline.py
+
+Staged download -> transcode pipeline.
+
+Downloads run on a thread pool and feed a process pool of transcoding workers, so
+network I/O, decoding and encoding overlap and use every core. A semaphore bounds
+the number of segments in flight (downloaded but not yet transcoded) to keep disk
+and memory use flat, and results are handed back in submission order so segments
+are still registered in time order. Once the consumer stops (i.e. it raised, or
+the poll lost its lease) no new download or transcode is started.
+
+The transcoding process pool is shared by every station in the process.
+"""
+
+
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import CancelledError, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Iterator, Optional, Tuple
+
+
+_transcode_pool = None
+_transcode_pool_lock = threading.Lock()
+
+
+def get_transcode_pool(max_workers: Optional[int] = None) -> ProcessPoolExecutor:
+    """
+    Return the process wide transcoding pool, creating it on first use.
+
+    Workers are spawned rather than forked since the parent runs many threads.
+
+    Args:
+        max_workers (int, optional): Number of worker processes, defaults to the number of cores.
+    """
+    global _transcode_pool
+    with _transcode_pool_lock:
+        if _transcode_pool is None:
+            _transcode_pool = ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(),
+                                                  mp_context=multiprocessing.get_context('spawn'))
+        return _transcode_pool
+
+
+def _timed(function: Callable, *args) -> Tuple[Any, float]:
+    """
+    Run `function` in a worker process and report how long it took there.
+    """
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+class StageStats:
+    def __init__(self, name: str) -> None:
+        """
+        Throughput counters of one pipeline stage.
+        """
+        self.name = name
+        self.items = 0
+        self.bytes = 0
+        self.busy = 0.0 # seconds spent working, summed over workers
+        self._lock = threading.Lock()
+
+    def add(self, elapsed: float, n_bytes: int = 0) -> None:
+        with self._lock:
+            self.items += 1
+            self.bytes += n_bytes
+            self.busy += elapsed
+
+    def report(self, wall: float) -> dict:
+        with self._lock:
+            return {'stage': self.name,
+                    'items': self.items,
+                    'items_per_s': self.items / wall if wall > 0 else None,
+                    'mb_per_s': self.bytes / 1e6 / wall if wall > 0 else None,
+                    'busy_s': self.busy}
+
+
+class SegmentPipeline:
+    def __init__(self,
+                 download: Callable[[Any], Optional[str]],
+                 transcode: Callable[[str], Any],
+                 download_workers: int = 4,
+                 transcode_workers: Optional[int] = None,
+                 max_pending: int = 8,
+                 check: Optional[Callable[[], None]] = None,
+                 ) -> None:
+        """
+        Args:
+            download (Callable): Called with a job on a download thread, returns the local path
+                to transcode or None to skip the job. Any other value is taken as the finished
+                result, i.e. a segment transcoded while it was downloaded, and skips the transcode.
+            transcode (Callable): Called with the local path in a worker process. Must be picklable
+                (a module level function or a functools.partial of one).
+            download_workers (int): Concurrent downloads.
+            transcode_workers (int, optional): Size of the shared transcoding pool, defaults to the number of cores.
+            max_pending (int): Segments allowed in flight between the start of their download and the end of their transcode.
+            check (Callable, optional): Called before a transcode writes its file, raises to refuse
+                it (i.e. BaseStreamingClass._check_fence). The error is the result of that job.
+        """
+        self.download = download
+        self.transcode = transcode
+        self.download_workers = download_workers
+        self.transcode_workers = transcode_workers
+        self.max_pending = max(max_pending, 1)
+        self.check = check
+        self.stats = {}
+        self._start = None
+
+    def _chain(self,
+               job,
+               slots: threading.BoundedSemaphore,
+               downloads: ThreadPoolExecutor,
+               stop: threading.Event,
+               transcodes: list,
+               ) -> Future:
+        """
+        Start the download of a job and queue its transcode once it is on disk.
+        """
+        result = Future()
+        n_bytes = [0] # size of the downloaded file, counted by both stages
+
+        def finish(value=None, error=None) -> None:
+            slots.release()
+            if error is not None:
+                result.set_exception(error)
+            else:
+                result.set_result(value)
+
+        def on_transcoded(future: Future) -> None:
+            try:
+                value, elapsed = future.result()
+            except BaseException as e:
+                finish(error=e)
+                return
+            self.stats['transcode'].add(elapsed, n_bytes[0])
+            finish(value)
+
+        def on_downloaded(future: Future) -> None:
+            try:
+                path = future.result()
+            except BaseException as e:
+                finish(error=e)
+                return
+            if not isinstance(path, str):
+                finish(path)
+                return
+            try:
+                if stop.is_set():
+                    raise CancelledError()
+                if self.check is not None:
+                    self.check()
+                transcode = get_transcode_pool(self.transcode_workers).submit(_timed, self.transcode, path)
+            except BaseException as e:
+                # i.e. the pool broke because a worker died
+                finish(error=e)
+                return
+            transcodes.append(transcode)
+            transcode.add_done_callback(on_transcoded)
+
+        def download(job):
+            if stop.is_set():
+                raise CancelledError()
+            start = time.perf_counter()
+            path = self.download(job)
+            if isinstance(path, str):
+                n_bytes[0] = os.path.getsize(path)
+                self.stats['download'].add(time.perf_counter() - start, n_bytes[0])
+            return path
+
+        downloads.submit(download, job).add_done_callback(on_downloaded)
+        return result
+
+    def run(self, jobs: Iterable[Any]) -> Iterator[Tuple[Any, Future]]:
+        """
+        Push jobs through the pipeline.
+
+        Yields:
+            tuple: (job, future holding the transcode result, None if the job was skipped),
+                in the order the jobs were given, each once it has completed.
+
+        If the consumer stops early (it raised, or closed the generator), the jobs not
+        started yet are dropped and queued transcodes are cancelled; downloads and
+        transcodes already running finish on their own.
+        """
+        jobs = list(jobs)
+        self.stats = {'download': StageStats('download'), 'transcode': StageStats('transcode')}
+        self._start = time.perf_counter()
+
+        slots = threading.BoundedSemaphore(self.max_pending)
+        ordered = queue.Queue()
+        stop = threading.Event()
+        transcodes = []
+
+        downloads = ThreadPoolExecutor(max_workers=self.download_workers)
+
+        def feed() -> None:
+            for job in jobs:
+                # backpressure: wait for a segment to leave the pipeline
+                while not slots.acquire(timeout=0.1):
+                    if stop.is_set():
+                        return
+                if stop.is_set():
+                    slots.release()
+                    return
+                try:
+                    future = self._chain(job, slots, downloads, stop, transcodes)
+                except BaseException as e:
+                    slots.release()
+                    future = Future()
+                    future.set_exception(e)
+                ordered.put((job, future))
+
+        feeder = threading.Thread(target=feed, daemon=True)
+        feeder.start()
+        try:
+            for _ in range(len(jobs)):
+                job, future = ordered.get()
+                future.exception() # wait for it
+                yield job, future
+        finally:
+            stop.set()
+            feeder.join()
+            downloads.shutdown(wait=True, cancel_futures=True)
+            for transcode in transcodes:
+                transcode.cancel()
+
+    def report(self) -> list:
+        """
+        Per stage throughput of the last run.
+        """
+        wall = time.perf_counter() - self._start if self._start is not None else 0
+        return [stats.report(wall) for stats in self.stats.values()]
+
@@ -0,0 +1,100 @@
+"""
+registry.py
+
+Registry of the hydrophone networks the streamer can stream from.
+
+Networks are discovered through the `hydrophone_streamer.networks` entry point
+group, so another package can add one without touching this repository:
+
+    [project.entry-points."hydrophone_streamer.networks"]
+    mynetwork = "my_package.streaming:MyStreamingClass"
+
+Only the name and import path of every network are read up front; the module of
+a network, and with it dependencies such as obspy or the ONC client, is imported
+the first time that network is selected.
+"""
+
+
+import importlib
+import logging
+import threading
+from typing import Dict, List, Union
+
+
+logger = logging.getLogger(__name__)
+
+ENTRY_POINT_GROUP = 'hydrophone_streamer.networks'
+
+# also available when the package runs from a source checkout without being installed
+BUILTIN_NETWORKS = {
+    'ooi': 'hydrophone_streamer.supported_classes.ooi_streaming_class:OOIStreamingClass',
+    'ooi_async': 'hydrophone_streamer.supported_classes.ooi_streaming_class:AsyncOOIStreamingClass',
+    'onc': 'hydrophone_streamer.supported_classes.onc_streaming_class:ONCStreamingClass',
+    'orcasound': 'hydrophone_streamer.supported_classes.orcasound_streaming_class:OrcasoundStreamingClass',
+}
+
+_targets: Dict[str, Union[str, type]] = {}
+_classes: Dict[str, type] = {}
+_discovered = False
+_lock = threading.Lock()
+
+
+def _discover() -> None:
+    """
+    Read the entry points once, installed plugins override the built-in networks.
+    """
+    global _discovered
+    if _discovered:
+        return
+    from importlib.metadata import entry_points
+
+    targets = dict(BUILTIN_NETWORKS)
+    for entry_point in entry_points(group=ENTRY_POINT_GROUP):
+        targets[entry_point.name] = entry_point.value
+    for name, target in targets.items():
+        _targets.setdefault(name, target)
+    _discovered = True
+
+
+def register_network(name: str, target: Union[str, type]) -> None:
+    """
+    Add a network at runtime, i.e. from a script or a benchmark.
+
+    Args:
+        name (str): The value of hydrophone_network that selects it.
+        target (Union[str, type]): The streaming class, or its 'module:ClassName' path.
+    """
+    with _lock:
+        _targets[name] = target
+        _classes.pop(name, None)
+
+
+def available_networks() -> List[str]:
+    """
+    Names of every registered network, without importing any of them.
+    """
+    with _lock:
+        _discover()
+        return sorted(_targets.keys())
+
+
+def get_network_class(name: str) -> type:
+    """
+    The streaming class of a network, imported on first use.
+
+    Raises:
+        ValueError: If no network of that name is registered.
+    """
+    with _lock:
+        if name in _classes:
+            return _classes[name]
+        _discover()
+        if name not in _targets:
+            raise ValueError(f"Unsupported network type: {name}, choose one of {sorted(_targets.keys())}")
+        target = _targets[name]
+        if isinstance(target, str):
+            module_name, _, attribute = target.partition(':')
+            logger.debug('importing the %s network from %s', name, target)
+            target = getattr(importlib.import_module(module_name), attribute)
+        _classes[name] = target
+        return target
@@ -0,0 +1,134 @@
+"""
+retention.py
+
+Quota based retention for rolling archives.
+
+Segments are evicted oldest first straight from the segment index (ordered on
+start time), so enforcing a limit never rescans the save directory. The segment
+latest.txt points at is never deleted. The continuous archive and the spectrogram
+pyramid then drop what they hold from before the oldest segment that is left.
+"""
+
+
+import heapq
+import os
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, List, Optional, Tuple
+
+from hydrophone_streamer.segment_index import Segment, SegmentIndex
+
+
+@dataclass
+class RetentionPolicy:
+    """
+    Limits on an archive. A limit of None is not enforced.
+    """
+    max_age_days: Optional[float] = None
+    max_bytes: Optional[int] = None
+    max_files: Optional[int] = None
+
+    @classmethod
+    def from_config(cls, config) -> 'RetentionPolicy':
+        if config is None:
+            return cls()
+        if isinstance(config, RetentionPolicy):
+            return config
+        return cls(**dict(config))
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_age_days is not None or self.max_bytes is not None or self.max_files is not None
+
+
+def _delete(index: SegmentIndex, segment: Segment) -> None:
+    path = os.path.join(index.save_dir, segment.filename)
+    if os.path.exists(path):
+        os.remove(path)
+    index.remove(segment.filename)
+
+
+def _oldest_first(i: int, index: SegmentIndex) -> Iterable[Tuple[datetime, int, Segment]]:
+    # a function rather than a generator expression, so each stream keeps its own archive number
+    return ((segment.start_time, i, segment) for segment in index.iter_oldest())
+
+
+def _over_quota(policy: RetentionPolicy, segment: Segment, n_files: int, n_bytes: int, cutoff: Optional[datetime]) -> bool:
+    if policy.max_files is not None and n_files > policy.max_files:
+        return True
+    if policy.max_bytes is not None and n_bytes > policy.max_bytes:
+        return True
+    if cutoff is not None and segment.start_time < cutoff:
+        return True
+    return False
+
+
+def enforce_retention(archives: Iterable[Tuple[SegmentIndex, Optional[str]]],
+                      policy: RetentionPolicy,
+                      now: Optional[datetime] = None,
+                      ) -> List[str]:
+    """
+    Delete the oldest segments across one or more archives until `policy` holds.
+
+    With several archives the limits apply to their combined size and file count,
+    and the globally oldest segment is evicted first.
+
+    Args:
+        archives (Iterable[Tuple[SegmentIndex, Optional[str]]]): (segment index, protected file name) pairs.
+            The protected file (i.e. the target of latest.txt) is never deleted.
+        policy (RetentionPolicy): Limits to enforce.
+        now (datetime, optional): Current time, defaults to utc now.
+
+    Returns:
+        List[str]: Paths of the deleted segments.
+    """
+    archives = list(archives)
+    if not policy.enabled or len(archives) == 0:
+        return []
+
+    if now is None:
+        now = datetime.now(timezone.utc)
+    cutoff = now - timedelta(days=policy.max_age_days) if policy.max_age_days is not None else None
+
+    n_files = sum(len(index) for index, _ in archives)
+    n_bytes = sum(index.total_size() for index, _ in archives)
+
+    # merge the per archive oldest-first streams
+    streams = [_oldest_first(i, index) for i, (index, _) in enumerate(archives)]
+
+    removed = []
+    for start_time, i, segment in heapq.merge(*streams):
+        if not _over_quota(policy, segment, n_files, n_bytes, cutoff):
+            break
+        index, protected = archives[i]
+        if protected is not None and segment.filename == os.path.basename(protected):
+            continue
+        _delete(index, segment)
+        n_files -= 1
+        n_bytes -= segment.size or 0
+        removed.append(os.path.join(index.save_dir, segment.filename))
+
+    return removed
+
+
+def prune_sample_sinks(index: SegmentIndex, sinks: Iterable) -> List[str]:
+    """
+    Drop what the sample sinks of a station (i.e. the continuous archive and the
+    spectrogram pyramid) hold from before the oldest segment left in its index.
+
+    Args:
+        index (SegmentIndex): Segment index of the station, after enforce_retention.
+        sinks (Iterable): Sample sinks of the station, those without a `prune` method are skipped.
+
+    Returns:
+        List[str]: Paths of the deleted files.
+    """
+    oldest = index.oldest()
+    if len(oldest) == 0:
+        return []
+    removed = []
+    for sink in sinks:
+        prune = getattr(sink, 'prune', None)
+        if prune is not None:
+            removed.extend(prune(oldest[0].start_time))
+    return removed
@@ -0,0 +1,232 @@
+"""
+ring_buffer.py
+
+Shared memory PCM ring buffer.
+
+The streamer writes the decoded samples of every new segment into a fixed size
+np.memmap file next to the FLACs, so downstream detectors can take zero-copy views
+of the most recent audio instead of decoding the FLAC files again. Samples are
+stored as float32 scaled like soundfile decodes the FLAC (full scale = 1.0).
+
+Layout of the file:
+    header      magic, version, sample rate, capacity, write head, block count
+    block table (first sample index, unix timestamp) of the last `max_blocks` writes
+    data        `capacity` float32 samples, indexed by (sample index % capacity)
+
+The write head counts every sample ever written and is only advanced once the
+samples and their block entry are in place, so a reader that sees a head value
+can safely read the samples before it.
+
+    from hydrophone_streamer.ring_buffer import RingBufferReader
+
+    reader = RingBufferReader('/data/ooi_stream/ring.pcm')
+    samples, start_time = reader.last(30) # the last 30 seconds
+"""
+
+
+import os
+from datetime import datetime, timezone
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+
+RING_FILENAME = 'ring.pcm'
+MAGIC = 0x48535242 # 'HSRB'
+VERSION = 1
+
+HEADER_DTYPE = np.dtype([('magic', '<u4'),
+                         ('version', '<u4'),
+                         ('sample_rate', '<f8'),
+                         ('capacity', '<u8'),
+                         ('write_head', '<u8'),
+                         ('max_blocks', '<u8'),
+                         ('block_head', '<u8')])
+HEADER_SIZE = 64
+BLOCK_DTYPE = np.dtype([('sample_index', '<u8'), ('timestamp', '<f8')])
+SAMPLE_DTYPE = np.dtype('<f4')
+
+
+def pcm_to_float(samples: np.ndarray) -> np.ndarray:
+    """
+    Scale integer PCM to float32 in [-1, 1), the way soundfile decodes the FLAC written by the transcoder.
+    """
+    samples = np.asarray(samples)
+    if samples.dtype == np.int16:
+        return samples.astype(np.float32) / 2 ** 15
+    if np.issubdtype(samples.dtype, np.integer):
+        return samples.astype(np.float32) / 2 ** 31
+    return samples.astype(np.float32, copy=False)
+
+
+class _RingFile:
+    def __init__(self, path: str, mode: str) -> None:
+        header = np.memmap(path, dtype=HEADER_DTYPE, mode='r', shape=(1,))
+        if header['magic'][0] != MAGIC or header['version'][0] != VERSION:
+            raise ValueError(f"{path} is not a ring buffer")
+        capacity = int(header['capacity'][0])
+        max_blocks = int(header['max_blocks'][0])
+        del header
+
+        self.path = path
+        self.header = np.memmap(path, dtype=HEADER_DTYPE, mode=mode, shape=(1,))
+        self.blocks = np.memmap(path, dtype=BLOCK_DTYPE, mode=mode, offset=HEADER_SIZE, shape=(max_blocks,))
+        self.data = np.memmap(path, dtype=SAMPLE_DTYPE, mode=mode,
+                              offset=HEADER_SIZE + max_blocks * BLOCK_DTYPE.itemsize, shape=(capacity,))
+
+    @property
+    def sample_rate(self) -> float:
+        return float(self.header['sample_rate'][0])
+
+    @property
+    def capacity(self) -> int:
+        return int(self.header['capacity'][0])
+
+    @property
+    def write_head(self) -> int:
+        return int(self.header['write_head'][0])
+
+
+def create_ring_buffer(path: str, sample_rate: float, seconds: float, max_blocks: int = 4096) -> None:
+    """
+    Create an empty ring buffer file holding `seconds` of audio.
+    """
+    capacity = int(round(sample_rate * seconds))
+    size = HEADER_SIZE + max_blocks * BLOCK_DTYPE.itemsize + capacity * SAMPLE_DTYPE.itemsize
+    tmp_path = path + '.part'
+    with open(tmp_path, 'wb') as f:
+        f.truncate(size)
+    header = np.memmap(tmp_path, dtype=HEADER_DTYPE, mode='r+', shape=(1,))
+    header[0] = (MAGIC, VERSION, sample_rate, capacity, 0, max_blocks, 0)
+    header.flush()
+    del header
+    os.replace(tmp_path, path)
+
+
+class PCMRingBuffer:
+    def __init__(self, save_dir: str, seconds: float = 600, filename: str = RING_FILENAME) -> None:
+        """
+        Writer side of the ring buffer of a station.
+
+        The file is created on the first write, once the sample rate is known, and
+        recreated if the sample rate changes.
+
+        Args:
+            save_dir (str): Directory of the station.
+            seconds (float): Seconds of audio kept in the buffer.
+            filename (str): Name of the ring buffer file inside save_dir.
+        """
+        self.path = os.path.join(save_dir, filename)
+        self.seconds = seconds
+        self._ring = None
+
+    def _open(self, sample_rate: float) -> _RingFile:
+        if self._ring is None and os.path.exists(self.path):
+            try:
+                self._ring = _RingFile(self.path, mode='r+')
+            except ValueError:
+                self._ring = None
+        if self._ring is None or self._ring.sample_rate != sample_rate or self._ring.capacity != int(round(sample_rate * self.seconds)):
+            self._ring = None
+            create_ring_buffer(self.path, sample_rate, self.seconds)
+            self._ring = _RingFile(self.path, mode='r+')
+        return self._ring
+
+    def write(self, samples: np.ndarray, sample_rate: float, start_time: datetime, gaps: Sequence[Tuple[int, int]] = ()) -> None:
+        """
+        Append the samples of a segment.
+
+        Args:
+            samples (np.ndarray): PCM samples, integer or float.
+            sample_rate (float): Sampling rate in Hz.
+            start_time (datetime): Time of the first sample.
+            gaps (Sequence[Tuple[int, int]]): (first, end) samples with no data. The ring
+                buffer is contiguous, so they are kept as the zeros the decoder wrote.
+        """
+        ring = self._open(sample_rate)
+        samples = pcm_to_float(samples)
+        capacity = ring.capacity
+        if len(samples) > capacity:
+            # only the tail fits
+            start_time = datetime.fromtimestamp(start_time.timestamp() + (len(samples) - capacity) / sample_rate, tz=timezone.utc)
+            samples = samples[-capacity:]
+
+        head = ring.write_head
+        position = head % capacity
+        first = min(len(samples), capacity - position)
+        ring.data[position:position + first] = samples[:first]
+        ring.data[:len(samples) - first] = samples[first:]
+
+        block_head = int(ring.header['block_head'][0])
+        ring.blocks[block_head % len(ring.blocks)] = (head, start_time.timestamp())
+        ring.header['block_head'] = block_head + 1
+
+        # publish last, readers only look below the write head
+        ring.header['write_head'] = head + len(samples)
+
+
+class RingBufferReader:
+    def __init__(self, path: str) -> None:
+        """
+        Reader side of a ring buffer, any number of processes can open the same file.
+
+        Args:
+            path (str): Path to ring.pcm, or to the save_dir holding it.
+        """
+        if os.path.isdir(path):
+            path = os.path.join(path, RING_FILENAME)
+        self._ring = _RingFile(path, mode='r')
+
+    @property
+    def sample_rate(self) -> float:
+        return self._ring.sample_rate
+
+    @property
+    def write_head(self) -> int:
+        """
+        Total number of samples written so far.
+        """
+        return self._ring.write_head
+
+    def time_of(self, sample_index: int) -> Optional[datetime]:
+        """
+        Timestamp of an absolute sample index, from the closest preceding block.
+        """
+        blocks = self._ring.blocks
+        n_blocks = min(int(self._ring.header['block_head'][0]), len(blocks))
+        if n_blocks == 0:
+            return None
+        valid = blocks[:n_blocks]
+        before = valid[valid['sample_index'] <= sample_index]
+        if len(before) == 0:
+            return None
+        block = before[np.argmax(before['sample_index'])]
+        return datetime.fromtimestamp(block['timestamp'] + (sample_index - int(block['sample_index'])) / self.sample_rate, tz=timezone.utc)
+
+    def read(self, start_index: int, n_samples: int) -> np.ndarray:
+        """
+        Samples [start_index, start_index + n_samples) by absolute index.
+
+        Returns a zero-copy view when the range does not wrap around the end of the
+        buffer, a copy otherwise.
+        """
+        capacity = self._ring.capacity
+        head = self.write_head
+        if start_index < max(head - capacity, 0) or start_index + n_samples > head:
+            raise IndexError(f"samples {start_index}:{start_index + n_samples} are not in the buffer (head {head})")
+        position = start_index % capacity
+        if position + n_samples <= capacity:
+            return self._ring.data[position:position + n_samples]
+        return np.concatenate([self._ring.data[position:], self._ring.data[:position + n_samples - capacity]])
+
+    def last(self, seconds: float) -> Tuple[np.ndarray, Optional[datetime]]:
+        """
+        The most recent `seconds` of audio (or as much as the buffer holds).
+
+        Returns:
+            tuple: (samples, time of the first sample)
+        """
+        head = self.write_head
+        n_samples = min(int(round(seconds * self.sample_rate)), head, self._ring.capacity)
+        start_index = head - n_samples
+        return self.read(start_index, n_samples), self.time_of(start_index)
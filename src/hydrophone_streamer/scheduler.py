@@ -0,0 +1,169 @@
+"""
+scheduler.py
+
+Cadence-aware polling.
+
+Hydrophone networks publish fixed length segments at a steady cadence and with a
+roughly constant lag. PollScheduler learns both from the segments a station has
+fetched, sleeps until the next segment should appear, polls quickly around that
+time and backs off exponentially (with jitter) on errors or when data stops
+arriving.
+"""
+
+
+import random
+import statistics
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Optional
+
+
+class PollScheduler:
+    def __init__(self,
+                 default_interval: float = 10,
+                 min_interval: float = 2,
+                 max_interval: float = 300,
+                 fast_window: float = 60,
+                 max_backoff: float = 600,
+                 jitter: float = 0.1,
+                 history: int = 64,
+                 ) -> None:
+        """
+        Args:
+            default_interval (float): Seconds between polls until the cadence is known.
+            min_interval (float): Seconds between polls around the predicted arrival.
+            max_interval (float): Longest sleep while waiting for overdue data.
+            fast_window (float): Seconds after the predicted arrival during which polls use min_interval.
+            max_backoff (float): Longest sleep after consecutive errors.
+            jitter (float): Relative jitter applied to every back-off.
+            history (int): Number of segments remembered to estimate the cadence and lag.
+        """
+        self.default_interval = default_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.fast_window = fast_window
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+
+        self.start_times = deque(maxlen=history) # sorted segment start times
+        self.lags = deque(maxlen=history) # seconds between a segment start and the moment we saw it
+        self.errors = 0
+        self.empty_polls = 0
+        self.last_delay = None
+
+    def seed(self, start_times: Iterable[datetime]) -> None:
+        """
+        Prime the cadence estimate with start times of segments already on disk.
+        """
+        for start_time in sorted(start_times):
+            self.start_times.append(start_time)
+
+    def observe(self, start_times: Iterable[datetime], now: Optional[datetime] = None) -> None:
+        """
+        Record the start times of the segments fetched by one poll.
+
+        Only the newest segment of a poll contributes to the lag, older ones in the
+        same batch are catch-up and say nothing about the publishing delay.
+        """
+        start_times = sorted(start_times)
+        if len(start_times) == 0:
+            return
+        if now is None:
+            now = datetime.now(timezone.utc)
+
+        for start_time in start_times:
+            if len(self.start_times) == 0 or start_time > self.start_times[-1]:
+                self.start_times.append(start_time)
+        self.lags.append((now - start_times[-1]).total_seconds())
+
+    @property
+    def cadence(self) -> Optional[float]:
+        """
+        Median seconds between consecutive segments, None until two segments are known.
+        """
+        times = list(self.start_times)
+        steps = [(b - a).total_seconds() for a, b in zip(times[:-1], times[1:]) if b > a]
+        if len(steps) == 0:
+            return None
+        return statistics.median(steps)
+
+    @property
+    def lag(self) -> Optional[float]:
+        """
+        Median seconds between a segment start and its arrival, None until one arrival was seen.
+        """
+        if len(self.lags) == 0:
+            return None
+        return statistics.median(self.lags)
+
+    def next_arrival(self) -> Optional[datetime]:
+        """
+        Predicted wall clock time of the next segment.
+        """
+        if self.cadence is None or self.lag is None:
+            return None
+        return self.start_times[-1] + timedelta(seconds=self.cadence + self.lag)
+
+    def _jittered(self, delay: float) -> float:
+        return delay * (1 + self.jitter * random.uniform(-1, 1))
+
+    def next_delay(self, n_fetched: int, error: bool = False, now: Optional[datetime] = None) -> float:
+        """
+        Seconds to sleep before the next poll.
+
+        Args:
+            n_fetched (int): Number of segments the last poll fetched.
+            error (bool): Whether the last poll failed.
+            now (datetime, optional): Current time, for testing.
+
+        Returns:
+            float: Delay in seconds.
+        """
+        if now is None:
+            now = datetime.now(timezone.utc)
+
+        if error:
+            self.errors += 1
+            delay = self._jittered(min(self.default_interval * 2 ** (self.errors - 1), self.max_backoff))
+        elif n_fetched > 0:
+            # more may be waiting while catching up
+            self.errors = 0
+            self.empty_polls = 0
+            delay = 0
+        else:
+            self.errors = 0
+            self.empty_polls += 1
+            next_arrival = self.next_arrival()
+            if next_arrival is None:
+                delay = self.default_interval
+            else:
+                until = (next_arrival - now).total_seconds()
+                if until > self.min_interval:
+                    # sleep until the segment is due
+                    delay = until
+                elif until > -self.fast_window:
+                    # due now, poll quickly
+                    delay = self.min_interval
+                else:
+                    # overdue, the source may be down
+                    overdue = min(int(-until // self.fast_window), 16)
+                    delay = self._jittered(min(self.min_interval * 2 ** overdue, self.max_interval))
+
+        self.last_delay = delay
+        return delay
+
+    def predictions(self) -> dict:
+        """
+        The current model of the station, for monitoring.
+        """
+        next_arrival = self.next_arrival()
+        return {
+            'cadence_s': self.cadence,
+            'lag_s': self.lag,
+            'last_segment': self.start_times[-1].isoformat() if len(self.start_times) > 0 else None,
+            'next_arrival': next_arrival.isoformat() if next_arrival is not None else None,
+            'next_delay_s': self.last_delay,
+            'consecutive_errors': self.errors,
+            'empty_polls': self.empty_polls,
+            'updated': datetime.now(timezone.utc).isoformat(),
+        }
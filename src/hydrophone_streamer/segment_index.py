@@ -0,0 +1,188 @@
+"""
+segment_index.py
+
+Persistent index of the segments downloaded into a save_dir.
+
+The index lives next to the audio in `segments.sqlite` and is keyed on the file
+name with a b-tree on the segment start time, so the newest-file lookup and the
+already-downloaded check no longer glob and regex the whole archive every poll.
+"""
+
+
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from typing import Callable, Iterable, Iterator, List, NamedTuple, Optional
+
+
+INDEX_FILENAME = 'segments.sqlite'
+
+
+class Segment(NamedTuple):
+    filename: str # base name inside save_dir
+    start_time: datetime
+    duration: Optional[float]
+    size: Optional[int]
+    network: Optional[str]
+
+
+def _to_timestamp(time: datetime) -> float:
+    if time.tzinfo is None:
+        time = time.replace(tzinfo=timezone.utc)
+    return time.timestamp()
+
+
+def _to_segment(row) -> Segment:
+    filename, start_time, duration, size, network = row
+    return Segment(filename, datetime.fromtimestamp(start_time, tz=timezone.utc), duration, size, network)
+
+
+class SegmentIndex:
+    def __init__(self, save_dir: str, network: Optional[str] = None, filename: str = INDEX_FILENAME) -> None:
+        """
+        Open (or create) the segment index of a save directory.
+
+        Args:
+            save_dir (str): Directory holding the downloaded segments.
+            network (str, optional): Hydrophone network recorded with new segments.
+            filename (str): Name of the SQLite file inside save_dir.
+        """
+        self.save_dir = save_dir
+        self.network = network
+        self.path = os.path.join(save_dir, filename)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS segments (
+                                filename TEXT PRIMARY KEY,
+                                start_time REAL NOT NULL,
+                                duration REAL,
+                                size INTEGER,
+                                network TEXT)""")
+        self._conn.execute('CREATE INDEX IF NOT EXISTS segments_start_time ON segments (start_time, filename)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+
+    def _key(self, path: str) -> str:
+        return os.path.basename(path)
+
+    def _execute(self, query: str, parameters: tuple = ()) -> list:
+        with self._lock:
+            return self._conn.execute(query, parameters).fetchall()
+
+    @property
+    def needs_rebuild(self) -> bool:
+        """
+        True until the index has been populated from the files already on disk.
+        """
+        return len(self._execute("SELECT value FROM meta WHERE key = 'rebuilt'")) == 0
+
+    def add(self,
+            path: str,
+            start_time: datetime,
+            duration: Optional[float] = None,
+            size: Optional[int] = None,
+            network: Optional[str] = None,
+            ) -> None:
+        """
+        Record a downloaded segment, replacing any previous entry for the same file.
+        """
+        if size is None and os.path.exists(os.path.join(self.save_dir, self._key(path))):
+            size = os.path.getsize(os.path.join(self.save_dir, self._key(path)))
+        self._execute('INSERT OR REPLACE INTO segments VALUES (?, ?, ?, ?, ?)',
+                      (self._key(path), _to_timestamp(start_time), duration, size, network or self.network))
+
+    def remove(self, path: str) -> None:
+        """
+        Drop a segment from the index.
+        """
+        self._execute('DELETE FROM segments WHERE filename = ?', (self._key(path),))
+
+    def contains(self, path: str) -> bool:
+        """
+        Check whether a segment has already been downloaded.
+        """
+        return len(self._execute('SELECT 1 FROM segments WHERE filename = ?', (self._key(path),))) > 0
+
+    def get(self, path: str) -> Optional[Segment]:
+        rows = self._execute('SELECT * FROM segments WHERE filename = ?', (self._key(path),))
+        return _to_segment(rows[0]) if rows else None
+
+    def latest(self) -> Optional[Segment]:
+        """
+        Return the segment with the most recent start time.
+        """
+        rows = self._execute('SELECT * FROM segments ORDER BY start_time DESC LIMIT 1')
+        return _to_segment(rows[0]) if rows else None
+
+    def newest(self, limit: int = 1) -> List[Segment]:
+        """
+        Return up to `limit` segments, newest first.
+        """
+        return [_to_segment(row) for row in self._execute('SELECT * FROM segments ORDER BY start_time DESC LIMIT ?', (limit,))]
+
+    def oldest(self, limit: int = 1) -> List[Segment]:
+        """
+        Return up to `limit` segments, oldest first.
+        """
+        return [_to_segment(row) for row in self._execute('SELECT * FROM segments ORDER BY start_time ASC LIMIT ?', (limit,))]
+
+    def iter_oldest(self, batch_size: int = 256) -> Iterator[Segment]:
+        """
+        Iterate over every segment, oldest first.
+
+        Rows are read in batches so segments can be removed while iterating.
+        """
+        last = (float('-inf'), '')
+        while True:
+            rows = self._execute('SELECT * FROM segments WHERE (start_time, filename) > (?, ?) ORDER BY start_time, filename LIMIT ?',
+                                 (last[0], last[1], batch_size))
+            for row in rows:
+                yield _to_segment(row)
+            if len(rows) < batch_size:
+                return
+            last = (rows[-1][1], rows[-1][0])
+
+    def __len__(self) -> int:
+        return self._execute('SELECT COUNT(*) FROM segments')[0][0]
+
+    def total_size(self) -> int:
+        """
+        Total size in bytes of the indexed segments.
+        """
+        return self._execute('SELECT COALESCE(SUM(size), 0) FROM segments')[0][0]
+
+    def rebuild(self, paths: Iterable[str], parse_time: Callable[[str], datetime]) -> int:
+        """
+        Populate the index from files already on disk. Files whose name does not
+        carry a timestamp are skipped.
+
+        Args:
+            paths (Iterable[str]): Segment files to index.
+            parse_time (Callable[[str], datetime]): Extracts the start time from a file name.
+
+        Returns:
+            int: Number of segments indexed.
+        """
+        rows = []
+        for path in paths:
+            try:
+                start_time = parse_time(path)
+            except (AttributeError, ValueError):
+                continue
+            rows.append((self._key(path), _to_timestamp(start_time), None,
+                         os.path.getsize(os.path.join(self.save_dir, self._key(path))), self.network))
+
+        with self._lock:
+            self._conn.execute('BEGIN')
+            self._conn.executemany('INSERT OR REPLACE INTO segments VALUES (?, ?, ?, ?, ?)', rows)
+            self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('rebuilt', ?)", (datetime.now(timezone.utc).isoformat(),))
+            self._conn.execute('COMMIT')
+
+        return len(rows)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
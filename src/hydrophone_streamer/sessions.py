@@ -0,0 +1,93 @@
+"""
+sessions.py
+
+Shared HTTP plumbing: one keep-alive requests.Session per process and a per-host
+limit on the number of concurrent requests.
+"""
+
+
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+DEFAULT_POOL_SIZE = 32
+
+_session = None
+_host_limiter = None
+_session_lock = threading.Lock()
+
+
+def get_session(pool_size: int = DEFAULT_POOL_SIZE) -> requests.Session:
+    """
+    Return the process wide keep-alive session, creating it on first use.
+
+    Args:
+        pool_size (int): Maximum number of pooled connections per host.
+
+    Returns:
+        requests.Session: Session shared by every streaming class in the process.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _session = session
+        return _session
+
+
+class HostLimiter:
+    def __init__(self, max_per_host: int = 4) -> None:
+        """
+        Bound the number of in-flight requests to any one host.
+
+        Args:
+            max_per_host (int): Concurrent requests allowed per host.
+        """
+        self.max_per_host = max_per_host
+        self._in_flight = {} # host -> requests holding a slot
+        self._condition = threading.Condition()
+
+    def restrict(self, max_per_host: int) -> None:
+        """
+        Lower the limit to `max_per_host` if it is tighter, requests in flight keep their slots.
+        """
+        with self._condition:
+            self.max_per_host = min(self.max_per_host, max_per_host)
+
+    @contextmanager
+    def limit(self, url: str):
+        """
+        Hold a slot for the host of `url` for the duration of the block.
+        """
+        host = urlparse(url).netloc
+        with self._condition:
+            self._condition.wait_for(lambda: self._in_flight.get(host, 0) < self.max_per_host)
+            self._in_flight[host] = self._in_flight.get(host, 0) + 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._in_flight[host] -= 1
+                self._condition.notify_all()
+
+
+def get_host_limiter(max_per_host: int = 4) -> HostLimiter:
+    """
+    Return the process wide per-host limiter, creating it on first use.
+
+    Every station shares the slots of a host. When stations ask for different
+    limits, the smallest one holds for the whole process.
+    """
+    global _host_limiter
+    with _session_lock:
+        if _host_limiter is None:
+            _host_limiter = HostLimiter(max_per_host)
+        _host_limiter.restrict(max_per_host)
+        return _host_limiter
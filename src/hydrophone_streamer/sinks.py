@@ -0,0 +1,478 @@
+"""
+sinks.py
+
+Output sinks: where the files of a station go besides its save_dir.
+
+Every segment registered by a streaming class, latest.txt and reference.bib are
+handed to the output sinks of the station, configured with the `output` option:
+
+    output: {type: s3, bucket: hydrophones, prefix: raw, endpoint_url: http://minio:9000}
+
+S3Sink uploads to S3 compatible storage (AWS, MinIO, Ceph) from a bounded queue
+on a few threads, large files as concurrent multipart uploads. Failed uploads are
+retried with back-off and, when a `spool_dir` is set, parked there until the store
+is reachable again, so a storage outage never stalls or loses the stream. Keys
+are `<prefix>/<station>/<file name>`.
+
+With keep_local=False the segments are removed from the save_dir once they are
+uploaded, except the one latest.txt names. They stay in the segment index, which
+records what was fetched so it is not fetched again, so local retention limits
+cannot be combined with it.
+"""
+
+
+import importlib
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+from typing import List, Optional
+
+from hydrophone_streamer.metrics import SPOOLED_FILES, UPLOAD_ERRORS, UPLOAD_QUEUE, UPLOADED_BYTES
+from hydrophone_streamer.notifications import LATEST_FILENAME
+
+
+logger = logging.getLogger(__name__)
+
+# `type` of an output -> 'module:Class', other types can be given as 'module:Class' directly
+SINK_TYPES = {
+    's3': 'hydrophone_streamer.sinks:S3Sink',
+}
+
+CONTENT_TYPES = {
+    '.flac': 'audio/flac',
+    '.wav': 'audio/wav',
+    '.mseed': 'application/vnd.fdsn.mseed',
+    '.txt': 'text/plain',
+    '.bib': 'application/x-bibtex',
+    '.json': 'application/json',
+}
+
+# files removed from the save_dir after the upload with keep_local=False, reference.bib and the like stay
+SEGMENT_EXTENSIONS = ('.flac', '.wav', '.mseed')
+
+
+class OutputSink:
+    """
+    Destination for the files of one station. Methods may return before the file
+    has arrived; `flush` waits for everything handed over so far.
+    """
+    def put_file(self, path: str, after: Optional[str] = None) -> None:
+        """
+        Copy a finished file, under its base name.
+
+        Args:
+            path (str): The local file.
+            after (str, optional): Name of an earlier file that must arrive first.
+        """
+        raise NotImplementedError("This method should be implemented in the subclass.")
+
+    def put_text(self, name: str, text: str, after: Optional[str] = None) -> None:
+        """
+        Write a small text file, i.e. the latest.txt pointer.
+
+        Args:
+            name (str): File name.
+            text (str): Content.
+            after (str, optional): Name of an earlier file that must arrive first,
+                i.e. the segment a pointer points at.
+        """
+        raise NotImplementedError("This method should be implemented in the subclass.")
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until everything handed over has been written or spooled, returns False on timeout.
+        """
+        return True
+
+    def close(self) -> None:
+        """
+        Flush and stop the sink.
+        """
+        self.flush()
+
+
+class _Item:
+    __slots__ = ('name', 'path', 'text', 'version', 'order')
+
+    def __init__(self, name: str, path: Optional[str] = None, text: Optional[str] = None) -> None:
+        self.name = name
+        self.path = path # local file to upload, or None for text
+        self.text = text
+        self.version = 0 # order of submission among the items of the same name
+        self.order = 0 # order of submission among every item
+
+
+class S3Sink(OutputSink):
+    def __init__(self,
+                 bucket: str,
+                 station: str,
+                 prefix: str = '',
+                 endpoint_url: Optional[str] = None,
+                 region_name: Optional[str] = None,
+                 workers: int = 4,
+                 max_queue: int = 64,
+                 multipart_threshold: int = 8 << 20,
+                 multipart_chunksize: int = 8 << 20,
+                 max_concurrency: int = 4,
+                 retries: int = 5,
+                 retry_delay: float = 1,
+                 spool_dir: Optional[str] = None,
+                 spool_interval: float = 30,
+                 keep_local: bool = True,
+                 client=None,
+                 ) -> None:
+        """
+        Upload the files of a station to an S3 bucket.
+
+        Args:
+            bucket (str): Bucket name.
+            station (str): Name of the station, the second level of the keys.
+            prefix (str): Top level of the keys.
+            endpoint_url (str, optional): i.e. http://localhost:9000 for MinIO, defaults to AWS.
+            region_name (str, optional): Region of the bucket. Credentials come from the usual
+                boto3 sources (environment, ~/.aws, instance role).
+            workers (int): Files uploaded at the same time.
+            max_queue (int): Files waiting for a worker before put_file blocks the caller.
+            multipart_threshold (int): Files of this many bytes or more are uploaded in parts.
+            multipart_chunksize (int): Size of a part.
+            max_concurrency (int): Parts of one file uploaded at the same time.
+            retries (int): Attempts after the first failure before a file is spooled or dropped.
+            retry_delay (float): Seconds before the first retry, doubled on every attempt.
+            spool_dir (str, optional): Where files that could not be uploaded wait for the store
+                to come back, kept across restarts. None drops them after the retries (the local
+                copy stays).
+            spool_interval (float): Seconds between two attempts to drain the spool.
+            keep_local (bool): Keep segments in the save_dir after they are uploaded. If False,
+                the segment latest.txt names is still kept until latest.txt moves on.
+            client (botocore.client.S3, optional): Client to use instead of creating one.
+        """
+        if client is None:
+            import boto3
+            from botocore.config import Config
+
+            # retries are handled here, so a dead endpoint is noticed quickly
+            client = boto3.client('s3', endpoint_url=endpoint_url, region_name=region_name,
+                                  config=Config(retries={'max_attempts': 2, 'mode': 'standard'},
+                                                connect_timeout=10, read_timeout=60,
+                                                max_pool_connections=workers * max_concurrency))
+        from boto3.s3.transfer import TransferConfig
+
+        self.client = client
+        self.bucket = bucket
+        self.station = station
+        self.prefix = prefix.strip('/')
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.spool_dir = spool_dir
+        self.spool_interval = spool_interval
+        self.keep_local = keep_local
+        self.transfer_config = TransferConfig(multipart_threshold=multipart_threshold,
+                                              multipart_chunksize=multipart_chunksize,
+                                              max_concurrency=max_concurrency,
+                                              use_threads=True)
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._pending = {} # name -> items queued or uploading under that name
+        self._deferred = {} # name -> items waiting for it to arrive
+        self._versions = {} # name -> version of the newest item submitted
+        self._written = {} # name -> version of the newest item uploaded or spooled
+        self._name_locks = {} # name -> lock held while an item of that name is written
+        self._unreachable_until = 0.0 # while the store is down new files are spooled right away
+        self._submitted = 0 # items submitted so far
+        self._latest = None # (name latest.txt points at, order of that latest.txt)
+        self._held = {} # name -> (path, order) of uploaded segments kept locally for latest.txt
+        self._stop_event = threading.Event()
+
+        if self.spool_dir is not None:
+            os.makedirs(self.spool_dir, exist_ok=True)
+            SPOOLED_FILES.set(len(self._spooled()), station=self.station)
+
+        self._workers = [threading.Thread(target=self._work, name=f'upload-{station}-{i}', daemon=True) for i in range(workers)]
+        for worker in self._workers:
+            worker.start()
+        self._drainer = None
+        if self.spool_dir is not None:
+            self._drainer = threading.Thread(target=self._drain_spool, name=f'upload-spool-{station}', daemon=True)
+            self._drainer.start()
+
+    def key(self, name: str) -> str:
+        """
+        Object key of a file of the station.
+        """
+        return '/'.join(part for part in (self.prefix, self.station, name) if part)
+
+    def put_file(self, path: str, after: Optional[str] = None) -> None:
+        self._submit(_Item(os.path.basename(path), path=path), after)
+
+    def put_text(self, name: str, text: str, after: Optional[str] = None) -> None:
+        self._submit(_Item(name, text=text), after)
+
+    def _submit(self, item: _Item, after: Optional[str]) -> None:
+        with self._lock:
+            self._pending[item.name] = self._pending.get(item.name, 0) + 1
+            item.version = self._versions[item.name] = self._versions.get(item.name, 0) + 1
+            self._submitted += 1
+            item.order = self._submitted
+            if item.name == LATEST_FILENAME and item.text is not None:
+                self._latest = (item.text.strip(), item.order)
+            self._name_locks.setdefault(item.name, threading.RLock())
+            deferred = after is not None and self._pending.get(after, 0) > 0
+            if deferred:
+                # queued once `after` has been uploaded or spooled
+                self._deferred.setdefault(after, []).append(item)
+        if item.name == LATEST_FILENAME:
+            # it names a newer segment, the ones uploaded before it can go
+            self._release_held()
+        if deferred:
+            return
+        if after is not None and self.spool_dir is not None and os.path.exists(self._spool_path(after)):
+            # goes up behind it when the spool drains
+            self._spool(item)
+            self._done(item, spooled=True)
+            return
+        self._enqueue(item)
+
+    def _enqueue(self, item: _Item) -> None:
+        self._queue.put(item) # blocks while the queue is full, which holds back the poll
+        UPLOAD_QUEUE.set(self._queue.qsize(), station=self.station)
+
+    def _done(self, item: _Item, spooled: bool) -> None:
+        """
+        Release the items waiting for `item`; they follow it into the spool if it was spooled.
+        """
+        with self._lock:
+            self._pending[item.name] -= 1
+            if self._pending[item.name] == 0:
+                del self._pending[item.name]
+                for state in (self._versions, self._written, self._name_locks):
+                    state.pop(item.name, None)
+            waiting = self._deferred.pop(item.name, []) if item.name not in self._pending else []
+        for follower in waiting:
+            if spooled:
+                self._spool(follower)
+                self._done(follower, spooled=True)
+            else:
+                # on this worker, putting it back on a full queue could block every worker
+                self._process(follower)
+
+    def _superseded(self, item: _Item) -> bool:
+        """
+        True if a newer item of the same name was already written, i.e. an older latest.txt.
+        """
+        with self._lock:
+            return self._written.get(item.name, 0) > item.version
+
+    def _mark_written(self, item: _Item) -> None:
+        with self._lock:
+            if item.name in self._written or item.name in self._pending:
+                self._written[item.name] = max(self._written.get(item.name, 0), item.version)
+
+    def _upload(self, item: _Item) -> int:
+        key = self.key(item.name)
+        content_type = CONTENT_TYPES.get(os.path.splitext(item.name)[1], 'application/octet-stream')
+        if item.path is not None:
+            n_bytes = os.path.getsize(item.path)
+            # multipart with parts sent in parallel above the threshold
+            self.client.upload_file(item.path, self.bucket, key, Config=self.transfer_config,
+                                    ExtraArgs={'ContentType': content_type})
+        else:
+            body = item.text.encode()
+            n_bytes = len(body)
+            self.client.put_object(Bucket=self.bucket, Key=key, Body=body, ContentType=content_type)
+        UPLOADED_BYTES.inc(n_bytes, station=self.station)
+        return n_bytes
+
+    def _upload_with_retries(self, item: _Item) -> bool:
+        attempt = 0
+        while True:
+            if self.spool_dir is not None and time.monotonic() < self._unreachable_until:
+                return False
+            try:
+                self._upload(item)
+                self._unreachable_until = 0.0
+                return True
+            except Exception as e:
+                if attempt >= self.retries or self._stop_event.is_set():
+                    UPLOAD_ERRORS.inc(station=self.station)
+                    logger.warning('upload of %s to s3://%s failed after %d attempts: %r', item.name, self.bucket, attempt + 1, e)
+                    self._unreachable_until = time.monotonic() + self.spool_interval
+                    return False
+                logger.debug('upload of %s failed (%r), retrying in %.0fs', item.name, e, self.retry_delay * 2 ** attempt)
+                time.sleep(self.retry_delay * 2 ** attempt)
+                attempt += 1
+
+    def _process(self, item: _Item) -> None:
+        """
+        Upload an item, or spool it if the store cannot be reached.
+        """
+        uploaded = True
+        # items of the same name are written one at a time and never replaced by older ones
+        with self._name_locks[item.name]:
+            if not self._superseded(item):
+                uploaded = self._upload_with_retries(item)
+                if uploaded:
+                    self._mark_written(item)
+                    # a newer copy went up, the spooled one is stale
+                    self._unspool(item.name)
+                    self._remove_local(item)
+                else:
+                    self._spool(item)
+        self._done(item, spooled=not uploaded)
+
+    def _remove_local(self, item: _Item) -> None:
+        """
+        With keep_local=False, remove an uploaded or spooled segment from the save_dir, or
+        hold it while latest.txt names it or may still name it.
+        """
+        if self.keep_local or item.path is None or not item.name.endswith(SEGMENT_EXTENSIONS):
+            return
+        with self._lock:
+            # segments submitted after the newest latest.txt may be the next one it names
+            if self._latest is None or self._latest[0] == item.name or item.order > self._latest[1]:
+                self._held[item.name] = (item.path, item.order)
+                return
+        if os.path.exists(item.path):
+            os.remove(item.path)
+
+    def _release_held(self, keep_newer: bool = True) -> None:
+        """
+        Remove the held segments latest.txt no longer names.
+
+        Args:
+            keep_newer (bool): Keep the segments submitted after the newest latest.txt.
+        """
+        with self._lock:
+            name, order = self._latest if self._latest is not None else (None, 0)
+            released = [held for held in self._held if held != name and not (keep_newer and self._held[held][1] > order)]
+            paths = [self._held.pop(held)[0] for held in released]
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _work(self) -> None:
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                self._process(item)
+            except Exception as e:
+                logger.exception('upload worker of %s failed on %s: %r', self.station, item.name, e)
+            finally:
+                self._queue.task_done()
+                UPLOAD_QUEUE.set(self._queue.qsize(), station=self.station)
+
+    def _spool_path(self, name: str) -> str:
+        return os.path.join(self.spool_dir, name)
+
+    def _spool(self, item: _Item) -> None:
+        """
+        Park an item in the spool directory, replacing an older copy under the same name.
+        """
+        if self.spool_dir is None or self._superseded(item):
+            return
+        target = self._spool_path(item.name)
+        tmp_path = target + '.tmp'
+        if item.path is not None:
+            try:
+                # same file system as the save_dir in the usual setup, no copy needed
+                os.link(item.path, tmp_path)
+            except OSError:
+                shutil.copyfile(item.path, tmp_path)
+        else:
+            with open(tmp_path, 'w') as f:
+                f.write(item.text)
+        os.replace(tmp_path, target)
+        self._mark_written(item)
+        self._remove_local(item)
+        SPOOLED_FILES.set(len(self._spooled()), station=self.station)
+
+    def _unspool(self, name: str) -> None:
+        if self.spool_dir is not None and os.path.exists(self._spool_path(name)):
+            os.remove(self._spool_path(name))
+            SPOOLED_FILES.set(len(self._spooled()), station=self.station)
+
+    def _spooled(self) -> List[str]:
+        """
+        Names in the spool, oldest first (by the time they were spooled).
+        """
+        entries = [entry for entry in os.scandir(self.spool_dir) if entry.is_file() and not entry.name.endswith('.tmp')]
+        return [entry.name for entry in sorted(entries, key=lambda entry: entry.stat().st_ctime)]
+
+    def _drain_spool(self) -> None:
+        """
+        Upload the spooled files in the order they were spooled once the store answers again.
+        """
+        while not self._stop_event.wait(self.spool_interval):
+            for name in self._spooled():
+                if self._stop_event.is_set():
+                    return
+                with self._lock:
+                    if name in self._pending:
+                        # a newer copy is on its way
+                        continue
+                path = self._spool_path(name)
+                try:
+                    self._upload(_Item(name, path=path))
+                except FileNotFoundError:
+                    continue
+                except Exception as e:
+                    logger.debug('store still unreachable (%r), %s stays spooled', e, name)
+                    break
+                self._unreachable_until = 0.0
+                self._unspool(name)
+                logger.info('uploaded spooled %s', name)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks > 0:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def close(self) -> None:
+        self.flush()
+        self._release_held(keep_newer=False)
+        self._stop_event.set()
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        if self._drainer is not None:
+            self._drainer.join()
+
+
+def build_output_sinks(config, save_dir: str, station: str) -> List[OutputSink]:
+    """
+    Output sinks from the `output` option: one sink configuration or a list of them.
+
+    Args:
+        config (Union[dict, list]): Each with a `type` ('s3', or 'module:Class' of an OutputSink)
+            and the arguments of that class. A relative `spool_dir` is taken inside the save_dir.
+        save_dir (str): Directory of the station.
+        station (str): Name of the station.
+    """
+    if config is None:
+        return []
+    if isinstance(config, dict):
+        config = [config]
+
+    sinks = []
+    for options in config:
+        options = dict(options)
+        sink_type = options.pop('type', 's3')
+        target = SINK_TYPES.get(sink_type, sink_type)
+        assert ':' in target, f"Unknown output type: {sink_type}, choose one of {sorted(SINK_TYPES)} or give 'module:Class'"
+        module_name, _, attribute = target.partition(':')
+        sink_class = getattr(importlib.import_module(module_name), attribute)
+        if options.get('spool_dir') is not None and not os.path.isabs(options['spool_dir']):
+            options['spool_dir'] = os.path.join(save_dir, options['spool_dir'])
+        sinks.append(sink_class(station=station, **options))
+    return sinks
@@ -0,0 +1,283 @@
+"""
+spectrogram.py
+
+Ingest-time spectrogram pyramid.
+
+While the decoded samples of a segment are in memory, the power spectral density
+is computed once with a batched STFT and averaged into fixed time bins at several
+resolutions (by default 1 s, 1 min and 10 min). Every level is stored per UTC day
+in `<save_dir>/spectrogram/<level>s/YYYY-MM-DD.f16` as a (bins per day, frequencies)
+float16 array of dB re 1 (full scale)^2/Hz, next to a count of the STFT frames
+averaged into every bin. The row of a bin follows from its time, so rendering a
+day or a month is a memory-mapped slice of the coarsest level that is detailed
+enough, instead of decoding the audio again.
+
+    from hydrophone_streamer.spectrogram import SpectrogramReader
+
+    spec = SpectrogramReader('/data/ooi_stream').read('2025-05-01', '2025-06-01')
+    spec.values, spec.times, spec.frequencies # NaN where nothing was recorded
+"""
+
+
+import json
+import os
+from datetime import date, datetime, timedelta, timezone
+from typing import List, NamedTuple, Sequence, Tuple, Union
+
+import numpy as np
+
+from hydrophone_streamer.notifications import write_atomic
+from hydrophone_streamer.ring_buffer import pcm_to_float
+
+
+SPECTROGRAM_DIRNAME = 'spectrogram'
+META_FILENAME = 'meta.json'
+VALUE_DTYPE = np.dtype('<f2')
+COUNT_DTYPE = np.dtype('<u4')
+DAY_SECONDS = 86400
+BATCH_FRAMES = 2048 # STFT frames transformed at once, bounds the memory of long segments
+
+
+class Spectrogram(NamedTuple):
+    values: np.ndarray # (times, frequencies) float16 dB re 1/Hz, NaN where nothing was recorded
+    times: np.ndarray # datetime64[ms] start of every bin
+    frequencies: np.ndarray # Hz
+    level: int # seconds per bin
+
+
+def _utc(time: Union[str, datetime]) -> datetime:
+    if not isinstance(time, datetime):
+        time = datetime.fromisoformat(str(time).replace('Z', '+00:00'))
+    if time.tzinfo is None:
+        time = time.replace(tzinfo=timezone.utc)
+    return time
+
+
+def _midnight(day: date) -> float:
+    return datetime.combine(day, datetime.min.time(), tzinfo=timezone.utc).timestamp()
+
+
+def stft_power(samples: np.ndarray, sample_rate: float, nfft: int, hop: int) -> np.ndarray:
+    """
+    One-sided power spectral density of every STFT frame, Hann windowed.
+
+    Frames are strided views of `samples` and are transformed BATCH_FRAMES at a time.
+
+    Returns:
+        np.ndarray: (frames, nfft // 2 + 1) float32 in (full scale)^2/Hz.
+    """
+    samples = pcm_to_float(samples)
+    if len(samples) < nfft:
+        return np.zeros((0, nfft // 2 + 1), dtype=np.float32)
+    frames = np.lib.stride_tricks.sliding_window_view(samples, nfft)[::hop]
+    window = np.hanning(nfft).astype(np.float32)
+    scale = np.float32(2 / (sample_rate * np.sum(window ** 2)))
+
+    power = np.empty((len(frames), nfft // 2 + 1), dtype=np.float32)
+    for start in range(0, len(frames), BATCH_FRAMES):
+        batch = frames[start:start + BATCH_FRAMES]
+        spectrum = np.fft.rfft((batch - batch.mean(axis=1, keepdims=True)) * window, axis=1)
+        power[start:start + len(batch)] = spectrum.real ** 2 + spectrum.imag ** 2
+    power *= scale
+    # DC and Nyquist are not doubled in a one-sided spectrum
+    power[:, 0] /= 2
+    if nfft % 2 == 0:
+        power[:, -1] /= 2
+    return power
+
+
+class SpectrogramPyramid:
+    def __init__(self,
+                 save_dir: str,
+                 nfft: int = 1024,
+                 hop: int = None,
+                 levels: Sequence[int] = (1, 60, 600),
+                 ) -> None:
+        """
+        Spectrogram pyramid of one station, usable as a sample sink.
+
+        The FFT length, hop and levels are fixed by the first write and kept in
+        spectrogram/meta.json, later instances use the stored ones.
+
+        Args:
+            save_dir (str): Directory of the station, the pyramid lives in save_dir/spectrogram.
+            nfft (int): FFT length in samples.
+            hop (int): Samples between STFT frames, defaults to nfft (no overlap).
+            levels (Sequence[int]): Bin lengths in seconds, each must divide a day.
+        """
+        for level in levels:
+            assert DAY_SECONDS % level == 0, f"spectrogram level {level} s does not divide a day"
+        self.path = os.path.join(save_dir, SPECTROGRAM_DIRNAME)
+        self.meta_path = os.path.join(self.path, META_FILENAME)
+        os.makedirs(self.path, exist_ok=True)
+        self.meta = _read_meta(self.meta_path)
+        if self.meta is None:
+            self.meta = {'nfft': int(nfft), 'hop': int(hop or nfft), 'levels': sorted(int(level) for level in levels), 'sample_rate': None}
+
+    def write(self, samples: np.ndarray, sample_rate: float, start_time: datetime, gaps: Sequence[Tuple[int, int]] = ()) -> None:
+        """
+        Add the spectra of a segment to every level of the pyramid.
+
+        Args:
+            samples (np.ndarray): PCM samples, integer or float.
+            sample_rate (float): Sampling rate in Hz.
+            start_time (datetime): Time of the first sample.
+            gaps (Sequence[Tuple[int, int]]): (first, end) samples the decoder filled with
+                zeros. Frames touching them are left out, so the bins stay unrecorded.
+        """
+        if self.meta['sample_rate'] is None:
+            self.meta['sample_rate'] = float(sample_rate)
+            write_atomic(self.meta_path, json.dumps(self.meta))
+        elif self.meta['sample_rate'] != float(sample_rate):
+            raise ValueError(f"spectrogram of {self.path} is at {self.meta['sample_rate']} Hz, got samples at {sample_rate} Hz")
+
+        nfft, hop = self.meta['nfft'], self.meta['hop']
+        power = stft_power(samples, sample_rate, nfft, hop)
+        frame_starts = np.arange(len(power)) * hop
+        if len(gaps) > 0:
+            recorded = np.ones(len(power), dtype=bool)
+            for first, end in gaps:
+                recorded &= (frame_starts + nfft <= first) | (frame_starts >= end)
+            power, frame_starts = power[recorded], frame_starts[recorded]
+        if len(power) == 0:
+            return
+        # every frame is binned by its centre
+        centres = _utc(start_time).timestamp() + (frame_starts + nfft / 2) / sample_rate
+        for level in self.meta['levels']:
+            self._add(level, np.floor(centres / level).astype(np.int64), power)
+
+    def _add(self, level: int, bins: np.ndarray, power: np.ndarray) -> None:
+        # frames are in time order, so each bin is a contiguous run of frames
+        starts = np.flatnonzero(np.r_[True, bins[1:] != bins[:-1]])
+        sums = np.add.reduceat(power, starts, axis=0)
+        counts = np.diff(np.r_[starts, len(bins)]).astype(COUNT_DTYPE)
+        unique_bins = bins[starts]
+
+        rows_per_day = DAY_SECONDS // level
+        days = unique_bins // rows_per_day
+        for day_number in np.unique(days):
+            in_day = days == day_number
+            rows = unique_bins[in_day] - day_number * rows_per_day
+            day = date(1970, 1, 1) + timedelta(days=int(day_number))
+            values, stored_counts = self._open(level, day, mode='r+')
+            old = stored_counts[rows].astype(np.float64)
+            total = old + counts[in_day]
+            # merge with frames of the same bins written by the previous segment
+            old_power = np.where(old[:, None] > 0, 10 ** (values[rows].astype(np.float64) / 10), 0)
+            mean = (old_power * old[:, None] + sums[in_day]) / total[:, None]
+            values[rows] = (10 * np.log10(np.maximum(mean, 1e-30))).astype(VALUE_DTYPE)
+            stored_counts[rows] = total.astype(COUNT_DTYPE)
+            values.flush()
+            stored_counts.flush()
+            del values, stored_counts
+
+    def prune(self, before: Union[str, datetime]) -> List[str]:
+        """
+        Delete the days of every level that end before `before`, i.e. to follow the
+        retention of the segments.
+
+        Returns:
+            List[str]: Paths of the deleted files.
+        """
+        before = _utc(before)
+        removed = []
+        for level in self.meta['levels']:
+            level_path = os.path.join(self.path, f'{level}s')
+            for name in sorted(os.listdir(level_path)) if os.path.isdir(level_path) else []:
+                day = date.fromisoformat(os.path.splitext(name)[0])
+                if _midnight(day) + DAY_SECONDS <= before.timestamp():
+                    os.remove(os.path.join(level_path, name))
+                    removed.append(os.path.join(level_path, name))
+        return removed
+
+    def _day_path(self, level: int, day: date) -> str:
+        return os.path.join(self.path, f'{level}s', f'{day.isoformat()}.f16')
+
+    def _open(self, level: int, day: date, mode: str):
+        return _open_day(self._day_path(level, day), DAY_SECONDS // level, self.meta['nfft'] // 2 + 1, mode)
+
+
+def _read_meta(path: str) -> dict:
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def _open_day(path: str, rows: int, n_frequencies: int, mode: str):
+    """
+    Values and frame counts of one day, created sparse for writing. None for reading a missing day.
+    """
+    count_path = path[:-len('.f16')] + '.count'
+    if not os.path.exists(path):
+        if mode == 'r':
+            return None, None
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.truncate(rows * n_frequencies * VALUE_DTYPE.itemsize)
+        with open(count_path, 'wb') as f:
+            f.truncate(rows * COUNT_DTYPE.itemsize)
+    values = np.memmap(path, dtype=VALUE_DTYPE, mode=mode, shape=(rows, n_frequencies))
+    counts = np.memmap(count_path, dtype=COUNT_DTYPE, mode=mode, shape=(rows,))
+    return values, counts
+
+
+class SpectrogramReader:
+    def __init__(self, save_dir: str) -> None:
+        """
+        Read the spectrogram pyramid of a station.
+
+        Args:
+            save_dir (str): Directory of the station.
+        """
+        self.path = os.path.join(save_dir, SPECTROGRAM_DIRNAME)
+        self.meta = _read_meta(os.path.join(self.path, META_FILENAME))
+        assert self.meta is not None and self.meta['sample_rate'] is not None, f"no spectrogram in {save_dir}"
+        self.frequencies = np.fft.rfftfreq(self.meta['nfft'], 1 / self.meta['sample_rate'])
+
+    @property
+    def levels(self) -> list:
+        return self.meta['levels']
+
+    def read(self,
+             start: Union[str, datetime],
+             end: Union[str, datetime],
+             level: int = None,
+             max_bins: int = 5000,
+             ) -> Spectrogram:
+        """
+        Spectrogram between start and end.
+
+        Args:
+            start, end (Union[str, datetime]): The time span, naive times are UTC.
+            level (int, optional): Seconds per bin, one of the stored levels.
+                Defaults to the finest level giving at most max_bins bins.
+            max_bins (int): Upper bound on the bins when picking the level.
+        """
+        start, end = _utc(start), _utc(end)
+        assert start < end, f"start {start} must be before end {end}"
+        span = (end - start).total_seconds()
+        if level is None:
+            fitting = [level for level in self.levels if span / level <= max_bins]
+            level = fitting[0] if len(fitting) > 0 else self.levels[-1]
+        assert level in self.levels, f"level {level} s is not stored, choose one of {self.levels}"
+
+        first, last = int(start.timestamp() // level), int(np.ceil(end.timestamp() / level))
+        n_frequencies = len(self.frequencies)
+        values = np.full((last - first, n_frequencies), np.nan, dtype=VALUE_DTYPE)
+
+        rows_per_day = DAY_SECONDS // level
+        for day_number in range(first // rows_per_day, (last - 1) // rows_per_day + 1):
+            day = date(1970, 1, 1) + timedelta(days=day_number)
+            day_values, day_counts = _open_day(os.path.join(self.path, f'{level}s', f'{day.isoformat()}.f16'),
+                                               rows_per_day, n_frequencies, mode='r')
+            if day_values is None:
+                continue
+            lo = max(first, day_number * rows_per_day)
+            hi = min(last, (day_number + 1) * rows_per_day)
+            rows = slice(lo - day_number * rows_per_day, hi - day_number * rows_per_day)
+            values[lo - first:hi - first] = np.where(day_counts[rows, None] > 0, day_values[rows], np.nan)
+            del day_values, day_counts
+
+        times = (np.arange(first, last, dtype=np.int64) * level * 1000).astype('datetime64[ms]')
+        return Spectrogram(values, times, self.frequencies, level)
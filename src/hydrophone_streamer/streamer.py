@@ -4,19 +4,63 @@ streamer.py
 
 import os
 import json
+import logging
 
+from typing import Union
 
-from hydrophone_streamer.supported_classes.ooi_streaming_class import OOIStreamingClass
-from hydrophone_streamer.supported_classes.onc_streaming_class import ONCStreamingClass
-# from supported_classes.orcasound_streaming_class import OrcasoundStreamingClass
+from hydrophone_streamer.registry import get_network_class
+
+
+logger = logging.getLogger(__name__)
+
+
+def build_streaming_class(
+        hydrophone_network: str,
+        stream_setting : Union[str, dict],
+        save_dir: str = 'data',
+        **options,
+):
+    """
+    Construct the streaming class of a hydrophone network.
+
+    Args:
+        hydrophone_network (str): Name of a registered network, i.e. 'onc' or 'ooi'
+            (see registry.available_networks).
+        stream_setting (Union[str, dict]): Settings of the hydrophone, or the path
+            to a json file holding them.
+        save_dir (str): Directory the segments are written to.
+        **options: Passed on to the streaming class (i.e. max_workers).
+
+    Returns:
+        BaseStreamingClass: The streaming class instance.
+    """
+    if isinstance(stream_setting, str):
+        logger.debug('reading stream setting from %s', stream_setting)
+        assert os.path.exists(stream_setting), "hydrophone configuration file does not exist."
+        with open(stream_setting, 'r') as file:
+            stream_setting = json.load(file)
+
+    # i.e. hydrophone-streamer save_dir=/home/user/Documents/ stream_setting="{'url':'https://rawdata-west.oceanobservatories.org/files/CE02SHBP/LJ01D/HYDBBA106/'}" hydrophone_network="ooi"
+    streaming_class = get_network_class(hydrophone_network)(stream_setting, save_dir=save_dir, **options)
+
+    return streaming_class
 
-from typing import Union
 
 def stream_data(
         hydrophone_network: str,
         stream_setting : Union[str, dict],
         save_dir: str = 'data',
-        
+        max_workers: int = 4,
+        max_connections_per_host: int = 4,
+        retention: dict = None,
+        ring_buffer_seconds: float = None,
+        continuous_archive: bool = False,
+        spectrogram: bool = False,
+        transcode_workers: int = None,
+        max_pending: int = 8,
+        streaming_decode: bool = False,
+        coordination: Union[str, dict] = None,
+        output: Union[dict, list] = None,
 ) -> None:
     """
     Stream data from a hydrophone based on its identifier.
@@ -24,25 +68,44 @@ def stream_data(
     Args:
         hydrophone_identifier (Union[str, dict]): Identifier for the hydrophone.
             Can be a string or a dictionary with specific keys.
+        max_workers (int): Segments downloaded concurrently.
+        max_connections_per_host (int): Concurrent requests allowed to any one host.
+        retention (dict): Limits on the archive (max_age_days, max_bytes, max_files).
+        ring_buffer_seconds (float): Seconds of decoded audio kept in a shared memory ring buffer, None disables it.
+        continuous_archive (bool): Also append the decoded audio to the time-indexed archive in save_dir/archive.
+        spectrogram (bool): Also store a 1 s / 1 min / 10 min spectrogram pyramid in save_dir/spectrogram.
+        transcode_workers (int): Processes transcoding segments, defaults to the number of cores.
+        max_pending (int): Segments downloaded but not yet transcoded.
+        streaming_decode (bool): Transcode miniSEED segments while they download, with bounded memory.
+        coordination (Union[str, dict]): Lease database shared with other instances streaming the same
+            save_dir. Only the instance holding the lease streams, the others stand by to take over.
+        output (Union[dict, list]): Also upload the segments, latest.txt and reference.bib, i.e.
+            {'type': 's3', 'bucket': 'hydrophones'}, see sinks.S3Sink.
 
     Returns:
         None
     """
-    
-    if isinstance(stream_setting, str):
-        print(stream_setting)
-        assert os.path.exists(hydrophone_identifier), "hydrophone configuration file does not exist."
-        with open(hydrophone_identifier, 'r') as file:
-            hydrophone_identifier = json.load(file)
-    
-    if hydrophone_network == 'onc':
-        streaming_class = ONCStreamingClass(stream_setting, save_dir=save_dir)
-    elif hydrophone_network == 'ooi':
-        # i.e. hydrophone-streamer save_dir=/home/user/Documents/ stream_setting="{'url':'https://rawdata-west.oceanobservatories.org/files/CE02SHBP/LJ01D/HYDBBA106/'}" hydrophone_network="ooi"
-        streaming_class = OOIStreamingClass(stream_setting, save_dir=save_dir)
-    elif hydrophone_network == 'orcasound':
-        streaming_class = OrcasoundStreamingClass(stream_setting, save_dir=save_dir)
-    else:
-        raise ValueError(f"Unsupported network type: {hydrophone_network}")
-    
-    streaming_class.stream_data()
\ No newline at end of file
+    options = dict(max_workers=max_workers,
+                   max_connections_per_host=max_connections_per_host,
+                   retention=retention,
+                   ring_buffer_seconds=ring_buffer_seconds,
+                   continuous_archive=continuous_archive,
+                   spectrogram=spectrogram,
+                   transcode_workers=transcode_workers,
+                   max_pending=max_pending,
+                   streaming_decode=streaming_decode,
+                   output=output)
+
+    if coordination is not None:
+        # the station is only built by the instance holding its lease
+        from hydrophone_streamer.coordination import build_coordinator
+        from hydrophone_streamer.supervisor import supervisor_class
+
+        station = {'hydrophone_network': hydrophone_network, 'stream_setting': stream_setting, 'save_dir': save_dir, **options}
+        coordinator = build_coordinator(coordination, [os.path.basename(os.path.normpath(save_dir))])
+        supervisor_class([station])([station], coordinator=coordinator).run()
+        return
+
+    streaming_class = build_streaming_class(hydrophone_network, stream_setting, save_dir=save_dir, **options)
+
+    streaming_class.stream_data()
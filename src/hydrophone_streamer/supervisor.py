@@ -0,0 +1,411 @@
+"""
+supervisor.py
+
+Run many hydrophone stations from one process.
+
+Stations are listed in a json file (see sample_configuration.json). Every station
+is polled by a shared worker pool, so one slow or failing station never holds up
+the others, and all of them reuse the process wide HTTP connection pool. A station
+that raises is torn down and rebuilt after an exponential back-off.
+
+With `use_asyncio` the stations are instead tasks on one event loop
+(AsyncSupervisor), so dozens of mostly idle stations need no thread each. A file
+listing an asynchronous network (i.e. ooi_async) always runs on the event loop.
+
+With `coordination` several supervisors, on one host or many, share the stations
+of the same file: each only polls the stations it holds the lease of, a lease is
+handed over only between two polls, and the writes of a poll are fenced with the
+epoch of its lease, see coordination.py.
+"""
+
+
+import asyncio
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import partial
+from typing import List, Optional
+
+from hydrophone_streamer.coordination import Coordinator, LeaseLost, build_coordinator
+from hydrophone_streamer.metrics import STATION_RESTARTS
+from hydrophone_streamer.retention import RetentionPolicy, enforce_retention, prune_sample_sinks
+from hydrophone_streamer.streamer import build_streaming_class
+
+
+logger = logging.getLogger(__name__)
+
+STATION_KEYS = ('hydrophone_network', 'stream_setting', 'save_dir')
+
+
+def load_stations(config_file: str) -> dict:
+    """
+    Read a supervisor configuration file.
+
+    The file holds a list of stations, each with `hydrophone_network`, `stream_setting`
+    and `save_dir`, plus any streaming class option (i.e. max_workers, retention).
+    Options under `defaults` apply to every station that does not override them, and
+    `global_retention` limits the combined archive of all stations.
+
+    Args:
+        config_file (str): Path to the json configuration.
+
+    Returns:
+        dict: The configuration with options merged into every station.
+    """
+    assert os.path.exists(config_file), f"supervisor configuration file {config_file} does not exist."
+    with open(config_file, 'r') as f:
+        config = json.load(f)
+
+    assert len(config.get('stations', [])) > 0, f"No stations listed in {config_file}"
+
+    defaults = config.get('defaults', {})
+    stations = []
+    for station in config['stations']:
+        for key in STATION_KEYS:
+            assert key in station, f"Station {station} must contain '{key}' key."
+        stations.append({**defaults, **station})
+
+    config['stations'] = stations
+    return config
+
+
+def needs_event_loop(stations: List[dict]) -> bool:
+    """
+    True if the streaming class of a station is asynchronous, it can only be polled by AsyncSupervisor.
+
+    Args:
+        stations (List[dict]): Station specifications, as returned by `load_stations`.
+    """
+    from hydrophone_streamer.registry import get_network_class
+    from hydrophone_streamer.supported_classes.async_base_streaming_class import AsyncBaseStreamingClass
+
+    return any(issubclass(get_network_class(station['hydrophone_network']), AsyncBaseStreamingClass) for station in stations)
+
+
+def supervisor_class(stations: List[dict], use_asyncio: bool = False) -> type:
+    """
+    AsyncSupervisor if asked for or if a station needs the event loop, else Supervisor.
+    """
+    return AsyncSupervisor if use_asyncio or needs_event_loop(stations) else Supervisor
+
+
+class _Station:
+    def __init__(self, spec: dict) -> None:
+        self.spec = spec
+        self.name = spec.get('name', os.path.basename(os.path.normpath(spec['save_dir'])))
+        self.instance = None
+        self.failures = 0
+        self.epoch = None # of the lease the current poll runs under
+
+
+class Supervisor:
+    def __init__(self,
+                 stations: List[dict],
+                 max_workers: Optional[int] = None,
+                 restart_delay: float = 10,
+                 max_restart_delay: float = 600,
+                 global_retention: dict = None,
+                 retention_interval: float = 60,
+                 coordinator: Optional[Coordinator] = None,
+                 ) -> None:
+        """
+        Schedule the polling of many stations on one worker pool.
+
+        Args:
+            stations (List[dict]): Station specifications, as returned by `load_stations`.
+            max_workers (int, optional): Stations polled at the same time, defaults to one per station.
+            restart_delay (float): Seconds to wait before rebuilding a failed station, doubled per consecutive failure.
+            max_restart_delay (float): Upper bound on the restart delay.
+            global_retention (dict, optional): Limits on the combined archive of every station, see RetentionPolicy.
+            retention_interval (float): Seconds between two checks of the global limits.
+            coordinator (Coordinator, optional): Only poll the stations whose lease this worker holds.
+        """
+        self.stations = [_Station(spec) for spec in stations]
+        self.max_workers = max_workers if max_workers is not None else len(self.stations)
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.global_retention = RetentionPolicy.from_config(global_retention)
+        self.retention_interval = retention_interval
+        self.coordinator = coordinator
+        if coordinator is not None:
+            names = [station.name for station in self.stations]
+            assert len(set(names)) == len(names), "Stations need unique names to be leased, set 'name' where save_dirs share a base name."
+
+    def _teardown(self, station: _Station) -> None:
+        """
+        Drop the instance of a station, its output sinks finish their uploads in the background.
+        """
+        instance, station.instance = station.instance, None
+        if instance is not None and hasattr(instance, 'close'):
+            threading.Thread(target=instance.close, name=f'close-{station.name}', daemon=True).start()
+
+    def _begin(self, station: _Station) -> bool:
+        """
+        Start a poll of the station if this worker may poll it, call `_end` once it is over.
+        A station whose lease was lost is torn down.
+        """
+        if self.coordinator is None:
+            return True
+        lease = self.coordinator.begin(station.name)
+        if lease is not None:
+            station.epoch = lease.epoch
+            return True
+        if station.instance is not None:
+            logger.info('station %s is leased to another worker, stopping it here', station.name)
+            self._teardown(station)
+            station.failures = 0
+        return False
+
+    def _end(self, station: _Station) -> None:
+        if self.coordinator is not None:
+            self.coordinator.end(station.name)
+
+    def _fence(self, station: _Station) -> None:
+        """
+        Refuse the writes of the poll about to run once its lease is gone.
+        """
+        if self.coordinator is not None:
+            station.instance.set_fence(partial(self.coordinator.check, station.name, station.epoch))
+
+    def _lease_lost(self, station: _Station, error: LeaseLost) -> float:
+        """
+        Drop a station whose lease was taken over during a poll, it is not a failure of the station.
+        """
+        logger.warning('station %s stopped mid-poll: %s', station.name, error)
+        self._teardown(station)
+        station.failures = 0
+        return self.coordinator.heartbeat_interval
+
+    def _build(self, station: _Station):
+        options = {k: v for k, v in station.spec.items() if k not in STATION_KEYS and k != 'name'}
+        return build_streaming_class(station.spec['hydrophone_network'],
+                                     station.spec['stream_setting'],
+                                     save_dir=station.spec['save_dir'],
+                                     **options)
+
+    def _poll(self, station: _Station) -> float:
+        """
+        Poll one station, building it first if needed. Ends the poll started with `_begin`.
+
+        Returns:
+            float: Seconds to wait before the next poll of this station.
+        """
+        try:
+            return self._poll_once(station)
+        finally:
+            self._end(station)
+
+    def _poll_once(self, station: _Station) -> float:
+        try:
+            if station.instance is None:
+                station.instance = self._build(station)
+            self._fence(station)
+            fetched_results = station.instance.poll()
+            # writes schedule.json, a full disk fails the station rather than the supervisor
+            delay = station.instance.next_poll_delay(len(fetched_results))
+        except LeaseLost as e:
+            return self._lease_lost(station, e)
+        except Exception as e:
+            station.failures += 1
+            self._teardown(station) # rebuilt on the next attempt
+            delay = min(self.restart_delay * 2 ** (station.failures - 1), self.max_restart_delay)
+            STATION_RESTARTS.inc(station=station.name)
+            logger.exception('station %s failed (%d in a row), restarting in %.0fs: %r', station.name, station.failures, delay, e)
+            return delay
+
+        station.failures = 0
+        return delay
+
+    def _enforce_global_retention(self) -> None:
+        """
+        Evict the globally oldest segments until the combined archive fits the global limits.
+        """
+        stations = [station for station in self.stations if station.instance is not None]
+        if self.coordinator is not None:
+            # hold the leases while deleting, so none is handed over meanwhile
+            stations = [station for station in stations if self.coordinator.begin(station.name) is not None]
+        try:
+            # stations that only keep their segments in an output sink have nothing local to evict
+            archives = [(station.instance.segment_index, station.instance._latest_pointer()) for station in stations
+                        if station.instance.keeps_local]
+            removed = enforce_retention(archives, self.global_retention)
+            if len(removed) > 0:
+                for station in stations:
+                    if station.instance.keeps_local:
+                        removed += prune_sample_sinks(station.instance.segment_index, station.instance.sample_sinks)
+        finally:
+            for station in stations:
+                self._end(station)
+        if len(removed) > 0:
+            logger.info('global retention removed %d files', len(removed))
+
+    def run(self) -> None:
+        """
+        Poll every station forever.
+        """
+        if needs_event_loop([station.spec for station in self.stations]):
+            raise ValueError("Asynchronous streaming classes cannot be polled from a thread pool, run them with AsyncSupervisor.")
+        if self.coordinator is not None:
+            self.coordinator.start()
+        try:
+            self._run()
+        finally:
+            for station in self.stations:
+                if station.instance is not None and hasattr(station.instance, 'close'):
+                    station.instance.close()
+            if self.coordinator is not None:
+                self.coordinator.stop()
+
+    def _run(self) -> None:
+        # (time the station is due, position in self.stations)
+        schedule = [(time.monotonic(), i) for i in range(len(self.stations))]
+        heapq.heapify(schedule)
+        running = {}
+        next_retention = time.monotonic() + self.retention_interval
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while True:
+                now = time.monotonic()
+                if self.global_retention.enabled and now >= next_retention:
+                    self._enforce_global_retention()
+                    next_retention = now + self.retention_interval
+
+                while len(schedule) > 0 and schedule[0][0] <= now and len(running) < self.max_workers:
+                    _, i = heapq.heappop(schedule)
+                    if not self._begin(self.stations[i]):
+                        # look again once the leases have been renewed or rebalanced
+                        heapq.heappush(schedule, (now + self.coordinator.heartbeat_interval, i))
+                        continue
+                    running[executor.submit(self._poll, self.stations[i])] = i
+
+                if len(schedule) == 0 or len(running) >= self.max_workers:
+                    timeout = None # wait for a worker to free up
+                else:
+                    timeout = max(schedule[0][0] - now, 0)
+                if self.global_retention.enabled:
+                    timeout = max(min(timeout if timeout is not None else float('inf'), next_retention - now), 0)
+                if len(running) == 0:
+                    time.sleep(timeout)
+                    continue
+
+                done, _ = wait(running.keys(), timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    i = running.pop(future)
+                    heapq.heappush(schedule, (time.monotonic() + future.result(), i))
+
+
+class AsyncSupervisor(Supervisor):
+    """
+    Drive every station from one asyncio event loop.
+
+    Each station is a task that sleeps on the loop between polls, so idle stations
+    cost no thread. Asynchronous streaming classes poll on the loop, synchronous ones
+    through SyncStationAdapter on a worker thread, at most max_workers of them at once.
+    """
+    async def _station_task(self, station: _Station, slots: asyncio.Semaphore) -> None:
+        from hydrophone_streamer.supported_classes.async_base_streaming_class import as_async
+
+        while True:
+            async with slots:
+                if not self._begin(station):
+                    # look again once the leases have been renewed or rebalanced
+                    delay = self.coordinator.heartbeat_interval
+                else:
+                    try:
+                        delay = await self._poll_async(station, as_async)
+                    finally:
+                        self._end(station)
+            await asyncio.sleep(delay)
+
+    async def _poll_async(self, station: _Station, as_async) -> float:
+        try:
+            if station.instance is None:
+                # constructors block (index, listings), build off the loop
+                station.instance = as_async(await asyncio.to_thread(self._build, station))
+            self._fence(station)
+            fetched_results = await station.instance.poll()
+            delay = station.instance.next_poll_delay(len(fetched_results))
+        except LeaseLost as e:
+            return self._lease_lost(station, e)
+        except Exception as e:
+            station.failures += 1
+            self._teardown(station) # rebuilt on the next attempt
+            delay = min(self.restart_delay * 2 ** (station.failures - 1), self.max_restart_delay)
+            STATION_RESTARTS.inc(station=station.name)
+            logger.exception('station %s failed (%d in a row), restarting in %.0fs: %r', station.name, station.failures, delay, e)
+            return delay
+        station.failures = 0
+        return delay
+
+    async def _retention_task(self) -> None:
+        while True:
+            await asyncio.sleep(self.retention_interval)
+            await asyncio.to_thread(self._enforce_global_retention)
+
+    async def run_async(self) -> None:
+        """
+        Poll every station forever on the running event loop.
+        """
+        from hydrophone_streamer.aio import close_client_session
+
+        if self.coordinator is not None:
+            await asyncio.to_thread(self.coordinator.start)
+
+        slots = asyncio.Semaphore(self.max_workers)
+        tasks = [asyncio.create_task(self._station_task(station, slots), name=station.name) for station in self.stations]
+        if self.global_retention.enabled:
+            tasks.append(asyncio.create_task(self._retention_task(), name='global_retention'))
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await close_client_session()
+            for station in self.stations:
+                if station.instance is not None and hasattr(station.instance, 'close'):
+                    await asyncio.to_thread(station.instance.close)
+            if self.coordinator is not None:
+                await asyncio.to_thread(self.coordinator.stop)
+
+    def run(self) -> None:
+        """
+        Poll every station forever.
+        """
+        asyncio.run(self.run_async())
+
+
+def supervise(config_file: str,
+              max_workers: Optional[int] = None,
+              use_asyncio: bool = False,
+              coordination: Optional[str] = None,
+              ) -> None:
+    """
+    Stream every station listed in a configuration file.
+
+    Args:
+        config_file (str): Path to the json configuration.
+        max_workers (int, optional): Stations polled at the same time, defaults to the
+            `max_workers` entry of the file or one per station.
+        use_asyncio (bool): Drive the stations from one event loop (AsyncSupervisor)
+            instead of a thread pool, defaults to the `use_asyncio` entry of the file.
+            Stations of an asynchronous network run on the event loop either way.
+        coordination (str, optional): Lease database on storage shared with the other workers
+            running the same file, defaults to the `coordination` entry of the file (a path, or a
+            dict with `backend`, `ttl` and `heartbeat_interval`). None runs every station here.
+    """
+    config = load_stations(config_file)
+    if max_workers is None:
+        max_workers = config.get('max_workers')
+    use_asyncio = use_asyncio or config.get('use_asyncio', False)
+
+    stations = [_Station(spec).name for spec in config['stations']]
+    coordinator = build_coordinator(coordination or config.get('coordination'), stations)
+
+    supervisor = supervisor_class(config['stations'], use_asyncio)
+    supervisor(config['stations'], max_workers=max_workers,
+               global_retention=config.get('global_retention'),
+               coordinator=coordinator).run()
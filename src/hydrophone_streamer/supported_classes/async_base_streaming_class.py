@@ -0,0 +1,177 @@
+"""
+async_base_streaming_class.py
+
+Asyncio variant of the streaming class lifecycle.
+
+A subclass of AsyncBaseStreamingClass implements `async download_data` on the
+non-blocking HTTP helpers of aio.py, so a station waiting on the network or
+sleeping until its next segment is due holds no thread. Work that would block the
+event loop goes to executors: `run_blocking` for disk and SQLite (the segment
+index, the sample sinks, retention) and `run_cpu` for transcoding, on the process
+pool shared with the synchronous pipeline.
+
+Existing synchronous classes run on the same event loop through SyncStationAdapter,
+which moves each poll to a worker thread, so one loop can drive every station of
+the supervisor (see AsyncSupervisor).
+"""
+
+
+import asyncio
+import time
+from datetime import datetime, timezone
+from functools import partial
+
+from hydrophone_streamer.metrics import LAST_POLL, POLL_ERRORS, STAGE_SECONDS
+from hydrophone_streamer.pipeline import get_transcode_pool
+from hydrophone_streamer.supported_classes.base_streaming_class import BaseStreamingClass
+
+
+class AsyncBaseStreamingClass(BaseStreamingClass):
+    def __init__(self, *args, **kwargs) -> None:
+        """
+        Takes the arguments of BaseStreamingClass.
+        """
+        super().__init__(*args, **kwargs)
+        # created on the event loop, see aio.get_client_session
+        self.http = None
+
+    def _client(self):
+        from hydrophone_streamer.aio import get_client_session
+        if self.http is None or self.http.closed:
+            self.http = get_client_session()
+        return self.http
+
+    async def run_blocking(self, function, *args, **kwargs):
+        """
+        Run a blocking call (file system, SQLite, a synchronous client) on a worker thread.
+        """
+        return await asyncio.to_thread(function, *args, **kwargs)
+
+    async def run_cpu(self, function, *args, **kwargs):
+        """
+        Run a CPU bound, picklable call (i.e. mseed_to_flac) on the shared transcoding processes.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_transcode_pool(self.transcode_workers), partial(function, *args, **kwargs))
+
+    async def register_segment(self, *args, **kwargs) -> None:
+        """
+        _register_segment off the event loop, it writes the index and feeds the sample sinks.
+        """
+        await self.run_blocking(self._register_segment, *args, **kwargs)
+
+    async def download_data(self) -> list:
+        """
+        Download data from the hydrophone source without blocking the event loop.
+        This method should be implemented in the subclass.
+        """
+        raise NotImplementedError("This method should be implemented in the subclass.")
+
+    async def latest_file(self) -> None:
+        """
+        Point latest.txt at the newest segment in the index.
+        """
+        def write() -> None:
+            this_time, max_file = self._most_recent_file_date(return_file=True)
+            if max_file is not None:
+                self._write_latest(max_file)
+
+        await self.run_blocking(write)
+
+    async def poll(self) -> list:
+        """
+        Run a single download cycle and update latest.txt if anything new arrived, see BaseStreamingClass.poll.
+
+        Returns:
+            list: Files fetched during this cycle.
+        """
+        self._new_segments = []
+        with STAGE_SECONDS.time(station=self.station, stage='poll'):
+            fetched_results = await self.download_data()
+            self.scheduler.observe(self._new_segments)
+
+            if len(fetched_results) > 0:
+                await self.latest_file()
+
+            with STAGE_SECONDS.time(station=self.station, stage='retention'):
+                await self.run_blocking(self.clean_old_files)
+
+        LAST_POLL.set(time.time(), station=self.station)
+        self.log.info('fetched %d segments, as recent as %s', len(fetched_results),
+                      datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"))
+
+        return fetched_results
+
+    async def stream_data_async(self) -> None:
+        """
+        Poll the hydrophone source forever, sleeping on the event loop until the next segment is due.
+        """
+        while True:
+            try:
+                fetched_results = await self.poll()
+                delay = self.next_poll_delay(len(fetched_results))
+            except Exception as e:
+                POLL_ERRORS.inc(station=self.station)
+                delay = self.next_poll_delay(0, error=True)
+                self.log.exception('poll failed, retrying in %.0fs: %r', delay, e)
+
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    def stream_data(self) -> None:
+        """
+        Blocking entry point, runs stream_data_async on a new event loop.
+        """
+        from hydrophone_streamer.aio import close_client_session
+
+        async def main() -> None:
+            try:
+                await self.stream_data_async()
+            finally:
+                await close_client_session()
+                await self.run_blocking(self.close)
+
+        asyncio.run(main())
+
+
+class SyncStationAdapter:
+    def __init__(self, instance: BaseStreamingClass) -> None:
+        """
+        Give a synchronous streaming class the awaitable poll of AsyncBaseStreamingClass.
+        Each poll runs on a worker thread, the station holds no thread between polls.
+
+        Args:
+            instance (BaseStreamingClass): The synchronous station.
+        """
+        self.instance = instance
+
+    def __getattr__(self, name: str):
+        return getattr(self.instance, name)
+
+    async def poll(self) -> list:
+        return await asyncio.to_thread(self.instance.poll)
+
+    async def stream_data_async(self) -> None:
+        """
+        The loop of BaseStreamingClass.stream_data, with the sleeps on the event loop.
+        """
+        while True:
+            try:
+                fetched_results = await self.poll()
+                delay = self.instance.next_poll_delay(len(fetched_results))
+            except Exception as e:
+                POLL_ERRORS.inc(station=self.instance.station)
+                delay = self.instance.next_poll_delay(0, error=True)
+                self.instance.log.exception('poll failed, retrying in %.0fs: %r', delay, e)
+
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+
+def as_async(instance: BaseStreamingClass):
+    """
+    The instance itself if it is asynchronous, else wrapped in a SyncStationAdapter.
+    """
+    if isinstance(instance, AsyncBaseStreamingClass):
+        return instance
+    return SyncStationAdapter(instance)
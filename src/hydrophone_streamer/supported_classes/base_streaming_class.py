@@ -6,64 +6,362 @@ hydrophone_streamer/src/supported_classes/base_class.py
 
 
 import time
-from datetime import datetime
+from datetime import datetime, timezone
 import glob
+import json
+import logging
 import os
 
+from hydrophone_streamer.log import StationLogger
+from hydrophone_streamer.metrics import DATA_LATENCY, LAST_POLL, POLL_ERRORS, SEGMENTS, STAGE_SECONDS
+from hydrophone_streamer.notifications import LATEST_FILENAME, SegmentFeed, write_latest
+from hydrophone_streamer.retention import RetentionPolicy, enforce_retention, prune_sample_sinks
+from hydrophone_streamer.scheduler import PollScheduler
+from hydrophone_streamer.segment_index import SegmentIndex
+from hydrophone_streamer.sessions import get_host_limiter, get_session
+
 
 class BaseStreamingClass:
+    network = None # short name of the hydrophone network, recorded in the segment index
+
     def __init__(self,
                  hydrophone_identifier: dict,
                  save_dir: str = 'data',
+                 max_workers: int = 4,
+                 max_connections_per_host: int = 4,
+                 retention: dict = None,
+                 ring_buffer_seconds: float = None,
+                 continuous_archive: bool = False,
+                 spectrogram: bool = False,
+                 transcode_workers: int = None,
+                 max_pending: int = 8,
+                 streaming_decode: bool = False,
+                 output=None,
                  ) -> None:
-        
+
+        """
+        Args:
+            hydrophone_identifier (dict): Dictionary containing hydrophone configuration.
+            save_dir (str): Directory the segments are written to.
+            max_workers (int): Segments downloaded concurrently.
+            max_connections_per_host (int): Concurrent requests allowed to any one host.
+            retention (dict): Limits on the archive, see RetentionPolicy (max_age_days, max_bytes, max_files).
+            ring_buffer_seconds (float): Also write the decoded samples to a shared memory ring buffer
+                holding this many seconds (ring.pcm in save_dir). None disables it.
+            continuous_archive (bool): Also append the decoded samples to the time-indexed archive in
+                save_dir/archive, see ContinuousArchive.
+            spectrogram (bool): Also compute the spectrogram pyramid of the decoded samples in
+                save_dir/spectrogram, see SpectrogramPyramid.
+            transcode_workers (int): Processes of the shared transcoding pool, defaults to the number of cores.
+            max_pending (int): Segments in flight between download and transcode, bounds disk and memory use.
+            streaming_decode (bool): Transcode miniSEED segments record by record while they download,
+                with memory bounded independently of the segment length, see StreamingMseedDecoder.
+            output (Union[dict, list]): Also send the segments, latest.txt and reference.bib to these
+                output sinks, i.e. {'type': 's3', 'bucket': ...}, see sinks.build_output_sinks.
+        """
+        self.hydrophone_identifier = hydrophone_identifier
+        self.save_dir = save_dir
+        self.max_workers = max_workers
+        self.transcode_workers = transcode_workers
+        self.max_pending = max_pending
+        self.streaming_decode = streaming_decode
+        self.retention = RetentionPolicy.from_config(retention)
+
+        # label of the station in logs and metrics
+        self.station = os.path.basename(os.path.normpath(save_dir))
+        self.log = StationLogger(logging.getLogger(type(self).__module__), {'station': self.station, 'network': self.network})
+
+        # keep-alive connections are pooled across every station in the process
+        self.session = get_session()
+        self.max_connections_per_host = max_connections_per_host
+        self.host_limiter = get_host_limiter(max_connections_per_host)
+
+        os.makedirs(self.save_dir, exist_ok=True)
+
+        self.segment_index = SegmentIndex(self.save_dir, network=self.network)
+        if self.segment_index.needs_rebuild:
+            # one time scan of an archive written before the index existed
+            with STAGE_SECONDS.time(station=self.station, stage='index_rebuild'):
+                n_indexed = self.segment_index.rebuild(glob.glob(os.path.join(self.save_dir, '*.flac')), self._file_time)
+            self.log.info('indexed %d existing segments in %s', n_indexed, self.save_dir)
+
+        # stages that receive the decoded samples of every new segment, see _register_segment
+        # (imported here so stations without them start faster)
+        self.sample_sinks = []
+        if ring_buffer_seconds is not None:
+            from hydrophone_streamer.ring_buffer import PCMRingBuffer
+            self.sample_sinks.append(PCMRingBuffer(self.save_dir, seconds=ring_buffer_seconds))
+        if continuous_archive:
+            from hydrophone_streamer.archive import ContinuousArchive
+            self.sample_sinks.append(ContinuousArchive(self.save_dir))
+        if spectrogram:
+            from hydrophone_streamer.spectrogram import SpectrogramPyramid
+            self.sample_sinks.append(SpectrogramPyramid(self.save_dir))
+
+        # where the files go besides the save_dir, i.e. an S3 bucket
+        self.output_sinks = []
+        if output is not None:
+            from hydrophone_streamer.sinks import build_output_sinks
+            self.output_sinks = build_output_sinks(output, self.save_dir, self.station)
+        if self.retention.enabled and not self.keeps_local:
+            self.close()
+            raise ValueError("retention limits the segments kept in the save_dir, it cannot be combined with an output with keep_local=False")
+
+        # consumers follow new segments through segments.jsonl instead of polling latest.txt
+        self.segment_feed = SegmentFeed(self.save_dir)
+
+        # learns the publishing cadence of the station to decide when to poll next
+        self.scheduler = PollScheduler()
+        self.scheduler.seed(segment.start_time for segment in self.segment_index.newest(self.scheduler.start_times.maxlen))
+        self._new_segments = []
+
+        # called before every write to the index, latest.txt or the archive, see set_fence
+        self.fence = None
+
+    @property
+    def keeps_local(self) -> bool:
+        """
+        False if an output sink removes the segments from the save_dir once they are uploaded.
+        They stay in the segment index, so they are not fetched again.
+        """
+        return all(getattr(sink, 'keep_local', True) for sink in self.output_sinks)
+
+    def set_fence(self, fence) -> None:
+        """
+        Guard the writes of the coming polls, i.e. with the lease they run under.
+
+        Args:
+            fence (Callable[[], None]): Raises (i.e. coordination.LeaseLost) once this process
+                may no longer write to the save_dir. None removes the guard.
         """
+        self.fence = fence
+
+    def _check_fence(self) -> None:
+        if self.fence is not None:
+            self.fence()
+
+    def _file_time(self, filename: str) -> datetime:
+        """
+        Parse the segment start time from a file name.
+        This method should be implemented in the subclass.
+        """
+        raise NotImplementedError("This method should be implemented in the subclass.")
+
+    def _register_segment(self,
+                          path: str,
+                          start_time: datetime = None,
+                          duration: float = None,
+                          samples=None,
+                          sample_rate: float = None,
+                          gaps: list = None,
+                          live: bool = True,
+                          ) -> None:
+        """
+        Record a newly written segment in the segment index, hand its samples to the
+        sample sinks and publish it to the segment feed. Live segments must be registered
+        in time order.
+
+        Args:
+            path (str): The segment file.
+            start_time (datetime, optional): Defaults to the time in the file name.
+            duration (float, optional): Length of the segment in seconds.
+            samples (np.ndarray, optional): Decoded samples, read back from the file if a sink needs them.
+            sample_rate (float, optional): Sampling rate of `samples`.
+            gaps (list, optional): (first, end) samples of `samples` the decoder filled with zeros.
+            live (bool): False for historical segments (i.e. from a backfill), which are only indexed.
+        """
+        self._check_fence()
+        if start_time is None:
+            start_time = self._file_time(path)
+        SEGMENTS.inc(station=self.station)
+        if not live:
+            self.segment_index.add(path, start_time, duration=duration)
+            self._put_file(path)
+            return
+        with STAGE_SECONDS.time(station=self.station, stage='register'):
+            if len(self.sample_sinks) > 0:
+                if samples is None:
+                    from hydrophone_streamer.transcode import read_flac
+                    samples, sample_rate = read_flac(path)
+                for sink in self.sample_sinks:
+                    sink.write(samples, sample_rate, start_time, gaps=gaps or [])
+            self.segment_index.add(path, start_time, duration=duration)
+            self.segment_feed.publish(path, start_time, duration=duration)
+            self._put_file(path)
+        self._new_segments.append(start_time)
+
+        end_time = start_time.timestamp() + (duration or 0)
+        DATA_LATENCY.set(time.time() - end_time, station=self.station)
+
+    def _most_recent_file_date(self, return_file: bool = False):
+        """
+        return the datetime object of the most recent file in the save_dir
+        """
+        latest = self.segment_index.latest()
+        if latest is None:
+            max_time, max_file = datetime.min.replace(tzinfo=timezone.utc), None
+        else:
+            max_time, max_file = latest.start_time, os.path.join(self.save_dir, latest.filename)
+
+        if return_file:
+            return max_time, max_file
+
+        return max_time
+
+    def _latest_pointer(self):
+        """
+        Return the file name latest.txt points at, or None.
         """
-        pass      
+        latest_path = os.path.join(self.save_dir, 'latest.txt')
+        if not os.path.exists(latest_path):
+            return None
+        with open(latest_path, 'r') as f:
+            return f.read().strip() or None
+
+    def _write_latest(self, filename: str) -> None:
+        """
+        Point latest.txt at a segment in the save_dir, atomically, and in the output
+        sinks once the segment has arrived there.
+        """
+        self._check_fence()
+        write_latest(self.save_dir, filename)
+        for sink in self.output_sinks:
+            sink.put_text(LATEST_FILENAME, os.path.basename(filename), after=os.path.basename(filename))
+
+    def _put_file(self, path: str) -> None:
+        """
+        Hand a finished file of the save_dir to the output sinks.
+        """
+        for sink in self.output_sinks:
+            sink.put_file(path)
+
+    def _write_reference(self, bibtex: str) -> None:
+        """
+        Write the citation of the data to reference.bib.
+        """
+        path = os.path.join(self.save_dir, 'reference.bib')
+        with open(path, 'w') as f:
+            f.write(bibtex)
+        self._put_file(path)
+
+    def close(self) -> None:
+        """
+        Finish the uploads of the output sinks.
+        """
+        for sink in self.output_sinks:
+            sink.close()
 
     def latest_file(self) -> None:
         """
         log the most recent audio file to a file for streaming purposes
-        """  
+        """
         raise NotImplementedError("This method should be implemented in the subclass.")
-    
+
     def download_data(self) -> list:
         """
         Download data from the hydrophone source.
         This method should be implemented in the subclass.
         """
         raise NotImplementedError("This method should be implemented in the subclass.")
-        
-    def stream_data(self) -> None:
+
+    @classmethod
+    def supports_backfill(cls) -> bool:
         """
-        
+        True when the network implements backfill_shards and backfill_shard.
         """
-        while True:
+        return (cls.backfill_shards is not BaseStreamingClass.backfill_shards
+                and cls.backfill_shard is not BaseStreamingClass.backfill_shard)
 
-            fetched_results = self.download_data()
-            
+    def backfill_shards(self, start: datetime, end: datetime) -> list:
+        """
+        Split a historical period into independent shards, see backfill.py.
+        This method should be implemented in the subclass.
 
+        Returns:
+            list: (start, end) of every shard, covering [start, end) without overlap.
+        """
+        raise NotImplementedError("This method should be implemented in the subclass.")
 
-            print(f'fetched as recent as {datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")}')
+    def backfill_shard(self, start: datetime, end: datetime) -> list:
+        """
+        Fetch the segments starting in [start, end) that are missing from the archive.
+        Called from several threads at once.
+        This method should be implemented in the subclass.
+
+        Returns:
+            list: Files written.
+        """
+        raise NotImplementedError("This method should be implemented in the subclass.")
+
+    def poll(self) -> list:
+        """
+        Run a single download cycle and update latest.txt if anything new arrived.
 
-            if len(fetched_results) == 0:
-                time.sleep(10)
-            else:
+        Returns:
+            list: Files fetched during this cycle.
+        """
+        self._new_segments = []
+        with STAGE_SECONDS.time(station=self.station, stage='poll'):
+            fetched_results = self.download_data()
+            self.scheduler.observe(self._new_segments)
+
+            if len(fetched_results) > 0:
                 self.latest_file()
 
+            with STAGE_SECONDS.time(station=self.station, stage='retention'):
+                self.clean_old_files()
+
+        LAST_POLL.set(time.time(), station=self.station)
+        self.log.info('fetched %d segments, as recent as %s', len(fetched_results),
+                      datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"))
 
-    def clean_old_files(self) -> None:
+        return fetched_results
+
+    def next_poll_delay(self, n_fetched: int, error: bool = False) -> float:
+        """
+        Seconds to wait before the next poll, and publish the scheduler's predictions
+        to schedule.json in the save_dir for monitoring.
+        """
+        delay = self.scheduler.next_delay(n_fetched, error=error)
+        with open(os.path.join(self.save_dir, 'schedule.json'), 'w') as f:
+            json.dump(self.scheduler.predictions(), f)
+        return delay
+
+    def stream_data(self) -> None:
         """
-        Clean old files in the save directory.
+        Poll the hydrophone source forever, sleeping until the next segment is due.
         """
-        clean_old_files = glob.glob(os.path.join(self.save_dir, '*.flac'))
-        clean_old_filed = clean_old_files + glob.glob(os.path.join(self.save_dir, '*.ts'))
-        for file in clean_old_files:
-            if os.path.getmtime(file) < time.time() - 60 * 60 * 24 * 7:
-                # if file is older than 7 days
-                os.remove(file)
+        try:
+            while True:
 
-            
+                try:
+                    fetched_results = self.poll()
+                    delay = self.next_poll_delay(len(fetched_results))
+                except Exception as e:
+                    POLL_ERRORS.inc(station=self.station)
+                    delay = self.next_poll_delay(0, error=True)
+                    self.log.exception('poll failed, retrying in %.0fs: %r', delay, e)
 
+                if delay > 0:
+                    time.sleep(delay)
+        finally:
+            self.close()
 
-            
\ No newline at end of file
+
+    def clean_old_files(self) -> list:
+        """
+        Evict the oldest segments until the retention policy holds, along with the
+        archive and spectrogram from before the oldest segment kept. The file
+        latest.txt points at is never deleted.
+
+        Returns:
+            list: Paths of the deleted files.
+        """
+        if not self.retention.enabled:
+            return []
+        self._check_fence()
+        removed = enforce_retention([(self.segment_index, self._latest_pointer())], self.retention)
+        if len(removed) > 0:
+            removed += prune_sample_sinks(self.segment_index, self.sample_sinks)
+            self.log.info('retention removed %d files from %s', len(removed), self.save_dir)
+        return removed
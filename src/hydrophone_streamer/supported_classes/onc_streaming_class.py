@@ -9,17 +9,17 @@ from datetime import datetime, timedelta, timezone
 
 import requests
 import os
-from urllib.parse import urljoin
 import re
 import json
-from copy import deepcopy
 import glob
-
-from omegaconf import DictConfig, OmegaConf
-
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from onc.onc import ONC
 
+from hydrophone_streamer.metrics import DOWNLOADED_BYTES, SEGMENT_ERRORS, STAGE_SECONDS
+from hydrophone_streamer.notifications import write_atomic
+
 
 try:
     from dotenv import load_dotenv
@@ -30,6 +30,14 @@ except:
 
 token = os.getenv('ONC_TOKEN')
 
+# data product options tried, in order of preference, when a device has no archived files
+DPO_OPTIONS = [{'dpo_hydrophoneDataDiversionMode':'OD'},
+               {'dpo_hydrophoneDataDiversionMode':'OD', 'dpo_hydrophoneChannel':'All'},
+               {'dpo_hydrophoneChannel':'All'},
+               {'dpo_audioFormatConversion':0, 'dpo_hydrophoneDataDiversionMode':'OD', 'dpo_hydrophoneChannel':'All'},
+               {'dpo_audioFormatConversion':0, 'dpo_hydrophoneDataDiversionMode':'OD'},
+               {'dpo_audioFormatConversion':1, 'dpo_hydrophoneDataDiversionMode':'OD', 'dpo_hydrophoneChannel':'All'}]
+
 def check_token_is_set():
     """
     """
@@ -43,39 +51,44 @@ def check_token_is_set():
 
 
 class ONCStreamingClass(BaseStreamingClass):
+    network = 'onc'
+
     def __init__(self, 
                  hydrophone_identifier: dict,
-                 save_dir: str = "data") -> None:
+                 save_dir: str = "data",
+                 **kwargs) -> None:
         """
         Initialize the ONCStreamingClass with the hydrophone identifier.
 
         Args:
             hydrophone_identifier (dict): Dictionary containing hydrophone configuration.
+            **kwargs: Passed on to BaseStreamingClass (i.e. max_workers).
         """
-        super().__init__(hydrophone_identifier)
-        self.hydrophone_identifier = hydrophone_identifier
-        self.save_dir = save_dir
-
         check_token_is_set()
 
-        
-
-
-        os.makedirs(self.save_dir, exist_ok=True)
+        super().__init__(hydrophone_identifier, save_dir=save_dir, **kwargs)
 
-        print(self.save_dir)
-
-        
 
         self.onc = ONC(token=token,
                        outPath=self.save_dir,)
 
-        if isinstance(self.hydrophone_identifier, dict):
-            print(hydrophone_identifier.keys())
+        self.log.debug('stream setting %s', self.hydrophone_identifier)
 
         self.api_url = 'https://data.oceannetworks.ca/api/deployments'
 
         self.built_in_delay = 6*60 # minutes, this is the built in delay for the ONC hydrophone data
+        self.backfill_window = timedelta(hours=6) # span of one getListByDevice query when backfilling
+
+        # last ingested archive file, so every listing only covers new time
+        self.cursor_path = os.path.join(self.save_dir, 'onc_cursor.json')
+        self.filters_path = os.path.join(self.save_dir, 'filters.json')
+        # data product options that worked for the device, found once and reused across restarts
+        self.dpo_cache_path = os.path.join(self.save_dir, 'dpo_cache.json')
+        self.min_order_window = timedelta(minutes=15) # shortest span worth a data product order
+        self._saved_filters = None
+        if os.path.exists(self.filters_path):
+            with open(self.filters_path, 'r') as f:
+                self._saved_filters = json.load(f)
 
         if not(os.path.exists(os.path.join(self.save_dir, 'reference.bib'))):
             self.get_citation()
@@ -99,16 +112,16 @@ class ONCStreamingClass(BaseStreamingClass):
         else:
             if(response.status_code == 400):
                 error = json.loads(str(response.content,'utf-8'))
-                print(error) # json response contains a list of errors, with an errorMessage and parameter
+                self.log.error('deployments lookup failed: %s', error) # json response contains a list of errors, with an errorMessage and parameter
             else:
-                print ('Error {} - {}'.format(response.status_code,response.reason))
+                self.log.error('deployments lookup failed: Error %s - %s', response.status_code, response.reason)
 
 
         correct_deployment = [d for d in response.json() if d['end'] is None][0] # no end time means it is currently deployed
 
 
         citation = correct_deployment['citation']['citation']
-        print(citation)
+        self.log.info('citation: %s', citation)
 
         
 
@@ -116,40 +129,257 @@ class ONCStreamingClass(BaseStreamingClass):
         if not(os.path.exists(os.path.join(self.save_dir, 'reference.bib'))):
             author, year, title, journal, doi = citation.split('. ')
             citation = "@misc{"+self.save_dir.split('/')[-1]+", author={"+author+"}, year={"+year+"}, title={"+title+"}, journal={"+journal+"}, doi={"+doi+"},}"
-            with open(os.path.join(self.save_dir, 'reference.bib'), 'w') as f:
-                f.write(citation)
+            self._write_reference(citation)
 
 
-    def _most_recent_file_date(self):
+    def _file_time(self, filename: str) -> datetime:
         """
-        return the datetime object of the most recent file in the save_dir
+        Parse the segment start time from an ONC file name, i.e. ICLISTENHF6095_20250525T000000.000Z.flac
         """
+        this_time = datetime.fromisoformat(re.search(r'\d{4}\d{2}\d{2}T\d{2}\d{2}\d{2}\.\d{3}Z', os.path.basename(filename)).group(0))
+        if this_time.tzinfo is None:
+            this_time = this_time.replace(tzinfo=timezone.utc)
+        return this_time
 
-        all_files = glob.glob(os.path.join(self.save_dir, '*.flac'))
+    def _index_untracked_files(self) -> list:
+        """
+        Register flac files that were written outside of the listing path (i.e. by a data product order).
+        """
+        untracked = []
+        with STAGE_SECONDS.time(station=self.station, stage='index_scan'):
+            filenames = glob.glob(os.path.join(self.save_dir, '*.flac'))
+        for filename in filenames:
+            if self.segment_index.contains(filename):
+                continue
+            try:
+                untracked.append((self._file_time(filename), filename))
+            except AttributeError:
+                # no timestamp in the file name
+                continue
+
+        # live segments are registered in time order, glob returns them in any order
+        new_files = []
+        for start_time, filename in sorted(untracked):
+            self._register_segment(filename, start_time)
+            new_files.append(filename)
+        return new_files
+
+
+    def _read_cursor(self) -> tuple:
+        """
+        Return (start time, file name) of the last ingested archive file, or (datetime.min, None).
+        """
+        if not os.path.exists(self.cursor_path):
+            return datetime.min.replace(tzinfo=timezone.utc), None
+        with open(self.cursor_path, 'r') as f:
+            cursor = json.load(f)
+        return datetime.fromisoformat(cursor['time']), cursor['filename']
 
-        # initialize with minimum date time
-        max_time = datetime.min
-        if max_time.tzinfo is None:
-            max_time = max_time.replace(tzinfo=timezone.utc)
+    def _write_cursor(self, filename: str) -> None:
+        write_atomic(self.cursor_path, json.dumps({'time': self._file_time(filename).isoformat(),
+                                                   'filename': os.path.basename(filename)}))
 
+    def _write_filters(self, filters: dict) -> None:
+        """
+        Record the query the archive was built from, only when it changes.
+        """
+        if filters == self._saved_filters:
+            return
+        write_atomic(self.filters_path, json.dumps(filters))
+        self._saved_filters = filters
 
-        for file in all_files:
-            this_time = datetime.fromisoformat(re.search(r'\d{4}\d{2}\d{2}T\d{2}\d{2}\d{2}\.\d{3}Z', os.path.basename(file)).group(0))
+    def _fetch_files(self, filenames: list) -> list:
+        """
+        Download archive files in parallel, at most max_workers at a time.
 
-            # try:
-            #     this_time = datetime.fromisoformat(re.search(r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}\.\d{6}Z', os.path.basename(file)).group(0))
-            # except:
-            #     this_time = datetime.fromisoformat(re.search(r'\d{4}-\d{2}-\d{2}T\d{2}\d{2}\d{2}\.\d{6}Z', os.path.basename(file)).group(0))
-            # # this_time = datetime.fromisoformat(this_time)
-            if this_time.tzinfo is None:
-                this_time = this_time.replace(tzinfo=timezone.utc)
-            if this_time > max_time:
-                max_time = this_time
+        A file already on disk (i.e. fetched before a crash, or by an earlier try of a
+        backfill shard) counts as fetched: the client refuses to overwrite it.
 
-        return max_time
+        Returns:
+            list: Local paths in time order, up to the first file that failed. Later
+                files are on disk and get picked up with it on the next poll.
+        """
+        def fetch(filename: str) -> str:
+            path = os.path.join(self.save_dir, os.path.basename(filename))
+            # the client only writes empty or missing files, anything else raises FileExistsError
+            if os.path.exists(path) and os.path.getsize(path) > 0:
+                self.log.debug('%s is already on disk', filename)
+                return path
+            self._check_fence()
+            try:
+                with STAGE_SECONDS.time(station=self.station, stage='download'):
+                    self.onc.getFile(filename, overwrite=False)
+            except FileExistsError:
+                self.log.debug('%s was written while it was fetched', filename)
+            return path
+
+        filenames = sorted(filenames, key=self._file_time)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [(filename, executor.submit(fetch, filename)) for filename in filenames]
 
-        
+        fetched_results = []
+        for filename, future in futures:
+            try:
+                path = future.result()
+            except Exception as e:
+                # a write refused by the fence ends the poll, it is not a segment error
+                self._check_fence()
+                SEGMENT_ERRORS.inc(station=self.station)
+                self.log.warning('failed to fetch %s: %r', filename, e)
+                break
+            if not os.path.exists(path):
+                self.log.warning('%s was not written by the archive', filename)
+                break
+            DOWNLOADED_BYTES.inc(os.path.getsize(path), station=self.station)
+            fetched_results.append(path)
+        return fetched_results
+
+    def _location_code(self) -> str:
+        """
+        Location of the current deployment of the device, from the deployments API.
+        """
+        deployments = self.onc.getDeployments({'deviceCode': self.hydrophone_identifier['deviceCode']})
+        assert len(deployments) > 0, f"No deployments found for {self.hydrophone_identifier['deviceCode']}"
+        current = [d for d in deployments if d['end'] is None] # no end time means it is currently deployed
+        if len(current) == 0:
+            current = sorted(deployments, key=lambda d: d['begin'])
+        return current[-1]['locationCode']
+
+    def _load_dpo_cache(self) -> dict:
+        """
+        Data product settings known to work for the device, or {}.
+        """
+        if not os.path.exists(self.dpo_cache_path):
+            return {}
+        with open(self.dpo_cache_path, 'r') as f:
+            return json.load(f).get(self.hydrophone_identifier['deviceCode'], {})
+
+    def _save_dpo_cache(self, entry: dict) -> None:
+        cache = {}
+        if os.path.exists(self.dpo_cache_path):
+            with open(self.dpo_cache_path, 'r') as f:
+                cache = json.load(f)
+        if len(entry) > 0:
+            cache[self.hydrophone_identifier['deviceCode']] = entry
+        else:
+            cache.pop(self.hydrophone_identifier['deviceCode'], None)
+        write_atomic(self.dpo_cache_path, json.dumps(cache, indent=1))
+
+    def _run_order(self, filters: dict, request_ids: dict, cancelled: threading.Event):
+        """
+        Request and run one data product order, waiting for it to be generated.
+
+        Returns:
+            dict: The run (runIds, fileCount), or None if the search was settled before it started.
+        """
+        if cancelled.is_set():
+            return None
+        request = self.onc.requestDataProduct(dict(filters)) # the client adds the token to the dict it is given
+        request_id = request['dpRequestId']
+        request_ids[request_id] = filters
+        if cancelled.is_set():
+            self.onc.cancelDataProduct(request_id)
+            return None
+
+        run = self.onc.runDataProduct(request_id, waitComplete=True)
+        if run['fileCount'] == 0 or len(run['runIds']) == 0:
+            raise ValueError(f"data product request {request_id} produced no files")
+        run['dpRequestId'] = request_id
+        return run
+
+    def _search_data_product(self, filters: dict) -> tuple:
+        """
+        Order the data product with every candidate set of options at once. The first
+        order that produces files wins and the others are cancelled.
+
+        Returns:
+            tuple: (options, run) of the winning order, or (None, None) if none produced files.
+        """
+        request_ids = {}
+        cancelled = threading.Event()
+        options, run = None, None
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(DPO_OPTIONS))) as executor:
+            futures = {executor.submit(self._run_order, {**filters, **candidate}, request_ids, cancelled): candidate
+                       for candidate in DPO_OPTIONS}
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    self.log.info('data product options %s failed: %r', futures[future], e)
+                    continue
+                if result is None or cancelled.is_set():
+                    continue
+                options, run = futures[future], result
+                cancelled.set()
+                for request_id in list(request_ids.keys()):
+                    if request_id == run['dpRequestId']:
+                        continue
+                    try:
+                        self.onc.cancelDataProduct(request_id)
+                    except Exception as e:
+                        self.log.debug('could not cancel data product request %s: %r', request_id, e)
+        return options, run
+
+    def _order_incremental(self, date_from: datetime, date_to: datetime) -> list:
+        """
+        Order the data product from the end of the newest archived segment up to date_to,
+        with the options cached for the device (searching for them on the first order).
+
+        Returns:
+            list: Files written.
+        """
+        latest = self.segment_index.latest()
+        if latest is not None:
+            date_from = max(date_from, latest.start_time + timedelta(seconds=latest.duration or 0))
+        if date_to - date_from < self.min_order_window:
+            # not enough new data to be worth an order yet
+            return []
+
+        cache = self._load_dpo_cache()
+        if 'locationCode' not in cache:
+            cache['locationCode'] = self._location_code()
+
+        filters = {'locationCode': cache['locationCode'],
+                   'deviceCategoryCode': 'HYDROPHONE',
+                   'dataProductCode': 'AD',
+                   'extension': 'flac',
+                   'dateFrom': date_from.strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+                   'dateTo': date_to.strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+                   'dpo_audioDownsample': -1,
+                   }
+
+        with STAGE_SECONDS.time(station=self.station, stage='order'):
+            if 'options' in cache:
+                options = cache['options']
+                try:
+                    run = self._run_order({**filters, **options}, {}, threading.Event())
+                except requests.HTTPError as e:
+                    # the options were rejected, search again on the next poll
+                    self.log.warning('cached data product options %s failed: %r', options, e)
+                    self._save_dpo_cache({})
+                    return []
+                except ValueError:
+                    # nothing new in the window
+                    return []
+            else:
+                options, run = self._search_data_product(filters)
+                if run is None:
+                    self.log.warning('no data product options produced files for %s', filters)
+                    return []
+                cache['options'] = options
+                cache['updated'] = datetime.now(timezone.utc).isoformat()
+                self._save_dpo_cache(cache)
+                self._write_filters({k: v for k, v in {**filters, **options}.items() if k not in ('dateFrom', 'dateTo')})
 
+        with STAGE_SECONDS.time(station=self.station, stage='download'):
+            for run_id in run['runIds']:
+                self.onc.downloadDataProduct(run_id, downloadResultsOnly=False, includeMetadataFile=False, overwrite=False)
+
+        if len(glob.glob(os.path.join(self.save_dir, '*.wav'))) > 0:
+            with STAGE_SECONDS.time(station=self.station, stage='convert'):
+                os.system('for s in '+self.save_dir.replace(' ', '\ ')+'/*.wav; do ffmpeg -i "${s}" -c:a flac "${s%.*}.flac"; rm "${s}"; done')
+
+        return self._index_untracked_files()
 
     def download_data(self) -> list:
         """
@@ -166,14 +396,19 @@ class ONCStreamingClass(BaseStreamingClass):
         built_in_delay = current_time - timedelta(minutes=self.built_in_delay)
         # built in delay as the maximum time between built in delay and _most_recent_file_date
         built_in_delay = max(built_in_delay, self._most_recent_file_date())
+        # and never before the last ingested file
+        cursor_time, cursor_file = self._read_cursor()
+        built_in_delay = max(built_in_delay, cursor_time)
 
 
         # get omegaconf as dictionary
         filters = self.hydrophone_identifier
-        if isinstance(filters, DictConfig) | isinstance(filters, OmegaConf):
+        if not isinstance(filters, dict):
+            from omegaconf import OmegaConf # only a DictConfig from hydra gets here
             filters = OmegaConf.to_container(filters, resolve=True)
 
         assert isinstance(filters, dict), "Hydrophone identifier must be a dictionary."
+        filters = dict(filters) # the stream setting itself is left untouched
 
         assert 'deviceCode' in filters.keys(), "Hydrophone identifier must contain 'deviceCode' key."
         filters.update({'extension':'flac',
@@ -194,58 +429,72 @@ class ONCStreamingClass(BaseStreamingClass):
         # deviceCode, dateFrom, dateTo, extension, rowLimit
         assert set(list(filters_archived.keys())) == set(['deviceCode', 'dateFrom', 'dateTo', 'extension', 'rowLimit']), "Filters must contain 'deviceCode', 'dateFrom', 'dateTo', 'extension' and 'rowLimit' keys."
 
-        print(filters_archived)
+        self.log.debug('listing filters %s', filters_archived)
         fetched_results = []
-        results = self.onc.getListByDevice(filters_archived)
+        with STAGE_SECONDS.time(station=self.station, stage='listing'):
+            results = self.onc.getListByDevice(filters_archived)
         if len(results['files'])>0:
-            # download the files
-            # print(results['files'])
-            prev_files = [f for f in results['files'] if os.path.exists(os.path.join(self.save_dir, os.path.basename(f)))]
-            if set(results['files']) == set(prev_files):
+            # the listing starts at the cursor, so the cursor file itself comes back
+            missing = [f for f in results['files'] if os.path.basename(f) != cursor_file and not self.segment_index.contains(f)]
+            if len(missing) == 0:
                 # all files have already been downloaded
                 return fetched_results
-            # print(results)
-            result = self.onc.getDirectFiles(filters_archived)
-            print('result', result)
-            # save the filters to json in fname
-            with open(os.path.join(self.save_dir, 'filters.json'), 'w') as f:
-                json.dump(filters_archived, f)
 
-            fetched_results = [os.path.join(self.save_dir, os.path.basename(f)) for f in results['files'] if f not in prev_files]
+            # the query without its time range
+            self._write_filters({k: v for k, v in filters_archived.items() if k not in ('dateFrom', 'dateTo')})
+
+            # only the new files, not the whole window
+            fetched_results = self._fetch_files(missing)
+            for filename in fetched_results:
+                self._register_segment(filename)
+            if len(fetched_results) > 0:
+                self._write_cursor(fetched_results[-1])
 
 
         else:
-            # optional parameters to loop through and try:
-            # filters_orig = {'locationCode': locationCode,'deviceCategoryCode':'HYDROPHONE','dataProductCode':'AD','extension':'flac','dateFrom':built_in_delay.strftime('%Y-%m-%dT%H:%M:%S.000Z'),'dateTo':current_time.strftime('%Y-%m-%dT%H:%M:%S.000Z'),'dpo_audioDownsample':-1} #, 'dpo_audioFormatConversion':0}
-            filters_orig = {'deviceCode': filters['deviceCode'],'deviceCategoryCode':'HYDROPHONE','dataProductCode':'AD','extension':'flac','dateFrom':built_in_delay.strftime('%Y-%m-%dT%H:%M:%S.000Z'),'dateTo':current_time.strftime('%Y-%m-%dT%H:%M:%S.000Z'),'dpo_audioDownsample':-1} #, 'dpo_audioFormatConversion':0}
-            filters_orig = {'locationCode': 'FGPD','deviceCategoryCode':'HYDROPHONE','dataProductCode':'AD','extension':'flac','dateFrom':built_in_delay.strftime('%Y-%m-%dT%H:%M:%S.000Z'),'dateTo':current_time.strftime('%Y-%m-%dT%H:%M:%S.000Z'),'dpo_audioDownsample':-1} #, 'dpo_audioFormatConversion':0}
-
-            is_done = False
-            for d in [{'dpo_hydrophoneDataDiversionMode':'OD'}, {'dpo_hydrophoneDataDiversionMode':'OD', 'dpo_hydrophoneChannel':'All'},{'dpo_hydrophoneChannel':'All'},{'dpo_audioFormatConversion':0,'dpo_hydrophoneDataDiversionMode':'OD','dpo_hydrophoneChannel':'All'},{'dpo_audioFormatConversion':0,'dpo_hydrophoneDataDiversionMode':'OD'},{'dpo_audioFormatConversion':1,'dpo_hydrophoneDataDiversionMode':'OD','dpo_hydrophoneChannel':'All'}]:
-                # for d in [{'dpo_hydrophoneDataDiversionMode':'OD'}, {'dpo_hydrophoneDataDiversionMode':'OD', 'dpo_hydrophoneChannel':'All'},{'dpo_hydrophoneChannel':'All'}]:
-                filters = deepcopy(filters_orig)
-                filters.update(d)
-                try:
-                    print(filters)
-                    result  = self.onc.orderDataProduct(filters, includeMetadataFile=False)
-                    print("results", results)
-                    if len(result['files']) == 0:
-                        continue
-                    # save the filters to json in fname
-                    with open(os.path.join(self.save_dir, 'filters.json'), 'w') as f:
-                        json.dump(filters, f)
-                    is_done=True
-                    break
-                except:
-                    continue
+            # the device has no archived files, its data is only offered as data products
+            fetched_results = self._order_incremental(built_in_delay, current_time)
 
-        if filters['extension'] == 'wav':
-            os.system('for s in '+self.save_dir.replace(' ', '\ ')+'/*.wav; do ffmpeg -i "${s}" -c:a flac "${s%.*}.flac"; rm "${s}"; done')
+        return fetched_results
 
-        
+    def backfill_shards(self, start: datetime, end: datetime) -> list:
+        """
+        Split the period into windows of `backfill_window`, one getListByDevice query each.
+        """
+        shards = []
+        shard_start = start
+        while shard_start < end:
+            shards.append((shard_start, min(shard_start + self.backfill_window, end)))
+            shard_start += self.backfill_window
+        return shards
+
+    def backfill_shard(self, start: datetime, end: datetime) -> list:
+        """
+        Fetch the archived files of one time window that are not in the archive.
+        """
+        assert 'deviceCode' in self.hydrophone_identifier.keys(), "Hydrophone identifier must contain 'deviceCode' key."
+        filters = {'deviceCode': self.hydrophone_identifier['deviceCode'],
+                   'extension': 'flac',
+                   'dateFrom': start.strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+                   'dateTo': end.strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+                   'rowLimit': 80000,
+                   }
+
+        results = self.onc.getListByDevice(filters, allPages=True)
+        missing = [f for f in results['files'] if not self.segment_index.contains(f)]
+        if len(missing) == 0:
+            return []
+
+        fetched_results = self._fetch_files(missing)
+        for filename in fetched_results:
+            self._register_segment(filename, live=False)
+
+        if len(fetched_results) < len(missing):
+            # keeps the shard out of the checkpoint so it is retried
+            raise IOError(f"{len(missing) - len(fetched_results)} of {len(missing)} files between {start} and {end} were not fetched")
 
         return fetched_results
-    
+
     def latest_file(self) -> None:
         """
         Get the latest file in the save directory.
@@ -253,25 +502,11 @@ class ONCStreamingClass(BaseStreamingClass):
         Returns:
             str: Path to the latest file.
         """
-        all_files = glob.glob(os.path.join(self.save_dir, '*.flac'))
-        if len(all_files) == 0:
+        latest = self.segment_index.latest()
+        if latest is None:
             return None
-        
-        latest_file = (None, None)
-
-        for filename in all_files:
-            this_time = datetime.fromisoformat(re.search(r'\d{4}\d{2}\d{2}T\d{2}\d{2}\d{2}\.\d{3}Z', os.path.basename(filename)).group(0))
-            if this_time.tzinfo is None:
-                this_time = this_time.replace(tzinfo=timezone.utc)
-            if latest_file[1] is None:
-                latest_file = (filename, this_time)
-            elif this_time > latest_file[1]:
-                latest_file = (filename, this_time)
-
 
         # save the filename in a text file called latest.txt
-        with open(os.path.join(self.save_dir, 'latest.txt'), 'w+') as f:
-            f.write(latest_file[0].replace(self.save_dir, '').strip('/'))
+        self._write_latest(latest.filename)
 
         return
-            
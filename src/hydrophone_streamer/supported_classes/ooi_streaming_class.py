@@ -3,34 +3,44 @@ OOI Streaming Class
 """
 
 
+from hydrophone_streamer.supported_classes.async_base_streaming_class import AsyncBaseStreamingClass
 from hydrophone_streamer.supported_classes.base_streaming_class import BaseStreamingClass
 
 from datetime import datetime, timedelta, timezone
 
-import requests
-from bs4 import BeautifulSoup
+import asyncio
 import os
-from urllib.parse import urljoin
 import re
 
 
-import obspy
 import glob
+from contextlib import closing
+from functools import partial
+
+from hydrophone_streamer.downloader import ListingFetcher, download_file, probe
+from hydrophone_streamer.listing import ListingCache
+from hydrophone_streamer.metrics import BACKLOG, DOWNLOADED_BYTES, SEGMENT_ERRORS, SKIPPED_FILES, STAGE_SECONDS
+from hydrophone_streamer.pipeline import SegmentPipeline
+from hydrophone_streamer.transcode import StreamingMseedDecoder, describe_flac, mseed_to_flac
 
 
 
 class OOIStreamingClass(BaseStreamingClass):
-    def __init__(self, hydrophone_identifier: dict, save_dir: str= "data") -> None:
+    network = 'ooi'
+    # raw data servers the class accepts urls from
+    url_prefixes = ('https://rawdata.oceanobservatories.org/files/',
+                    'https://rawdata-west.oceanobservatories.org/files/')
+
+    def __init__(self, hydrophone_identifier: dict, save_dir: str= "data", **kwargs) -> None:
         """
         Initialize the OOIStreamingClass with the hydrophone identifier.
 
         Args:
             hydrophone_identifier (dict): Dictionary containing hydrophone configuration.
+            **kwargs: Passed on to BaseStreamingClass (i.e. max_workers).
         """
-        super().__init__(hydrophone_identifier)
-        self.hydrophone_identifier = hydrophone_identifier
-        print(self.hydrophone_identifier)
-        self.save_dir = save_dir
+        super().__init__(hydrophone_identifier, save_dir=save_dir, **kwargs)
+        self.log.debug('stream setting %s', self.hydrophone_identifier)
 
         self.metadata = {'CE02SHBP': {'latitude': 44.6371, 'longitude': -124.306, 'depth': 79, 'reference_designator':'CE02SHBP-LJ01D-06-CTDBPN106'},
                          'CE04OSBP': {'latitude': 44.3695, 'longitude': -124.954, 'depth': 579 , 'reference_designator':'CE04OSBP-LJ01C-06-DOSTAD108'},
@@ -40,19 +50,14 @@ class OOIStreamingClass(BaseStreamingClass):
                         'RS03AXPS': {'latitude': 45.8305, 'longitude': -129.7535, 'depth': 2607, 'reference_designator':'RS03AXPS-PC03A-4A-CTDPFA303'},
         }
 
-        os.makedirs(self.save_dir, exist_ok=True)
-
-
-        if isinstance(self.hydrophone_identifier, dict):
-            print(hydrophone_identifier.keys())
 
         assert 'url' in self.hydrophone_identifier.keys(), "Hydrophone identifier must contain 'url' key."
                 
         self.url = self.hydrophone_identifier['url']
 
-        assert self.url.startswith('https://rawdata.oceanobservatories.org/files/'), "URL is not recognised for OOI"
+        assert self.url.startswith(self.url_prefixes), "URL is not recognised for OOI"
         # assert that url is a valid URL
-        response = requests.get(self.url)
+        response = self.session.get(self.url)
         if response.status_code != 200:
             raise ValueError(f"Invalid URL: {self.url}. Status code: {response.status_code}")
         
@@ -67,48 +72,53 @@ class OOIStreamingClass(BaseStreamingClass):
 
         self.built_in_delay = 30 # minutes
 
+        self.listing_fetcher = ListingFetcher(session=self.session)
+        self.listing_cache = ListingCache(self._file_time)
 
-    def _most_recent_file_date(self, return_file: bool = False):
-        """
-        return the datetime object of the most recent file in the save_dir
-        """
-
-        all_files = glob.glob(os.path.join(self.save_dir, '*.flac'))
+        # mseed -> flac runs in worker processes, samples are only sent back if a sink needs them
+        self.pipeline = SegmentPipeline(self._download_segment,
+                                        partial(mseed_to_flac, keep_samples=len(self.sample_sinks) > 0),
+                                        download_workers=self.max_workers,
+                                        transcode_workers=self.transcode_workers,
+                                        max_pending=self.max_pending,
+                                        check=self._check_fence)
 
-        # initialize with minimum date time
-        max_time = datetime.min
-        if max_time.tzinfo is None:
-            max_time = max_time.replace(tzinfo=timezone.utc)
 
-        max_file = None
-        for file in all_files:
-
-            try:
-                this_time = datetime.fromisoformat(re.search(r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}\.\d{6}Z', os.path.basename(file)).group(0))
-            except:
-                this_time = datetime.fromisoformat(re.search(r'\d{4}-\d{2}-\d{2}T\d{2}\d{2}\d{2}\.\d{6}Z', os.path.basename(file)).group(0))
-            # this_time = datetime.fromisoformat(this_time)
-            if this_time.tzinfo is None:
-                this_time = this_time.replace(tzinfo=timezone.utc)
-            if this_time > max_time:
-                max_time = this_time
-                max_file = file
-
-        if return_file:
-            return max_time, max_file
+    def _file_time(self, filename: str) -> datetime:
+        """
+        Parse the segment start time from an OOI file name, with or without the colons.
+        """
+        try:
+            this_time = datetime.fromisoformat(re.search(r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}\.\d{6}Z', os.path.basename(filename)).group(0))
+        except AttributeError:
+            this_time = datetime.fromisoformat(re.search(r'\d{4}-\d{2}-\d{2}T\d{2}\d{2}\d{2}\.\d{6}Z', os.path.basename(filename)).group(0))
+        if this_time.tzinfo is None:
+            this_time = this_time.replace(tzinfo=timezone.utc)
+        return this_time
 
 
-        return max_time
+    def _day_urls(self, start: datetime, end: datetime) -> list:
+        """
+        Return the listing url of every day directory between start and end, so the
+        previous day is still queried while the catch-up window crosses midnight UTC.
+        """
+        day_urls = []
+        day = min(start, end).date()
+        while day <= end.date():
+            day_urls.append(os.path.join(self.url, day.strftime('%Y/%m/%d/')))
+            day += timedelta(days=1)
 
+        # directories that fell out of the window are not needed any more
+        for url in self.listing_cache.retain(day_urls):
+            self.listing_fetcher.forget(url)
 
+        return day_urls
 
 
-    def download_data(self):
+    def _window(self) -> tuple:
         """
-        Download data from the OOI hydrophone.
-
-        Returns:
-            list: List of fetched results.
+        (current time, five minutes ago, start of the listing window): the window starts at the
+        newest segment in the index, but never more than `built_in_delay` minutes back.
         """
         # current time utc
         current_time = datetime.now(timezone.utc)
@@ -122,135 +132,410 @@ class OOIStreamingClass(BaseStreamingClass):
         built_in_delay = max(built_in_delay, self._most_recent_file_date())
 
 
-        #https://rawdata-west.oceanobservatories.org/files/CE02SHBP/LJ01D/11-HYDBBA106/2018/01/01/
+        if built_in_delay.tzinfo is None:
+            built_in_delay = built_in_delay.replace(tzinfo=timezone.utc)
 
-        url_builder = os.path.join(self.url, five_minutes_ago.strftime('%Y/%m/%d/')) # add the extensions to download the files from this date
+        return current_time, five_minutes_ago, built_in_delay
 
-        response = requests.get(url_builder)
-
-        print(response.status_code, type(response.status_code))
-
-        fetched_results = []
-
-        if response.status_code == 200:
-            soup = BeautifulSoup(response.text, 'html.parser')
+    def _listed_candidates(self, url_builder: str, response, built_in_delay: datetime, five_minutes_ago: datetime, current_time: datetime) -> list:
+        """
+        Segments of one day listing that start in the window and are not in the index.
 
-            assert len(soup.find_all('a'))>0, f"No links found in the response from {url_builder}"
+        Returns:
+            list: (start time, url, local path) of every segment to fetch.
+        """
+        self.log.debug('listing %s %d %s', url_builder, response.status_code, 'modified' if response.modified else 'not modified')
 
-            for link in reversed(soup.find_all('a')):
-                href = link.get('href')
-                if href.endswith('.mseed'):
-                    # for example href is ./OO-HYEA2--YDH-2018-01-01T00:00:00.000000.mseed
-                    # and url is https://rawdata-west.oceanobservatories.org/files/CE02SHBP/LJ01D/11-HYDBBA106/2018/01/01/
-                    # we want to save the file to os.path.join(base_dir, 'CE02SHBP/LJ01D/11-HYDBBA106/2018/01/01/OO-HYEA2--YDH-2018-01-01T00:00:00.000000.mseed')
-                    absolute_url = urljoin(url_builder, href)
-                    print(absolute_url)
+        if response.status_code == 404 and url_builder.endswith(five_minutes_ago.strftime('%Y/%m/%d/')):
+            # today's directory is created with its first segment
+            return []
+        if response.status_code != 200:
+            raise ValueError(f"Failed to fetch data from {url_builder}. Status code: {response.status_code}")
 
-                    
-                    # absolute_url example: https://rawdata.oceanobservatories.org/files/CE02SHBP/LJ01D/HYDBBA106/2025/05/24/OO-HYEA2--YDH-2025-05-24T23:55:00.000000Z.mseed
-                    # filter using regex to extract the filename with timestamp
-                    filename_timestamp = datetime.fromisoformat(re.search(r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}\.\d{6}Z', absolute_url).group(0))
+        if response.modified:
+            # only the links appended since the last poll are parsed
+            with STAGE_SECONDS.time(station=self.station, stage='parse_listing'):
+                self.listing_cache.update(url_builder, response.text)
+
+        candidates = []
+        # absolute_url example: https://rawdata.oceanobservatories.org/files/CE02SHBP/LJ01D/HYDBBA106/2025/05/24/OO-HYEA2--YDH-2025-05-24T23:55:00.000000Z.mseed
+        for filename_timestamp, absolute_url in self.listing_cache.entries(url_builder, built_in_delay, current_time):
+            local_path = os.path.join(self.save_dir, os.path.basename(absolute_url)).replace(':','')
+
+            # a leftover .mseed is complete (downloads are renamed into place once verified) and only needs transcoding
+            if not self.segment_index.contains(local_path.replace('.mseed','.flac')):
+                candidates.append((filename_timestamp, absolute_url, local_path))
+        return candidates
+
+    def _register_transcoded(self, segment) -> None:
+        # timed in the worker process, or on the download thread when streaming
+        STAGE_SECONDS.observe(segment.decode_seconds, station=self.station, stage='decode')
+        STAGE_SECONDS.observe(segment.encode_seconds, station=self.station, stage='encode')
+        self._register_segment(segment.path, segment.start_time, segment.duration,
+                               samples=segment.samples, sample_rate=segment.sample_rate, gaps=segment.gaps)
+        segment.samples = None
+
+    def _write_reference_once(self, built_in_delay: datetime, current_time: datetime, url_builder: str) -> None:
+        if not(os.path.exists(os.path.join(self.save_dir, 'reference.bib'))):
+            bibtex=f"""@misc{{{self.metadata[self.deployment]['reference_designator']}_{current_time.strftime('%Y%m%d')},
+    'title': 'NSF Ocean Observatories Initiative',
+    'year': {datetime.now().strftime('%Y')},
+    'howpublished': 'Instrument and/or data product(s) {self.metadata[self.deployment]['reference_designator']} data from {built_in_delay.strftime("%Y-%m-%d")} to {current_time.strftime("%Y-%m-%d")}',
+    'publisher': 'Raw Data Archive',
+    'url': {url_builder},
+    'accessed': {datetime.now().strftime("%Y-%m-%d")},}}"""
+        
+            self._write_reference(bibtex)
 
-                    # print('filename_timestamp:', filename_timestamp, 
-                    #       'built_in_delay:', built_in_delay,
-                    #       'current_time:', current_time)
+    def download_data(self):
+        """
+        Download data from the OOI hydrophone.
 
-                    if built_in_delay.tzinfo is None:
-                        built_in_delay = built_in_delay.replace(tzinfo=timezone.utc)
-                    if current_time.tzinfo is None:
-                        current_time = current_time.replace(tzinfo=timezone.utc)
-                    if filename_timestamp <= built_in_delay:
-                        continue
-                    if filename_timestamp > current_time:
-                        continue
+        Returns:
+            list: List of fetched results.
+        """
+        current_time, five_minutes_ago, built_in_delay = self._window()
 
-                    d = requests.get(absolute_url)
-                    if int(d.headers['Content-Length'])<1000000:
-                        continue
+        fetched_results = []
 
+        candidates = []
+
+        for url_builder in self._day_urls(built_in_delay, five_minutes_ago):
+            #https://rawdata-west.oceanobservatories.org/files/CE02SHBP/LJ01D/11-HYDBBA106/2018/01/01/
+            with STAGE_SECONDS.time(station=self.station, stage='listing'):
+                response = self.listing_fetcher.fetch(url_builder)
+            candidates.extend(self._listed_candidates(url_builder, response, built_in_delay, five_minutes_ago, current_time))
+
+        # downloads feed a pool of transcoding processes; results come back in timestamp order so latest.txt never moves backwards
+        candidates.sort(key=lambda x: x[0])
+        BACKLOG.set(len(candidates), station=self.station)
+        with closing(self.pipeline.run(candidates)) as results:
+            for (filename_timestamp, absolute_url, local_path), future in results:
+                BACKLOG.dec(station=self.station)
+                try:
+                    segment = future.result()
+                except Exception as e:
+                    # a transcode refused by the fence ends the poll, it is not a segment error
+                    self._check_fence()
+                    SEGMENT_ERRORS.inc(station=self.station)
+                    self.log.warning('failed to fetch segment starting %s: %r', filename_timestamp, e)
+                    continue
+                if segment is None:
+                    continue
+                self._register_transcoded(segment)
+                fetched_results.append(segment.path)
+
+        if len(candidates) > 0:
+            self.log.info('pipeline throughput %s', self.pipeline.report())
+
+        self._write_reference_once(built_in_delay, current_time, url_builder)
 
-                    local_path = os.path.join(self.save_dir, os.path.basename(absolute_url)).replace(':','')
-                    # print('local_path:',local_path)
+        return fetched_results
 
+    def _existing_segment(self, job: tuple):
+        """
+        The TranscodedSegment of a FLAC already on disk, or None.
+        """
+        filename_timestamp, absolute_url, local_path = job
+        flac_path = local_path.replace('.mseed','.flac')
+        if not os.path.exists(flac_path):
+            return None
+        # transcoded by a run that stopped before indexing it, only the mseed may be left over
+        if os.path.exists(local_path):
+            os.remove(local_path)
+        return describe_flac(flac_path, filename_timestamp)
+
+    def _download_segment(self, job: tuple):
+        """
+        Download one mseed segment. Runs on a download thread of the pipeline.
 
-                    # Download the file
-                    if not(os.path.exists(local_path) or os.path.exists(local_path.replace('.mseed','.flac'))):
-                        # use wget silently and non blocking
-                        # print(f'wget -q {absolute_url} -O '+ local_path.replace(" ", "\ ")) 
-                        os.system(f'wget -q {absolute_url} -O '+local_path.replace(" ", "\ "))
+        Args:
+            job (tuple): (start time, url, local path)
 
+        Returns:
+            str: Path to the downloaded mseed, or None if the segment was skipped.
+                With streaming_decode, the TranscodedSegment written while it downloaded,
+                and for a FLAC already on disk, its TranscodedSegment.
+        """
+        filename_timestamp, absolute_url, local_path = job
+        existing = self._existing_segment(job)
+        if existing is not None:
+            return existing
+
+        with self.host_limiter.limit(absolute_url):
+            # metadata only, the body is fetched once below
+            with STAGE_SECONDS.time(station=self.station, stage='probe'):
+                remote = probe(absolute_url, session=self.session)
+            if remote.size is not None and remote.size<1000000:
+                SKIPPED_FILES.inc(station=self.station, reason='too_small')
+                return None
+
+            if self.streaming_decode:
+                return self._stream_segment(absolute_url, local_path, remote)
+
+            with STAGE_SECONDS.time(station=self.station, stage='download'):
+                n_bytes = download_file(absolute_url, local_path, session=self.session,
+                                        expected_size=remote.size, etag=remote.etag)
+            DOWNLOADED_BYTES.inc(n_bytes, station=self.station)
+
+        return local_path
+
+    def _stream_segment(self, absolute_url: str, local_path: str, remote):
+        """
+        Download one mseed segment and transcode its records as they arrive, see StreamingMseedDecoder.
+        The mseed is still written to disk, so an interrupted download resumes where it
+        stopped and a file the decoder cannot handle is transcoded whole instead.
 
-                        # convert from mseed to flac
-                        mseed2flac([local_path],)
+        Returns:
+            Union[TranscodedSegment, str]: The segment, or the path of the mseed to hand to the transcoding pool.
+        """
+        decoder = StreamingMseedDecoder(local_path.replace('.mseed','.flac'))
+        errors = []
 
-                        fetched_results.append(local_path.replace('.mseed','.flac'))
+        def on_chunk(chunk: bytes) -> None:
+            if len(errors) > 0:
+                return
+            try:
+                decoder.feed(chunk)
+            except Exception as e:
+                # keep downloading, the file is transcoded once it is complete
+                errors.append(e)
+                decoder.abort()
+
+        try:
+            with STAGE_SECONDS.time(station=self.station, stage='download'):
+                n_bytes = download_file(absolute_url, local_path, session=self.session,
+                                        expected_size=remote.size, etag=remote.etag, on_chunk=on_chunk)
+        except BaseException:
+            decoder.abort()
+            raise
+        DOWNLOADED_BYTES.inc(n_bytes, station=self.station)
+
+        if len(errors) == 0:
+            try:
+                self._check_fence()
+            except BaseException:
+                decoder.abort()
+                raise
+            try:
+                segment = decoder.close()
+            except Exception as e:
+                decoder.abort()
+                errors.append(e)
+            else:
+                os.remove(local_path)
+                return segment
+
+        self.log.warning('streaming decode of %s failed (%r), transcoding the whole file', os.path.basename(local_path), errors[0])
+        return local_path
+
+    def backfill_shards(self, start: datetime, end: datetime) -> list:
+        """
+        One shard per day directory of the archive.
+        """
+        shards = []
+        shard_start = start
+        while shard_start < end:
+            next_day = datetime.combine(shard_start.date() + timedelta(days=1), datetime.min.time(), tzinfo=timezone.utc)
+            shards.append((shard_start, min(next_day, end)))
+            shard_start = next_day
+        return shards
+
+    def backfill_shard(self, start: datetime, end: datetime) -> list:
+        """
+        Fetch the segments of one day directory that start in [start, end) and are not in the archive.
+        """
+        day_url = os.path.join(self.url, start.strftime('%Y/%m/%d/'))
+        with self.host_limiter.limit(day_url):
+            response = self.session.get(day_url)
+        if response.status_code == 404:
+            # no data recorded that day
+            return []
+        if response.status_code != 200:
+            raise ValueError(f"Failed to fetch data from {day_url}. Status code: {response.status_code}")
 
-        else:
-            raise ValueError(f"Failed to fetch data from {url_builder}. Status code: {response.status_code}")
+        # a private listing, the live poll's cache only holds the last couple of days
+        listing = ListingCache(self._file_time)
+        listing.update(day_url, response.text)
 
-        if not(os.path.exists(os.path.join(self.save_dir, 'reference.bib'))):
-            bibtex=f"""@misc{{{self.metadata[self.deployment]['reference_designator']}_{current_time.strftime('%Y%m%d')},
-    'title': 'NSF Ocean Observatories Initiative',
-    'year': {datetime.now().strftime('%Y')},
-    'howpublished': 'Instrument and/or data product(s) {self.metadata[self.deployment]['reference_designator']} data from {built_in_delay.strftime("%Y-%m-%d")} to {current_time.strftime("%Y-%m-%d")}',
-    'publisher': 'Raw Data Archive',
-    'url': {url_builder},
-    'accessed': {datetime.now().strftime("%Y-%m-%d")},}}"""
-        
-            with open(os.path.join(self.save_dir, 'reference.bib'), 'w') as f:
-                f.write(bibtex)
+        fetched_results = []
+        candidates = []
+        for filename_timestamp, absolute_url in listing.entries(day_url, datetime.min.replace(tzinfo=timezone.utc), end):
+            if filename_timestamp < start or filename_timestamp >= end:
+                continue
+            local_path = os.path.join(self.save_dir, os.path.basename(absolute_url)).replace(':','')
+            flac_path = local_path.replace('.mseed','.flac')
+            if self.segment_index.contains(flac_path):
+                continue
+            if os.path.exists(flac_path):
+                # transcoded by an earlier run that stopped before indexing it
+                self._register_segment(flac_path, live=False)
+                fetched_results.append(flac_path)
+                continue
+            candidates.append((filename_timestamp, absolute_url, local_path))
+
+        # a pipeline per shard, they all share the transcoding process pool
+        pipeline = SegmentPipeline(self._download_segment, mseed_to_flac,
+                                   download_workers=self.max_workers,
+                                   transcode_workers=self.transcode_workers,
+                                   max_pending=self.max_pending,
+                                   check=self._check_fence)
+        with closing(pipeline.run(sorted(candidates, key=lambda x: x[0]))) as results:
+            for (filename_timestamp, absolute_url, local_path), future in results:
+                segment = future.result()
+                if segment is None:
+                    continue
+                self._register_segment(segment.path, segment.start_time, segment.duration, live=False)
+                fetched_results.append(segment.path)
 
         return fetched_results
-    
+
     def latest_file(self) -> None:
         """
         Log the most recent audio file to a file for streaming purposes.
         """
         # get the most recent file in the save_dir
         this_time, max_file = self._most_recent_file_date(return_file=True)
-
-
+        if max_file is None:
+            return
 
         # save the filename in a text file called latest.txt
-        with open(os.path.join(self.save_dir, 'latest.txt'), 'w+') as f:
-            f.write(max_file.replace(self.save_dir, '').strip('/')) # remove the save_dir and .flac extension
+        self._write_latest(max_file)
 
         return
 
 
+class AsyncOOIStreamingClass(AsyncBaseStreamingClass, OOIStreamingClass):
+    """
+    OOIStreamingClass on the event loop (hydrophone_network="ooi_async"): listings,
+    probes and downloads go through the aiohttp helpers of aio.py, so a station
+    waiting on the raw data server holds no thread, and the mseed is transcoded on
+    the shared process pool. With streaming_decode the file is transcoded record by
+    record once it is on disk, which bounds the memory but does not overlap with the
+    download. Backfills run the synchronous path of OOIStreamingClass.
+    """
+    def __init__(self, *args, **kwargs) -> None:
+        """
+        Takes the arguments of OOIStreamingClass.
+        """
+        super().__init__(*args, **kwargs)
+        from hydrophone_streamer.aio import AsyncListingFetcher
+        self.listing_fetcher = AsyncListingFetcher()
+
+    async def download_data(self) -> list:
+        """
+        Download data from the OOI hydrophone without blocking the event loop.
+
+        Returns:
+            list: List of fetched results.
+        """
+        from hydrophone_streamer.aio import get_host_limiter
+
+        current_time, five_minutes_ago, built_in_delay = await self.run_blocking(self._window)
+        host_limiter = get_host_limiter(self.max_connections_per_host)
+
+        candidates = []
+        for url_builder in self._day_urls(built_in_delay, five_minutes_ago):
+            with STAGE_SECONDS.time(station=self.station, stage='listing'):
+                async with host_limiter.limit(url_builder):
+                    response = await self.listing_fetcher.fetch(url_builder)
+            candidates.extend(await self.run_blocking(self._listed_candidates, url_builder, response,
+                                                      built_in_delay, five_minutes_ago, current_time))
+
+        # every segment is a task, at most max_pending in flight and max_workers downloading;
+        # results are awaited in timestamp order so latest.txt never moves backwards
+        candidates.sort(key=lambda x: x[0])
+        BACKLOG.set(len(candidates), station=self.station)
+        in_flight = asyncio.Semaphore(self.max_pending)
+        downloads = asyncio.Semaphore(self.max_workers)
+        tasks = [asyncio.create_task(self._fetch_segment(job, in_flight, downloads, host_limiter)) for job in candidates]
+
+        fetched_results = []
+        try:
+            for (filename_timestamp, absolute_url, local_path), task in zip(candidates, tasks):
+                BACKLOG.dec(station=self.station)
+                try:
+                    segment = await task
+                except Exception as e:
+                    # a transcode refused by the fence ends the poll, it is not a segment error
+                    self._check_fence()
+                    SEGMENT_ERRORS.inc(station=self.station)
+                    self.log.warning('failed to fetch segment starting %s: %r', filename_timestamp, e)
+                    continue
+                if segment is None:
+                    continue
+                await self.run_blocking(self._register_transcoded, segment)
+                fetched_results.append(segment.path)
+        finally:
+            # i.e. the lease was lost while registering, the rest resume from their part files
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        await self.run_blocking(self._write_reference_once, built_in_delay, current_time, url_builder)
+
+        return fetched_results
 
+    async def _fetch_segment(self, job: tuple, in_flight: asyncio.Semaphore, downloads: asyncio.Semaphore, host_limiter):
+        """
+        Download one mseed segment and transcode it on the process pool.
 
-def mseed2flac(filenames):
+        Returns:
+            TranscodedSegment: The segment, or None if it was skipped.
+        """
+        from hydrophone_streamer import aio
+
+        filename_timestamp, absolute_url, local_path = job
+        async with in_flight:
+            existing = await self.run_blocking(self._existing_segment, job)
+            if existing is not None:
+                return existing
+
+            async with downloads, host_limiter.limit(absolute_url):
+                # metadata only, the body is fetched once below
+                with STAGE_SECONDS.time(station=self.station, stage='probe'):
+                    remote = await aio.probe(absolute_url, session=self._client())
+                if remote.size is not None and remote.size<1000000:
+                    SKIPPED_FILES.inc(station=self.station, reason='too_small')
+                    return None
+
+                with STAGE_SECONDS.time(station=self.station, stage='download'):
+                    n_bytes = await aio.download_file(absolute_url, local_path, session=self._client(),
+                                                      expected_size=remote.size, etag=remote.etag)
+            DOWNLOADED_BYTES.inc(n_bytes, station=self.station)
+
+            self._check_fence()
+            return await self.run_cpu(mseed_to_flac, local_path, keep_samples=len(self.sample_sinks) > 0,
+                                      streaming=self.streaming_decode)
+
+
+def mseed2flac(filenames, keep_samples: bool = False):
+    """
+    Transcode miniSEED files to FLAC in process and remove the originals.
+
+    Args:
+        filenames (Union[str, list]): Path(s) to .mseed files, wildcards are resolved.
+        keep_samples (bool): Return the decoded samples with every segment.
+
+    Returns:
+        list: TranscodedSegment for every file that was written.
+    """
     # resolve wildcard characters
-    # print(filenames)
     if type(filenames)==str:
         if '*' in filenames:
             filenames = glob.glob(filenames, recursive=True)
+        else:
+            filenames = [filenames]
     else:
         if len(filenames)==1:
             if '*' in filenames[0]:
                 filenames = glob.glob(filenames[0], recursive=True)
 
-    # print(filenames)
-    # print('here')
+    segments = []
     for filename in filenames:
-        # print(filename)
         if not(filename.endswith('mseed')):continue
-        # print(filename)
-        # try:
-        st = obspy.read(filename, format='mseed')
-        st.merge(fill_value=0)
-        sample_rate = st[0].stats['sampling_rate']
-        st.write(filename.replace('mseed','wav'), format='WAV', framerate=sample_rate)
-        # by default say no to overwrite
-
-        os.system('ffmpeg -n -i '+filename.replace(' ', '\ ').replace('mseed','wav')+' -c:a flac '+filename.replace(' ', '\ ').replace('mseed','flac')+"&& rm "+filename.replace(' ', '\ ').replace('mseed','wav'))
-        assert not(os.path.exists(filename.replace(' ', '\ ').replace('mseed','wav'))) # likely no system ffmpeg installed
-        
-
-        # os.system('rm '+filename.replace(' ', '\ ').replace('mseed','wav'))
-        os.system('rm '+filename.replace(' ', '\ ')) # also remove mseed file
-
-
-
+        segment = mseed_to_flac(filename, keep_samples=keep_samples)
+        if segment is not None:
+            segments.append(segment)
 
+    return segments
@@ -0,0 +1,318 @@
+"""
+orcasound_streaming_class.py
+
+Orcasound live streams.
+
+Every Orcasound node publishes its audio as HLS in a public bucket:
+
+    <node>/latest.txt                       unix time the current stream started
+    <node>/hls/<start>/live.m3u8            playlist, a line per ~10 s segment
+    <node>/hls/<start>/live000.ts, ...      MPEG-TS segments
+
+The playlist is polled with conditional requests, only the segments added since
+the last poll are downloaded, and every minute of segments is remuxed by a single
+ffmpeg process into one FLAC file, so the archive trails the node by about a
+minute instead of the hours of ONC or the half hour of OOI.
+"""
+
+
+import json
+import os
+import re
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import List, NamedTuple, Tuple
+from urllib.parse import urljoin
+
+import soundfile as sf
+
+from hydrophone_streamer.downloader import ListingFetcher, download_file
+from hydrophone_streamer.metrics import BACKLOG, DOWNLOADED_BYTES, SEGMENT_ERRORS, SKIPPED_FILES, STAGE_SECONDS
+from hydrophone_streamer.notifications import write_atomic
+from hydrophone_streamer.supported_classes.base_streaming_class import BaseStreamingClass
+
+
+BUCKET_URL = 'https://s3-us-west-2.amazonaws.com/streaming-orcasound-net/'
+PLAYLIST_NAME = 'live.m3u8'
+FFMPEG = os.environ.get('FFMPEG_BINARY', 'ffmpeg')
+
+
+class PlaylistSegment(NamedTuple):
+    sequence: int
+    duration: float
+    uri: str
+
+
+def parse_playlist(text: str) -> Tuple[List[PlaylistSegment], float, bool]:
+    """
+    Parse an HLS media playlist.
+
+    Returns:
+        tuple: (segments in playlist order, target duration in seconds, True if the stream has ended)
+    """
+    sequence = 0
+    target_duration = 10.0
+    duration = None
+    segments = []
+    ended = False
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith('#EXT-X-MEDIA-SEQUENCE:'):
+            sequence = int(line.split(':', 1)[1])
+        elif line.startswith('#EXT-X-TARGETDURATION:'):
+            target_duration = float(line.split(':', 1)[1])
+        elif line.startswith('#EXTINF:'):
+            duration = float(line.split(':', 1)[1].split(',')[0])
+        elif line.startswith('#EXT-X-ENDLIST'):
+            ended = True
+        elif line != '' and not line.startswith('#'):
+            segments.append(PlaylistSegment(sequence, duration if duration is not None else target_duration, line))
+            sequence += 1
+            duration = None
+    return segments, target_duration, ended
+
+
+class OrcasoundStreamingClass(BaseStreamingClass):
+    network = 'orcasound'
+
+    def __init__(self, hydrophone_identifier: dict, save_dir: str = "data", **kwargs) -> None:
+        """
+        Initialize the OrcasoundStreamingClass with the hydrophone identifier.
+
+        Args:
+            hydrophone_identifier (dict): Dictionary containing hydrophone configuration:
+                'node' (i.e. 'rpi_orcasound_lab'), optionally 'url' of the bucket and
+                'batch_seconds', the length of the FLAC files (60 by default), and
+                'max_catch_up_minutes', how far behind the live edge a new archive starts (30).
+            **kwargs: Passed on to BaseStreamingClass (i.e. max_workers).
+        """
+        super().__init__(hydrophone_identifier, save_dir=save_dir, **kwargs)
+        self.log.debug('stream setting %s', self.hydrophone_identifier)
+
+        assert 'node' in self.hydrophone_identifier.keys(), "Hydrophone identifier must contain 'node' key."
+        assert shutil.which(FFMPEG) is not None, f"{FFMPEG} was not found, it is needed to remux the Orcasound HLS segments"
+
+        self.node = self.hydrophone_identifier['node']
+        self.url = urljoin(self.hydrophone_identifier.get('url', BUCKET_URL), self.node + '/')
+        self.batch_seconds = self.hydrophone_identifier.get('batch_seconds', 60)
+        self.max_catch_up = timedelta(minutes=self.hydrophone_identifier.get('max_catch_up_minutes', 30))
+
+        # the latest.txt pointer and the playlist are both fetched conditionally
+        self.listing_fetcher = ListingFetcher(session=self.session)
+
+        # segments are downloaded here until their minute is complete
+        self.hls_dir = os.path.join(self.save_dir, 'hls')
+        os.makedirs(self.hls_dir, exist_ok=True)
+        # stream folder, next playlist sequence number and its start time, and the downloaded segments not yet remuxed
+        self.cursor_path = os.path.join(self.save_dir, 'orcasound_cursor.json')
+
+    def _file_time(self, filename: str) -> datetime:
+        """
+        Parse the start time from a FLAC file name, i.e. rpi_orcasound_lab_2025-05-24T235500.123456Z.flac
+        """
+        match = re.search(r'\d{4}-\d{2}-\d{2}T\d{6}\.\d{6}Z', os.path.basename(filename))
+        return datetime.strptime(match.group(0), '%Y-%m-%dT%H%M%S.%fZ').replace(tzinfo=timezone.utc)
+
+    def _read_cursor(self) -> dict:
+        if not os.path.exists(self.cursor_path):
+            return {'folder': None, 'next_sequence': 0, 'next_start': None, 'pending': []}
+        with open(self.cursor_path, 'r') as f:
+            return json.load(f)
+
+    def _write_cursor(self, cursor: dict) -> None:
+        write_atomic(self.cursor_path, json.dumps(cursor))
+
+    def _fetch_segments(self, folder: str, cursor: dict) -> bool:
+        """
+        Download the segments of a stream folder that were added since the last poll, or
+        that failed to download on an earlier one, appending them to cursor['pending'].
+
+        Returns:
+            bool: True if the playlist marks the stream as ended.
+        """
+        playlist_url = urljoin(self.url, f'hls/{folder}/{PLAYLIST_NAME}')
+        with STAGE_SECONDS.time(station=self.station, stage='listing'):
+            response = self.listing_fetcher.fetch(playlist_url)
+        if response.status_code == 404:
+            # the folder is announced before its first segment is written
+            return False
+        if response.status_code != 200:
+            raise ValueError(f"Failed to fetch {playlist_url}. Status code: {response.status_code}")
+        # an unchanged playlist is parsed from the cache all the same, segments that failed
+        # on an earlier poll are still ahead of the cursor and an ended stream stays ended
+
+        segments, target_duration, ended = parse_playlist(response.text)
+        new = [segment for segment in segments if segment.sequence >= cursor['next_sequence']]
+        if len(new) > 0 and new[0].sequence > cursor['next_sequence']:
+            # the playlist window moved past segments we never saw
+            missed = new[0].sequence - cursor['next_sequence']
+            SKIPPED_FILES.inc(missed, station=self.station, reason='expired')
+            self.log.warning('%d segments left the playlist before they were fetched', missed)
+            cursor['next_start'] += missed * target_duration
+
+        jobs = []
+        start = cursor['next_start']
+        # a new archive, or one after a long outage, starts max_catch_up behind the live edge
+        cutoff = datetime.now(timezone.utc).timestamp() - self.max_catch_up.total_seconds()
+        for segment in new:
+            if start + segment.duration < cutoff:
+                SKIPPED_FILES.inc(station=self.station, reason='too_old')
+                start += segment.duration
+                cursor['next_sequence'], cursor['next_start'] = segment.sequence + 1, start
+                continue
+            local_path = os.path.join(self.hls_dir, f'{folder}_{segment.sequence:06d}.ts')
+            jobs.append((urljoin(playlist_url, segment.uri), local_path, start, segment.duration, segment.sequence))
+            start += segment.duration
+
+        def fetch(job: tuple) -> int:
+            url, local_path = job[:2]
+            with self.host_limiter.limit(url):
+                with STAGE_SECONDS.time(station=self.station, stage='download'):
+                    return download_file(url, local_path, session=self.session)
+
+        BACKLOG.set(len(jobs), station=self.station)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [(job, executor.submit(fetch, job)) for job in jobs]
+        for (url, local_path, start, duration, sequence), future in futures:
+            try:
+                n_bytes = future.result()
+            except Exception as e:
+                # later segments are fetched again from here on the next poll
+                SEGMENT_ERRORS.inc(station=self.station)
+                self.log.warning('failed to fetch %s: %r', url, e)
+                return False
+            DOWNLOADED_BYTES.inc(n_bytes, station=self.station)
+            cursor['pending'].append([local_path, start, duration])
+            cursor['next_sequence'] = sequence + 1
+            cursor['next_start'] = start + duration
+        return ended
+
+    def _complete_batches(self, pending: list, final: bool) -> list:
+        """
+        Group the pending segments by the batch their start falls in. The last batch
+        is only complete once it is full, or when the stream ended.
+        """
+        batches = []
+        for segment in pending:
+            key = int(segment[1] // self.batch_seconds)
+            if len(batches) == 0 or batches[-1][0] != key:
+                batches.append((key, []))
+            batches[-1][1].append(segment)
+        if len(batches) > 0 and not final:
+            key, segments = batches[-1]
+            _, start, duration = segments[-1]
+            if start + duration < (key + 1) * self.batch_seconds - 0.5:
+                batches.pop()
+        return [segments for _, segments in batches]
+
+    def _remux(self, segments: list) -> tuple:
+        """
+        Remux a batch of consecutive TS segments into one FLAC file with one ffmpeg process.
+
+        Returns:
+            tuple: (path, start time, duration in seconds)
+        """
+        start_time = datetime.fromtimestamp(segments[0][1], tz=timezone.utc)
+        path = os.path.join(self.save_dir, f"{self.node}_{start_time.strftime('%Y-%m-%dT%H%M%S.%fZ')}.flac")
+        # MPEG-TS can be concatenated as is
+        data = b''
+        for local_path, _, _ in segments:
+            with open(local_path, 'rb') as f:
+                data += f.read()
+        self._check_fence()
+        with STAGE_SECONDS.time(station=self.station, stage='remux'):
+            subprocess.run([FFMPEG, '-hide_banner', '-loglevel', 'error', '-y', '-f', 'mpegts', '-i', 'pipe:0',
+                            '-vn', '-ac', '1', '-c:a', 'flac', '-sample_fmt', 's16', '-f', 'flac', path + '.part'],
+                           input=data, check=True, capture_output=True)
+        os.replace(path + '.part', path)
+        return path, start_time, sf.info(path).duration
+
+    def download_data(self) -> list:
+        """
+        Download the new segments of the live stream and remux every complete minute.
+
+        Returns:
+            list: List of fetched results.
+        """
+        with STAGE_SECONDS.time(station=self.station, stage='listing'):
+            response = self.listing_fetcher.fetch(urljoin(self.url, 'latest.txt'))
+        if response.status_code != 200:
+            raise ValueError(f"Failed to fetch latest.txt of {self.node}. Status code: {response.status_code}")
+        folder = response.text.strip()
+
+        cursor = self._read_cursor()
+        fetched_results = []
+        if cursor['folder'] != folder:
+            if cursor['folder'] is not None:
+                # the node restarted its stream, finish the old folder first
+                self._fetch_segments(cursor['folder'], cursor)
+                fetched_results += self._remux_batches(cursor, final=True)
+                self.listing_fetcher.forget(urljoin(self.url, f"hls/{cursor['folder']}/{PLAYLIST_NAME}"))
+            self.log.info('following stream folder %s', folder)
+            cursor.update({'folder': folder, 'next_sequence': 0, 'next_start': float(folder)})
+            self._write_cursor(cursor)
+
+        ended = self._fetch_segments(folder, cursor)
+        fetched_results += self._remux_batches(cursor, ended)
+        self._write_cursor(cursor)
+
+        if not(os.path.exists(os.path.join(self.save_dir, 'reference.bib'))):
+            bibtex=f"""@misc{{orcasound_{self.node},
+    'title': 'Orcasound hydrophone network',
+    'howpublished': 'Live audio stream of the {self.node} node',
+    'url': {self.url},
+    'accessed': {datetime.now().strftime("%Y-%m-%d")},}}"""
+            self._write_reference(bibtex)
+
+        return fetched_results
+
+    def _remux_batches(self, cursor: dict, final: bool) -> list:
+        """
+        Remux the complete batches of cursor['pending'] in parallel and register them in time order.
+        """
+        # i.e. the hls folder was cleared while the streamer was down
+        missing = [segment for segment in cursor['pending'] if not os.path.exists(segment[0])]
+        if len(missing) > 0:
+            SEGMENT_ERRORS.inc(len(missing), station=self.station)
+            self.log.warning('dropping %d pending segments whose files are gone, i.e. %s', len(missing), missing[0][0])
+            cursor['pending'] = [segment for segment in cursor['pending'] if os.path.exists(segment[0])]
+            self._write_cursor(cursor)
+
+        batches = self._complete_batches(cursor['pending'], final)
+        fetched_results = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [(segments, executor.submit(self._remux, segments)) for segments in batches]
+            for segments, future in futures:
+                try:
+                    path, start_time, duration = future.result()
+                except subprocess.CalledProcessError as e:
+                    SEGMENT_ERRORS.inc(station=self.station)
+                    self.log.warning('failed to remux %d segments from %s: %s', len(segments), segments[0][0], e.stderr.decode(errors='replace').strip())
+                except Exception as e:
+                    # a remux refused by the fence ends the poll, the batch stays pending
+                    self._check_fence()
+                    SEGMENT_ERRORS.inc(station=self.station)
+                    self.log.warning('failed to remux %d segments from %s: %r', len(segments), segments[0][0], e)
+                else:
+                    self._register_segment(path, start_time, duration)
+                    fetched_results.append(path)
+                # a batch that cannot be remuxed is dropped rather than retried forever
+                for local_path, _, _ in segments:
+                    if os.path.exists(local_path):
+                        os.remove(local_path)
+                cursor['pending'] = cursor['pending'][len(segments):]
+                self._write_cursor(cursor)
+        BACKLOG.set(len(cursor['pending']), station=self.station)
+        return fetched_results
+
+    def latest_file(self) -> None:
+        """
+        Log the most recent audio file to a file for streaming purposes.
+        """
+        this_time, max_file = self._most_recent_file_date(return_file=True)
+        if max_file is None:
+            return
+
+        self._write_latest(max_file)
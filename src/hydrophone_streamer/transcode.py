@@ -0,0 +1,507 @@
+"""
+transcode.py
+
+In-process miniSEED -> FLAC transcoding.
+
+The merged obspy trace is handed to libsndfile block by block, so no intermediate
+WAV file is written and no ffmpeg process is spawned.
+
+StreamingMseedDecoder instead decodes the miniSEED records as their bytes arrive,
+i.e. straight from the download, and hands the samples to the encoder in fixed
+size blocks, so its memory use does not grow with the length of the segment.
+"""
+
+
+import io
+import logging
+import os
+import struct
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import BinaryIO, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+import soundfile as sf
+
+
+logger = logging.getLogger(__name__)
+
+BLOCK_SIZE = 1 << 16 # samples handed to the encoder per write
+BATCH_BYTES = 1 << 20 # miniSEED bytes decoded per obspy call when streaming
+
+
+@dataclass
+class TranscodedSegment:
+    """
+    Description of a segment written by the transcoder.
+    """
+    path: str
+    start_time: datetime
+    sample_rate: int
+    n_samples: int
+    samples: Optional[np.ndarray] = None # only kept when asked for, i.e. to feed a ring buffer
+    gaps: Optional[List[Tuple[int, int]]] = None # (first, end) samples filled with zeros, None if unknown
+    decode_seconds: float = 0.0 # measured where the transcode ran, which may be a worker process
+    encode_seconds: float = 0.0
+
+    @property
+    def duration(self) -> float:
+        return self.n_samples / self.sample_rate
+
+
+class UnsortedRecords(ValueError):
+    """
+    A miniSEED record arrived after later samples were written, raised by StreamingMseedDecoder.
+    Records are not guaranteed to be in time order, such a file has to be decoded whole.
+    """
+
+
+def flac_subtype(dtype: np.dtype) -> str:
+    """
+    Pick the FLAC sample width for an array dtype.
+
+    16 bit data is kept as is. Anything wider is stored as 24 bit, which is the
+    widest FLAC libsndfile (and ffmpeg) will write; the top 24 bits are kept, as
+    ffmpeg did when it was fed the 32 bit WAV written by obspy.
+    """
+    if np.dtype(dtype) == np.int16:
+        return 'PCM_16'
+    return 'PCM_24'
+
+
+def as_pcm(samples: np.ndarray) -> np.ndarray:
+    """
+    Coerce samples to an integer dtype libsndfile accepts without rescaling.
+
+    obspy wrote non-integer traces to WAV as int32, so do the same here.
+    """
+    samples = np.asarray(samples)
+    if samples.dtype in (np.int16, np.int32):
+        return samples
+    return samples.astype(np.int32)
+
+
+class FlacEncoder:
+    """
+    Incrementally encode PCM blocks to FLAC.
+
+    When `destination` is a path the stream is written to `<path>.part` and renamed
+    into place on close, so readers never see a half written file. File-like
+    destinations (i.e. io.BytesIO) are written to directly.
+    """
+    def __init__(self,
+                 destination: Union[str, BinaryIO],
+                 sample_rate: int,
+                 subtype: str = 'PCM_24',
+                 channels: int = 1,
+                 ) -> None:
+        self.destination = destination
+        self.sample_rate = int(round(sample_rate))
+        self.n_samples = 0
+
+        if isinstance(destination, str):
+            self._target = destination + '.part'
+        else:
+            self._target = destination
+
+        self._file = sf.SoundFile(self._target, mode='w', samplerate=self.sample_rate,
+                                  channels=channels, format='FLAC', subtype=subtype)
+
+    def write(self, samples: np.ndarray) -> None:
+        """
+        Append a block of samples to the stream.
+        """
+        samples = as_pcm(samples)
+        self._file.write(samples)
+        self.n_samples += len(samples)
+
+    def close(self) -> None:
+        """
+        Flush the stream and publish the file.
+        """
+        if self._file.closed:
+            return
+        self._file.close()
+        if isinstance(self.destination, str):
+            os.replace(self._target, self.destination)
+
+    def abort(self) -> None:
+        """
+        Close the stream and discard anything written so far.
+        """
+        if not self._file.closed:
+            self._file.close()
+        if isinstance(self.destination, str) and os.path.exists(self._target):
+            os.remove(self._target)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def encode_flac(samples: np.ndarray,
+                sample_rate: float,
+                destination: Union[str, BinaryIO],
+                block_size: int = BLOCK_SIZE,
+                ) -> int:
+    """
+    Encode a 1D array of samples to FLAC.
+
+    Args:
+        samples (np.ndarray): PCM samples.
+        sample_rate (float): Sampling rate in Hz.
+        destination (Union[str, BinaryIO]): Output path or writable binary stream.
+        block_size (int): Number of samples handed to the encoder at a time.
+
+    Returns:
+        int: Number of samples written.
+    """
+    samples = as_pcm(samples)
+    with FlacEncoder(destination, sample_rate, subtype=flac_subtype(samples.dtype)) as encoder:
+        for i in range(0, len(samples), block_size):
+            encoder.write(samples[i:i + block_size])
+    return encoder.n_samples
+
+
+def read_merged_trace(source) -> tuple:
+    """
+    Read a miniSEED file and merge it into a single trace.
+
+    Args:
+        source: Path or binary stream holding miniSEED data.
+
+    Returns:
+        tuple: (samples, sample_rate, start_time, gaps), gaps are the (first, end)
+            samples the merge filled with zeros.
+    """
+    import obspy
+
+    st = obspy.read(source, format='mseed')
+    spans = [(trace.id, trace.stats.starttime, trace.stats.npts) for trace in st]
+    st.merge(fill_value=0)
+    trace = st[0]
+    sample_rate = trace.stats['sampling_rate']
+
+    gaps = []
+    written = 0
+    for offset, npts in sorted((int(round((starttime - trace.stats.starttime) * sample_rate)), npts)
+                               for trace_id, starttime, npts in spans if trace_id == trace.id):
+        if offset > written:
+            gaps.append((written, offset))
+        written = max(written, offset + npts)
+
+    start_time = trace.stats['starttime'].datetime.replace(tzinfo=timezone.utc)
+    return trace.data, sample_rate, start_time, gaps
+
+
+def mseed_record_length(data: Union[bytes, bytearray, memoryview]) -> Optional[int]:
+    """
+    Length of the miniSEED 2 record at the start of `data`, from its blockette 1000.
+
+    Returns:
+        int: Record length in bytes, or None if more bytes are needed to tell.
+
+    Raises:
+        ValueError: If `data` does not start with a miniSEED 2 record with a blockette 1000.
+    """
+    if len(data) < 48:
+        return None
+    if data[6:7] not in (b'D', b'R', b'Q', b'M'):
+        raise ValueError(f"Not a miniSEED 2 record, quality indicator {bytes(data[6:7])!r}")
+
+    # the byte order of the header is not flagged, tell it from a plausible start year, as libmseed does
+    for order in ('>', '<'):
+        year, day = struct.unpack_from(order + 'HH', data, 20)
+        if 1900 <= year <= 2100 and 1 <= day <= 366:
+            break
+    else:
+        raise ValueError("Not a miniSEED 2 record, the start time is not plausible")
+
+    offset = struct.unpack_from(order + 'H', data, 46)[0]
+    while offset >= 48:
+        if len(data) < offset + 8:
+            return None
+        blockette, next_offset = struct.unpack_from(order + 'HH', data, offset)
+        if blockette == 1000:
+            return 1 << data[offset + 6]
+        if next_offset <= offset:
+            break
+        offset = next_offset
+    raise ValueError("miniSEED record without a blockette 1000, its length is unknown")
+
+
+class StreamingMseedDecoder:
+    """
+    Transcode miniSEED to FLAC as the bytes arrive.
+
+    Whole records are collected until `batch_bytes` of them are buffered, decoded
+    in one obspy call and written to the encoder `block_size` samples at a time, so
+    the memory held is bounded by the batch and does not depend on the length of
+    the segment. The result matches mseed_to_flac: the first channel is kept and
+    gaps are filled with zeros. Overlapping samples keep their first copy. A record
+    that belongs before samples already written (in a gap that was filled, or before
+    the first sample) raises UnsortedRecords, the file must then be decoded whole.
+
+        decoder = StreamingMseedDecoder('segment.flac')
+        for chunk in response.iter_content(CHUNK_SIZE):
+            decoder.feed(chunk)
+        segment = decoder.close()
+    """
+    def __init__(self,
+                 destination: Union[str, BinaryIO],
+                 batch_bytes: int = BATCH_BYTES,
+                 block_size: int = BLOCK_SIZE,
+                 keep_samples: bool = False,
+                 ) -> None:
+        """
+        Args:
+            destination (Union[str, BinaryIO]): Output path or writable binary stream.
+            batch_bytes (int): Complete records buffered before they are decoded.
+            block_size (int): Number of samples handed to the encoder at a time.
+            keep_samples (bool): Return the decoded samples with the segment. They are
+                collected in memory, so this gives up the bound on memory use.
+        """
+        self.destination = destination
+        self.batch_bytes = batch_bytes
+        self.block_size = block_size
+        self.keep_samples = keep_samples
+
+        self.encoder = None # opened with the first record, which sets the sample rate and width
+        self.trace_id = None
+        self.sample_rate = None
+        self.start_time = None # obspy.UTCDateTime of the first sample
+        self.n_bytes = 0
+        self.decode_seconds = 0.0
+        self.encode_seconds = 0.0
+
+        self._buffer = bytearray()
+        self._complete = 0 # bytes at the head of the buffer that form whole records
+        self._kept = []
+        self._filled = [] # (first, end) sample of every gap written as zeros
+
+    def feed(self, data: bytes) -> None:
+        """
+        Append bytes of the miniSEED stream, decoding every full batch of records.
+        """
+        self._buffer += data
+        self.n_bytes += len(data)
+        while True:
+            length = mseed_record_length(memoryview(self._buffer)[self._complete:])
+            if length is None or self._complete + length > len(self._buffer):
+                break
+            self._complete += length
+            if self._complete >= self.batch_bytes:
+                self._decode()
+
+    def _decode(self) -> None:
+        """
+        Decode the complete records at the head of the buffer and encode their samples.
+        """
+        import obspy
+
+        if self._complete == 0:
+            return
+        start = time.perf_counter()
+        st = obspy.read(io.BytesIO(bytes(memoryview(self._buffer)[:self._complete])), format='MSEED')
+        del self._buffer[:self._complete]
+        self._complete = 0
+        self.decode_seconds += time.perf_counter() - start
+
+        for trace in sorted(st, key=lambda trace: trace.stats.starttime):
+            self._write_trace(trace)
+
+    def _write_trace(self, trace) -> None:
+        """
+        Place the samples of a decoded trace after those already written, filling gaps with zeros.
+        """
+        if self.trace_id is None:
+            self.trace_id = trace.id
+            self.sample_rate = trace.stats.sampling_rate
+            self.start_time = trace.stats.starttime
+        elif trace.id != self.trace_id:
+            logger.debug('skipping records of %s, only %s is kept', trace.id, self.trace_id)
+            return
+        elif trace.stats.sampling_rate != self.sample_rate:
+            raise ValueError(f"Sample rate of {self.trace_id} changed from {self.sample_rate} to {trace.stats.sampling_rate} Hz")
+
+        data = as_pcm(trace.data)
+        if self.encoder is None:
+            self.encoder = FlacEncoder(self.destination, self.sample_rate, subtype=flac_subtype(data.dtype))
+
+        offset = int(round((trace.stats.starttime - self.start_time) * self.sample_rate))
+        written = self.encoder.n_samples
+        end = offset + len(data)
+        if offset < 0 or any(first < end and offset < last for first, last in self._filled):
+            raise UnsortedRecords(f"Records of {self.trace_id} from {trace.stats.starttime} arrived after later samples were written")
+        if offset < written:
+            # overlap, the samples already written are kept
+            data = data[written - offset:]
+        elif offset > written:
+            self._filled.append((written, offset))
+            self._write(np.zeros(offset - written, dtype=data.dtype))
+        self._write(data)
+
+    def _write(self, samples: np.ndarray) -> None:
+        start = time.perf_counter()
+        for i in range(0, len(samples), self.block_size):
+            self.encoder.write(samples[i:i + self.block_size])
+        self.encode_seconds += time.perf_counter() - start
+        if self.keep_samples and len(samples) > 0:
+            self._kept.append(samples)
+
+    def close(self) -> TranscodedSegment:
+        """
+        Decode the remaining records and publish the FLAC.
+
+        Raises:
+            ValueError: If the stream ends in the middle of a record or held no samples.
+        """
+        self._decode()
+        if len(self._buffer) > 0:
+            self.abort()
+            raise ValueError(f"miniSEED stream ends with {len(self._buffer)} bytes of an incomplete record")
+        if self.encoder is None:
+            raise ValueError("miniSEED stream holds no samples")
+        self.encoder.close()
+
+        samples = None
+        if self.keep_samples:
+            samples = np.concatenate(self._kept)
+            self._kept = []
+
+        return TranscodedSegment(path=self.destination if isinstance(self.destination, str) else None,
+                                 start_time=self.start_time.datetime.replace(tzinfo=timezone.utc),
+                                 sample_rate=int(round(self.sample_rate)),
+                                 n_samples=self.encoder.n_samples,
+                                 samples=samples,
+                                 gaps=list(self._filled),
+                                 decode_seconds=self.decode_seconds,
+                                 encode_seconds=self.encode_seconds)
+
+    def abort(self) -> None:
+        """
+        Stop decoding and discard anything written so far.
+        """
+        if self.encoder is not None:
+            self.encoder.abort()
+        self._buffer = bytearray()
+        self._complete = 0
+        self._kept = []
+        self._filled = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+
+
+def stream_mseed_to_flac(chunks: Iterable[bytes],
+                         destination: Union[str, BinaryIO],
+                         batch_bytes: int = BATCH_BYTES,
+                         keep_samples: bool = False,
+                         ) -> TranscodedSegment:
+    """
+    Transcode a miniSEED byte stream to FLAC with bounded memory, see StreamingMseedDecoder.
+
+    Args:
+        chunks (Iterable[bytes]): The miniSEED stream, in pieces of any size.
+        destination (Union[str, BinaryIO]): Output path or writable binary stream.
+        batch_bytes (int): Complete records buffered before they are decoded.
+        keep_samples (bool): Return the decoded samples with the segment.
+
+    Returns:
+        TranscodedSegment: The written segment.
+    """
+    with StreamingMseedDecoder(destination, batch_bytes=batch_bytes, keep_samples=keep_samples) as decoder:
+        for chunk in chunks:
+            decoder.feed(chunk)
+        return decoder.close()
+
+
+def mseed_to_flac(filename: str,
+                  destination: Optional[str] = None,
+                  overwrite: bool = False,
+                  remove_source: bool = True,
+                  keep_samples: bool = False,
+                  streaming: bool = False,
+                  ) -> Optional[TranscodedSegment]:
+    """
+    Transcode a miniSEED file to FLAC without an intermediate WAV.
+
+    Args:
+        filename (str): Path to the .mseed file.
+        destination (str, optional): Output path, defaults to the input with a .flac extension.
+        overwrite (bool): Replace an existing FLAC. Defaults to False, like `ffmpeg -n`.
+        remove_source (bool): Delete the miniSEED once the FLAC is in place.
+        keep_samples (bool): Return the decoded samples with the segment.
+        streaming (bool): Decode the file record by record with StreamingMseedDecoder
+            instead of reading and merging it whole, which bounds the memory used. A file
+            whose records are not in time order is still read whole.
+
+    Returns:
+        TranscodedSegment: The written segment, or None if the destination already existed.
+    """
+    if destination is None:
+        destination = os.path.splitext(filename)[0] + '.flac'
+
+    if os.path.exists(destination) and not overwrite:
+        return None
+
+    if streaming:
+        try:
+            with open(filename, 'rb') as f:
+                segment = stream_mseed_to_flac(iter(lambda: f.read(BATCH_BYTES), b''), destination, keep_samples=keep_samples)
+        except UnsortedRecords as e:
+            logger.debug('%s, decoding %s whole', e, filename)
+        else:
+            if remove_source:
+                os.remove(filename)
+            return segment
+
+    start = time.perf_counter()
+    samples, sample_rate, start_time, gaps = read_merged_trace(filename)
+    decoded = time.perf_counter()
+    n_samples = encode_flac(samples, sample_rate, destination)
+    encoded = time.perf_counter()
+
+    if remove_source:
+        os.remove(filename)
+
+    return TranscodedSegment(path=destination,
+                             start_time=start_time,
+                             sample_rate=int(round(sample_rate)),
+                             n_samples=n_samples,
+                             samples=samples if keep_samples else None,
+                             gaps=gaps,
+                             decode_seconds=decoded - start,
+                             encode_seconds=encoded - decoded)
+
+
+def describe_flac(path: str, start_time: datetime) -> TranscodedSegment:
+    """
+    Describe a FLAC already on disk, i.e. written by a run that stopped before indexing it.
+    FLACs are only renamed into place once complete, see FlacEncoder.
+    """
+    info = sf.info(path)
+    return TranscodedSegment(path=path, start_time=start_time, sample_rate=info.samplerate, n_samples=info.frames)
+
+
+def read_flac(path: str) -> tuple:
+    """
+    Decode a FLAC file to float32.
+
+    Returns:
+        tuple: (samples, sample_rate)
+    """
+    samples, sample_rate = sf.read(path, dtype='float32', always_2d=False)
+    if samples.ndim > 1:
+        samples = samples[:, 0]
+    return samples, sample_rate
@@ -0,0 +1,115 @@
+"""
+conftest.py
+
+The stand-in servers of the benchmarks (benchmarks/standins.py) are shared with the
+tests, along with a file server that drops connections partway (flaky_server).
+"""
+
+
+import hashlib
+import os
+import re
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+
+class FlakyServer:
+    def __init__(self, body: bytes) -> None:
+        """
+        Serve one file with ETag, Range and If-Range, cutting responses short on demand.
+
+        Attributes:
+            drops (int): Responses still to cut short.
+            drop_after (int): Bytes of the body sent before a connection is dropped.
+            body_after_drop (bytes): Replaces the file (and its ETag) after the next drop.
+            requests (list): (method, Range, If-Range, status) of every request.
+        """
+        self.drops = 0
+        self.drop_after = 0
+        self.body_after_drop = None
+        self.requests = []
+        self._lock = threading.Lock()
+        self.set_body(body)
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05,), daemon=True)
+        self._thread.start()
+        self.url = f'http://127.0.0.1:{self._server.server_address[1]}/segment.mseed'
+
+    def set_body(self, body: bytes) -> None:
+        with self._lock:
+            self.body = body
+            self.etag = '"' + hashlib.md5(body).hexdigest() + '"'
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args) -> None:
+                pass
+
+            def _respond(self, head: bool) -> None:
+                with server._lock:
+                    body, etag = server.body, server.etag
+                    drop = not head and server.drops > 0
+                    if drop:
+                        server.drops -= 1
+
+                status, payload = 200, body
+                headers = {'ETag': etag, 'Accept-Ranges': 'bytes'}
+                byte_range = re.fullmatch(r'bytes=(\d+)-', self.headers.get('Range', ''))
+                if_range = self.headers.get('If-Range')
+                if byte_range is not None and (if_range is None or if_range == etag):
+                    first = int(byte_range.group(1))
+                    if first >= len(body):
+                        status, payload = 416, b''
+                        headers['Content-Range'] = f'bytes */{len(body)}'
+                    else:
+                        status, payload = 206, body[first:]
+                        headers['Content-Range'] = f'bytes {first}-{len(body) - 1}/{len(body)}'
+                server.requests.append((self.command, self.headers.get('Range'), if_range, status))
+
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                if head:
+                    return
+                if drop and server.drop_after < len(payload):
+                    self.wfile.write(payload[:server.drop_after])
+                    self.wfile.flush()
+                    self.close_connection = True
+                    if server.body_after_drop is not None:
+                        server.set_body(server.body_after_drop)
+                        server.body_after_drop = None
+                    return
+                self.wfile.write(payload)
+
+            def do_GET(self) -> None:
+                self._respond(head=False)
+
+            def do_HEAD(self) -> None:
+                self._respond(head=True)
+
+        return Handler
+
+
+@pytest.fixture
+def flaky_server():
+    server = FlakyServer(os.urandom(1 << 20))
+    yield server
+    server.close()
@@ -0,0 +1,110 @@
+"""
+test_aio.py
+
+The asyncio download helpers and the OOI network on the event loop.
+"""
+
+
+import asyncio
+import glob
+import os
+
+import pytest
+
+pytest.importorskip('aiohttp')
+
+from hydrophone_streamer import aio
+from hydrophone_streamer.downloader import CHUNK_SIZE
+from hydrophone_streamer.supported_classes.ooi_streaming_class import AsyncOOIStreamingClass, OOIStreamingClass
+from standins import OOIServer
+
+
+def run(coroutine_function, *args, **kwargs):
+    """
+    Run a coroutine on a new event loop, closing the loop's client session afterwards.
+    """
+    async def main():
+        try:
+            return await coroutine_function(*args, **kwargs)
+        finally:
+            await aio.close_client_session()
+
+    return asyncio.run(main())
+
+
+def test_dropped_connections_resume_with_range(flaky_server, tmp_path):
+    flaky_server.drops = 2
+    flaky_server.drop_after = 5 * CHUNK_SIZE
+    local_path = str(tmp_path / 'segment.mseed')
+    chunks = []
+
+    n_bytes = run(aio.download_file, flaky_server.url, local_path, retry_delay=0, on_chunk=chunks.append)
+
+    assert n_bytes == len(flaky_server.body)
+    with open(local_path, 'rb') as f:
+        assert f.read() == flaky_server.body
+    assert b''.join(chunks) == flaky_server.body
+    assert not os.path.exists(local_path + '.part')
+    assert [status for _, _, _, status in flaky_server.requests] == [200, 206, 206]
+
+
+def test_changed_file_is_downloaded_again_in_full(flaky_server, tmp_path):
+    remote = run(aio.probe, flaky_server.url)
+    assert remote.size == len(flaky_server.body) and remote.etag == flaky_server.etag
+    flaky_server.drops = 1
+    flaky_server.drop_after = 5 * CHUNK_SIZE
+    new_body = os.urandom(len(flaky_server.body))
+    flaky_server.body_after_drop = new_body
+    local_path = str(tmp_path / 'segment.mseed')
+
+    run(aio.download_file, flaky_server.url, local_path, expected_size=remote.size, etag=remote.etag, retry_delay=0)
+
+    _, byte_range, if_range, status = flaky_server.requests[-1]
+    assert byte_range is not None and if_range == remote.etag and status == 200
+    with open(local_path, 'rb') as f:
+        assert f.read() == new_body
+
+
+def test_part_file_is_resumed_by_the_next_call(flaky_server, tmp_path):
+    flaky_server.drops = 1
+    flaky_server.drop_after = 6 * CHUNK_SIZE
+    local_path = str(tmp_path / 'segment.mseed')
+
+    import aiohttp
+    with pytest.raises(aiohttp.ClientPayloadError):
+        run(aio.download_file, flaky_server.url, local_path, retries=0)
+    assert not os.path.exists(local_path)
+    assert os.path.exists(local_path + '.part')
+
+    run(aio.download_file, flaky_server.url, local_path, retries=0)
+    with open(local_path, 'rb') as f:
+        assert f.read() == flaky_server.body
+    assert flaky_server.requests[-1][3] == 206
+
+
+@pytest.mark.parametrize('streaming_decode', [False, True])
+def test_async_ooi_matches_the_synchronous_class(tmp_path, streaming_decode):
+    with OOIServer(n_segments=4) as server:
+        server.release(4)
+
+        class LocalOOIStreamingClass(OOIStreamingClass):
+            url_prefixes = (server.url,)
+
+        class LocalAsyncOOIStreamingClass(AsyncOOIStreamingClass):
+            url_prefixes = (server.url,)
+
+        expected = LocalOOIStreamingClass({'url': server.url}, save_dir=str(tmp_path / 'sync')).poll()
+        station = LocalAsyncOOIStreamingClass({'url': server.url}, save_dir=str(tmp_path / 'async'),
+                                              streaming_decode=streaming_decode)
+        fetched = run(station.poll)
+        assert run(station.poll) == []
+
+    assert [os.path.basename(path) for path in fetched] == [os.path.basename(path) for path in expected]
+    for sync_path, async_path in zip(expected, fetched):
+        with open(sync_path, 'rb') as f, open(async_path, 'rb') as g:
+            assert f.read() == g.read()
+    assert glob.glob(str(tmp_path / 'async' / '*.mseed*')) == []
+    assert len(station.segment_index) == 4
+    with open(tmp_path / 'async' / 'latest.txt') as f:
+        assert f.read().strip() == os.path.basename(fetched[-1])
+    assert os.path.exists(tmp_path / 'async' / 'reference.bib')
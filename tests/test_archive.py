@@ -0,0 +1,121 @@
+"""
+test_archive.py
+
+The time-indexed continuous archive.
+"""
+
+
+import io
+import os
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import obspy
+import pytest
+
+from hydrophone_streamer.archive import FULL_SCALE, ArchiveReader, ContinuousArchive
+from hydrophone_streamer.spectrogram import SpectrogramPyramid, SpectrogramReader
+from hydrophone_streamer.transcode import mseed_to_flac
+from standins import synthetic_samples
+
+
+START = datetime(2025, 5, 24, 3, tzinfo=timezone.utc)
+
+
+def write_mseed_with_gap(path: str, sample_rate: int = 1000) -> None:
+    # 10 s of data, 2 s missing, 10 s of data
+    traces = [obspy.Trace(data=synthetic_samples(sample_rate, 10, seed=i),
+                          header={'network': 'OO', 'station': 'TEST', 'channel': 'YDH', 'sampling_rate': sample_rate,
+                                  'starttime': obspy.UTCDateTime(START + timedelta(seconds=12 * i))})
+              for i in range(2)]
+    buffer = io.BytesIO()
+    obspy.Stream(traces).write(buffer, format='MSEED', reclen=512, encoding='STEIM2')
+    with open(path, 'wb') as f:
+        f.write(buffer.getvalue())
+
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_gap_inside_a_segment_is_not_covered(tmp_path, streaming):
+    write_mseed_with_gap(str(tmp_path / 'segment.mseed'))
+    segment = mseed_to_flac(str(tmp_path / 'segment.mseed'), keep_samples=True, streaming=streaming)
+    assert segment.gaps == [(10000, 12000)]
+    assert segment.duration == 22
+
+    archive = ContinuousArchive(str(tmp_path), chunk_seconds=5)
+    archive.write(segment.samples, segment.sample_rate, segment.start_time, gaps=segment.gaps)
+
+    end = START + timedelta(seconds=22)
+    assert archive.coverage(START, end) == [(START, START + timedelta(seconds=10)), (START + timedelta(seconds=12), end)]
+    assert archive.gaps(START, end) == [(START + timedelta(seconds=10), START + timedelta(seconds=12))]
+    piece = archive.read(START, end)
+    assert piece.gaps == archive.gaps(START, end)
+    np.testing.assert_array_equal(piece.samples[10000:12000], 0)
+    archive.close()
+
+    # nor is it in the spectrogram
+    pyramid = SpectrogramPyramid(str(tmp_path), nfft=1000, levels=(1,))
+    pyramid.write(segment.samples, segment.sample_rate, segment.start_time, gaps=segment.gaps)
+    values = SpectrogramReader(str(tmp_path)).read(START, end, level=1).values.astype(np.float32)
+    assert np.flatnonzero(np.isnan(values).all(axis=1)).tolist() == [10, 11]
+
+
+def test_prune_drops_chunks_before_the_horizon(tmp_path):
+    archive = ContinuousArchive(str(tmp_path), chunk_seconds=60)
+    sample_rate = 10
+    # an hour on each of two days
+    for day in range(2):
+        archive.write(synthetic_samples(sample_rate, 3600, seed=day), sample_rate, START + timedelta(days=day))
+
+    horizon = START + timedelta(days=1, minutes=30, seconds=20)
+    removed = archive.prune(horizon)
+
+    # the whole first day, and the chunks of the second one that end before the horizon
+    assert len(removed) == 60 + 30
+    assert not os.path.exists(os.path.join(archive.path, START.date().isoformat()))
+    assert archive.coverage(START, START + timedelta(days=2)) == [(START + timedelta(days=1, minutes=30), START + timedelta(days=1, hours=1))]
+    piece = archive.read(START + timedelta(days=1, minutes=31), START + timedelta(days=1, minutes=32))
+    assert piece.gaps == [] and np.any(piece.samples != 0)
+
+    # nothing left to prune
+    assert archive.prune(horizon) == []
+    archive.close()
+
+
+def test_read_across_midnight_and_chunks(tmp_path):
+    archive = ContinuousArchive(str(tmp_path / 'station'), chunk_seconds=7)
+    before_midnight = datetime(2025, 5, 24, 23, 59, 50, tzinfo=timezone.utc)
+    samples = synthetic_samples(100, 20, seed=0)
+    archive.write(samples, 100, before_midnight)
+
+    assert sorted(name for name in os.listdir(archive.path) if os.path.isdir(os.path.join(archive.path, name))) == ['2025-05-24', '2025-05-25']
+    piece = ArchiveReader(str(tmp_path)).read('station', before_midnight + timedelta(seconds=3), before_midnight + timedelta(seconds=17))
+    assert piece.sample_rate == 100
+    assert piece.start_time == before_midnight + timedelta(seconds=3)
+    assert piece.gaps == []
+    np.testing.assert_array_equal(piece.samples, samples[300:1700].astype(np.float32) / FULL_SCALE)
+
+    # before and after the segment
+    piece = archive.read(before_midnight - timedelta(seconds=5), before_midnight + timedelta(seconds=25))
+    assert piece.gaps == [(before_midnight - timedelta(seconds=5), before_midnight),
+                          (before_midnight + timedelta(seconds=20), before_midnight + timedelta(seconds=25))]
+    np.testing.assert_array_equal(piece.samples[:500], 0)
+    archive.close()
+
+
+def test_overlaps_are_recorded_and_the_later_write_wins(tmp_path):
+    archive = ContinuousArchive(str(tmp_path), chunk_seconds=60)
+    first, second = synthetic_samples(100, 10, seed=0), synthetic_samples(100, 10, seed=1)
+    archive.write(first, 100, START)
+    archive.write(second, 100, START + timedelta(seconds=8))
+    # jitter within the tolerance is neither a gap nor an overlap
+    archive.write(synthetic_samples(100, 10, seed=2), 100, START + timedelta(seconds=18.005))
+
+    end = START + timedelta(seconds=28.005)
+    assert archive.overlaps(START, end) == [(START + timedelta(seconds=8), START + timedelta(seconds=10))]
+    assert archive.gaps(START, end) == []
+    np.testing.assert_array_equal(archive.read(START + timedelta(seconds=8), START + timedelta(seconds=10)).samples,
+                                  second[:200].astype(np.float32) / FULL_SCALE)
+
+    with pytest.raises(ValueError):
+        archive.write(first, 200, START + timedelta(minutes=5))
+    archive.close()
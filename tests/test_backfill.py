@@ -0,0 +1,135 @@
+"""
+test_backfill.py
+
+Backfilling historical periods.
+"""
+
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from hydrophone_streamer.backfill import BackfillCheckpoint, backfill, run_backfill
+from hydrophone_streamer.supported_classes.base_streaming_class import BaseStreamingClass
+from hydrophone_streamer.supported_classes.ooi_streaming_class import OOIStreamingClass
+from hydrophone_streamer.supported_classes.orcasound_streaming_class import OrcasoundStreamingClass
+
+
+class LiveOnlyStation(BaseStreamingClass):
+    network = 'live_only_test'
+
+    def _file_time(self, filename: str) -> datetime:
+        return datetime.now(timezone.utc)
+
+    def download_data(self) -> list:
+        return []
+
+
+class ShardedStation(BaseStreamingClass):
+    network = 'sharded_test'
+    built_in_delay = 30 # minutes
+
+    def _file_time(self, filename: str) -> datetime:
+        return datetime.now(timezone.utc)
+
+    def download_data(self) -> list:
+        return []
+
+    def latest_file(self) -> None:
+        pass
+
+    def backfill_shards(self, start: datetime, end: datetime) -> list:
+        shards = []
+        while start < end:
+            shards.append((start, min(start + timedelta(days=1), end)))
+            start += timedelta(days=1)
+        return shards
+
+    def backfill_shard(self, start: datetime, end: datetime) -> list:
+        self.hydrophone_identifier['fetched'].append(start)
+        if start in self.hydrophone_identifier['failing']:
+            raise ConnectionError('archive unreachable')
+        return [f'{start.date().isoformat()}.flac']
+
+
+def test_interrupted_backfill_resumes_with_the_missing_shards(tmp_path):
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    end = start + timedelta(days=4)
+    save_dir = str(tmp_path / 'sharded')
+
+    first = ShardedStation({'fetched': [], 'failing': [start + timedelta(days=2)]}, save_dir=save_dir)
+    assert len(run_backfill(first, start, end, shard_workers=2)) == 3
+    assert sorted(first.hydrophone_identifier['fetched']) == [start + timedelta(days=i) for i in range(4)]
+    checkpoint = BackfillCheckpoint(save_dir)
+    assert [checkpoint.is_done(start + timedelta(days=i), start + timedelta(days=i + 1)) for i in range(4)] == [True, True, False, True]
+    first.close()
+
+    # run again, only the failed shard is fetched
+    second = ShardedStation({'fetched': [], 'failing': []}, save_dir=save_dir)
+    assert run_backfill(second, start, end) == ['2024-01-03.flac']
+    assert second.hydrophone_identifier['fetched'] == [start + timedelta(days=2)]
+    assert run_backfill(second, start, end) == []
+    second.close()
+
+
+def test_unsettled_shard_is_not_checkpointed(tmp_path):
+    now = datetime.now(timezone.utc)
+    start, end = now - timedelta(days=1, hours=12), now - timedelta(minutes=5)
+    station = ShardedStation({'fetched': [], 'failing': []}, save_dir=str(tmp_path / 'sharded'))
+
+    assert len(run_backfill(station, start, end)) == 2
+    # the archive may still publish segments for the last shard
+    checkpoint = BackfillCheckpoint(station.save_dir)
+    assert checkpoint.is_done(start, start + timedelta(days=1))
+    assert not checkpoint.is_done(start + timedelta(days=1), end)
+    station.close()
+
+
+def test_live_only_network_is_rejected(tmp_path):
+    assert OOIStreamingClass.supports_backfill()
+    assert not OrcasoundStreamingClass.supports_backfill()
+
+    save_dir = tmp_path / 'orcasound_lab'
+    with pytest.raises(ValueError):
+        backfill('orcasound', {'node': 'rpi_orcasound_lab'}, str(save_dir), '2025-05-01', '2025-05-02')
+    # rejected before the station is set up
+    assert not save_dir.exists()
+
+    station = LiveOnlyStation({}, save_dir=str(tmp_path / 'live_only'))
+    try:
+        with pytest.raises(ValueError):
+            run_backfill(station, '2025-05-01', '2025-05-02')
+    finally:
+        station.close()
+
+
+CLOSED = []
+
+
+def test_station_is_closed_after_the_backfill(tmp_path):
+    from hydrophone_streamer.registry import register_network
+    from standins import OOIServer
+
+    with OOIServer(n_segments=3) as server:
+        server.release(3)
+
+        class ClosingOOIStreamingClass(OOIStreamingClass):
+            url_prefixes = (server.url,)
+
+            def close(self) -> None:
+                CLOSED.append(self.save_dir)
+                super().close()
+
+        register_network('ooi_backfill_test', ClosingOOIStreamingClass)
+        now = datetime.now(timezone.utc)
+        start, end = (now - timedelta(hours=1)).date().isoformat(), (now + timedelta(days=1)).date().isoformat()
+        save_dir = str(tmp_path / 'ooi_backfill')
+
+        files = backfill('ooi_backfill_test', {'url': server.url}, save_dir, start, end)
+        assert len(files) == 3
+        assert CLOSED == [save_dir]
+
+        with pytest.raises(AssertionError):
+            # end before start
+            backfill('ooi_backfill_test', {'url': server.url}, save_dir, end, start)
+        assert CLOSED == [save_dir, save_dir]
@@ -0,0 +1,161 @@
+"""
+test_coordination.py
+
+Lease handoffs between supervisors in separate processes sharing one save_dir.
+"""
+
+
+import json
+import multiprocessing
+import os
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+from hydrophone_streamer.coordination import Coordinator, LeaseLost, SQLiteLeaseBackend
+from hydrophone_streamer.supported_classes.base_streaming_class import BaseStreamingClass
+
+
+STATION = 'shared'
+POLL_SECONDS = 1.5
+
+
+class SlowStation(BaseStreamingClass):
+    network = 'slow_test'
+
+    def _file_time(self, filename: str) -> datetime:
+        return datetime.fromtimestamp(int(os.path.basename(filename).split('_')[1].split('.')[0]) / 1e9, tz=timezone.utc)
+
+    def _log(self, event: str) -> None:
+        with open(os.path.join(self.save_dir, 'polls.jsonl'), 'a') as f:
+            f.write(json.dumps({'pid': os.getpid(), 'event': event, 'time': time.time()}) + '\n')
+
+    def download_data(self) -> list:
+        """
+        A long poll writing one segment at its end.
+        """
+        self._log('start')
+        time.sleep(POLL_SECONDS)
+        path = os.path.join(self.save_dir, f'{os.getpid()}_{time.time_ns()}.flac')
+        with open(path, 'wb') as f:
+            f.write(b'\0')
+        self._register_segment(path)
+        self._log('end')
+        return [path]
+
+    def latest_file(self) -> None:
+        self._write_latest(self.segment_index.latest().filename)
+
+    def next_poll_delay(self, n_fetched: int, error: bool = False) -> float:
+        return 0.05
+
+
+def run_supervisor(db: str, save_dir: str, worker_id: str) -> None:
+    from hydrophone_streamer.registry import register_network
+    from hydrophone_streamer.supervisor import Supervisor
+
+    register_network('slow_test', SlowStation)
+    coordinator = Coordinator(SQLiteLeaseBackend(db), [STATION], worker_id=worker_id, ttl=1.5, heartbeat_interval=0.2)
+    spec = {'hydrophone_network': 'slow_test', 'stream_setting': {}, 'save_dir': save_dir, 'name': STATION}
+    Supervisor([spec], coordinator=coordinator).run()
+
+
+def hold_leases(db: str, worker_id: str) -> None:
+    Coordinator(SQLiteLeaseBackend(db), [STATION], worker_id=worker_id, ttl=1, heartbeat_interval=0.2).start()
+    while True:
+        time.sleep(1)
+
+
+def read_polls(save_dir: str) -> dict:
+    """
+    (start, end) of every completed poll, by process.
+    """
+    polls, started = {}, {}
+    path = os.path.join(save_dir, 'polls.jsonl')
+    if not os.path.exists(path):
+        return polls
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            if record['event'] == 'start':
+                started[record['pid']] = record['time']
+            else:
+                polls.setdefault(record['pid'], []).append((started[record['pid']], record['time']))
+    return polls
+
+
+def wait_for(condition, timeout: float = 20) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.05)
+
+
+@pytest.fixture
+def spawn():
+    context = multiprocessing.get_context('spawn')
+    processes = []
+
+    def start(target, *args):
+        process = context.Process(target=target, args=args, daemon=True)
+        process.start()
+        processes.append(process)
+        return process
+
+    yield start
+    for process in processes:
+        process.kill()
+        process.join()
+
+
+def test_handoff_waits_for_the_poll_in_flight(tmp_path, spawn):
+    db = str(tmp_path / 'leases.sqlite')
+    save_dir = str(tmp_path / STATION)
+    SQLiteLeaseBackend(db).close()
+
+    # the joining worker sorts first, so the fair share moves the station to it
+    holder = spawn(run_supervisor, db, save_dir, 'worker_b')
+    wait_for(lambda: len(read_polls(save_dir).get(holder.pid, [])) >= 1)
+    joiner = spawn(run_supervisor, db, save_dir, 'worker_a')
+    wait_for(lambda: len(read_polls(save_dir).get(joiner.pid, [])) >= 1)
+
+    polls = read_polls(save_dir)
+    for start, end in polls[holder.pid]:
+        for other_start, other_end in polls[joiner.pid]:
+            assert end <= other_start or other_end <= start, "two processes polled the station at the same time"
+    assert max(end for _, end in polls[holder.pid]) <= min(start for start, _ in polls[joiner.pid])
+
+
+def test_stale_writer_is_fenced(tmp_path, spawn):
+    db = str(tmp_path / 'leases.sqlite')
+    backend = SQLiteLeaseBackend(db)
+    coordinator = Coordinator(backend, [STATION], worker_id='worker_a', ttl=1, heartbeat_interval=0.2)
+    coordinator.step()
+    lease = coordinator.begin(STATION)
+    assert lease is not None
+    coordinator.check(STATION, lease.epoch)
+
+    # the heartbeat of this worker stalls mid-poll, another worker takes the station over
+    spawn(hold_leases, db, 'worker_b')
+    wait_for(lambda: backend.lease(STATION) is not None and backend.lease(STATION).owner == 'worker_b')
+
+    with pytest.raises(LeaseLost):
+        coordinator.check(STATION, lease.epoch)
+    coordinator.step()
+    assert not coordinator.owns(STATION)
+    coordinator.end(STATION)
+    assert backend.lease(STATION).owner == 'worker_b'
+    assert backend.lease(STATION).epoch > lease.epoch
+
+
+def test_lease_released_and_taken_again_gets_a_new_epoch(tmp_path):
+    backend = SQLiteLeaseBackend(str(tmp_path / 'leases.sqlite'))
+    first = backend.acquire(STATION, 'worker_a', ttl=30)
+    backend.release(STATION, 'worker_a')
+    second = backend.acquire(STATION, 'worker_b', ttl=30)
+    backend.release(STATION, 'worker_b')
+    third = backend.acquire(STATION, 'worker_a', ttl=30)
+    assert first.epoch < second.epoch < third.epoch
+    assert backend.renew(STATION, 'worker_a', ttl=30)
+    assert backend.acquire(STATION, 'worker_a', ttl=30).epoch == third.epoch
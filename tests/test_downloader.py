@@ -0,0 +1,84 @@
+"""
+test_downloader.py
+
+Resumed downloads against a server that drops connections partway.
+"""
+
+
+import os
+
+import pytest
+
+from hydrophone_streamer.downloader import CHUNK_SIZE, download_file, probe
+
+
+def test_dropped_connections_resume_with_range(flaky_server, tmp_path):
+    flaky_server.drops = 2
+    flaky_server.drop_after = 5 * CHUNK_SIZE # a chunk cut short is read again
+    local_path = str(tmp_path / 'segment.mseed')
+
+    n_bytes = download_file(flaky_server.url, local_path, retry_delay=0)
+
+    assert n_bytes == len(flaky_server.body)
+    with open(local_path, 'rb') as f:
+        assert f.read() == flaky_server.body
+    assert not os.path.exists(local_path + '.part')
+    assert [(r, s) for _, r, _, s in flaky_server.requests] == [(None, 200), (f'bytes={5 * CHUNK_SIZE}-', 206), (f'bytes={10 * CHUNK_SIZE}-', 206)]
+
+
+def test_part_file_is_resumed_by_the_next_call(flaky_server, tmp_path):
+    flaky_server.drops = 1
+    flaky_server.drop_after = 6 * CHUNK_SIZE
+    local_path = str(tmp_path / 'segment.mseed')
+
+    with pytest.raises(IOError):
+        download_file(flaky_server.url, local_path, retries=0)
+    # only complete files are published under the final name
+    assert not os.path.exists(local_path)
+    assert os.path.getsize(local_path + '.part') == 6 * CHUNK_SIZE
+
+    download_file(flaky_server.url, local_path, retries=0)
+    with open(local_path, 'rb') as f:
+        assert f.read() == flaky_server.body
+    assert not os.path.exists(local_path + '.part')
+    assert flaky_server.requests[-1][1:] == (f'bytes={6 * CHUNK_SIZE}-', None, 206)
+
+
+def test_changed_file_is_downloaded_again_in_full(flaky_server, tmp_path):
+    remote = probe(flaky_server.url)
+    flaky_server.drops = 1
+    flaky_server.drop_after = 5 * CHUNK_SIZE
+    new_body = os.urandom(len(flaky_server.body))
+    flaky_server.body_after_drop = new_body
+    local_path = str(tmp_path / 'segment.mseed')
+
+    download_file(flaky_server.url, local_path, expected_size=remote.size, etag=remote.etag, retry_delay=0)
+
+    # If-Range with the old ETag, so the server answers 200 with the new file instead of splicing it
+    assert flaky_server.requests[-1][1:] == (f'bytes={5 * CHUNK_SIZE}-', remote.etag, 200)
+    with open(local_path, 'rb') as f:
+        assert f.read() == new_body
+
+
+def test_changed_file_is_refused_once_bytes_were_passed_on(flaky_server, tmp_path):
+    remote = probe(flaky_server.url)
+    flaky_server.drops = 1
+    flaky_server.drop_after = 300000
+    flaky_server.body_after_drop = os.urandom(len(flaky_server.body))
+    local_path = str(tmp_path / 'segment.mseed')
+    chunks = []
+
+    with pytest.raises(ValueError):
+        download_file(flaky_server.url, local_path, expected_size=remote.size, etag=remote.etag,
+                      retry_delay=0, on_chunk=chunks.append)
+    assert not os.path.exists(local_path) and not os.path.exists(local_path + '.part')
+
+
+def test_on_chunk_sees_every_byte_once(flaky_server, tmp_path):
+    flaky_server.drops = 2
+    flaky_server.drop_after = 250000
+    chunks = []
+
+    download_file(flaky_server.url, str(tmp_path / 'segment.mseed'), retry_delay=0, on_chunk=chunks.append)
+
+    assert b''.join(chunks) == flaky_server.body
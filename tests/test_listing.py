@@ -0,0 +1,76 @@
+"""
+test_listing.py
+
+Incremental parsing of the OOI day listings.
+"""
+
+
+from datetime import datetime, timedelta, timezone
+
+from hydrophone_streamer.listing import ListingCache
+from hydrophone_streamer.supported_classes.ooi_streaming_class import OOIStreamingClass
+from standins import OOIServer
+
+
+DAY_URL = 'https://rawdata.oceanobservatories.org/files/CE02SHBP/LJ01D/HYDBBA106/2025/05/24/'
+START = datetime(2025, 5, 24, tzinfo=timezone.utc)
+
+
+def listing(n_segments: int) -> str:
+    links = ['<a href="../">Parent Directory</a>']
+    for i in range(n_segments):
+        name = f"OO-HYEA2--YDH-{(START + timedelta(minutes=5 * i)).strftime('%Y-%m-%dT%H:%M:%S')}.000000Z.mseed"
+        links.append(f'<a href="./{name}">{name}</a> 2025-05-24 12:00  100M')
+    return '<html><body><pre>' + '\n'.join(links) + '</pre></body></html>'
+
+
+def parse_time(href: str) -> datetime:
+    return datetime.strptime(href[len('./OO-HYEA2--YDH-'):-len('.mseed')], '%Y-%m-%dT%H:%M:%S.%fZ').replace(tzinfo=timezone.utc)
+
+
+def test_only_new_entries_are_added():
+    parsed = []
+
+    def counting_parse_time(href: str) -> datetime:
+        parsed.append(href)
+        return parse_time(href)
+
+    cache = ListingCache(counting_parse_time)
+    assert cache.update(DAY_URL, listing(10)) == 10
+    assert cache.update(DAY_URL, listing(10)) == 0
+    assert cache.update(DAY_URL, listing(12)) == 2
+    # the head of the listing is not parsed again
+    assert len(parsed) == 12
+
+    entries = cache.entries(DAY_URL, START + timedelta(minutes=10), START + timedelta(minutes=25))
+    assert [time for time, _ in entries] == [START + timedelta(minutes=m) for m in (15, 20, 25)]
+    assert entries[0][1] == DAY_URL + 'OO-HYEA2--YDH-2025-05-24T00:15:00.000000Z.mseed'
+
+
+def test_listing_without_the_last_link_is_parsed_whole():
+    cache = ListingCache(parse_time)
+    cache.update(DAY_URL, listing(5))
+    # the newest file was withdrawn and others were published
+    text = listing(8).replace('2025-05-24T00:20:00', '2025-05-24T00:21:00')
+    assert cache.update(DAY_URL, text) == 4
+    assert len(cache.entries(DAY_URL, START - timedelta(minutes=1), START + timedelta(days=1))) == 9
+
+
+def test_previous_day_is_listed_until_the_window_leaves_it(tmp_path):
+    with OOIServer(n_segments=1) as server:
+        class LocalOOIStreamingClass(OOIStreamingClass):
+            url_prefixes = (server.url,)
+
+        station = LocalOOIStreamingClass({'url': server.url}, save_dir=str(tmp_path / 'ooi_station'))
+        midnight = datetime(2025, 5, 25, tzinfo=timezone.utc)
+        yesterday, today = [station._day_urls(day, day)[0] for day in (midnight - timedelta(days=1), midnight)]
+        station.listing_cache.update(yesterday, listing(3))
+
+        # the catch-up window crosses midnight
+        assert station._day_urls(midnight - timedelta(minutes=30), midnight + timedelta(minutes=5)) == [yesterday, today]
+        assert len(station.listing_cache.entries(yesterday, START - timedelta(minutes=1), midnight)) == 3
+
+        # once it has left the previous day, its entries are dropped
+        assert station._day_urls(midnight + timedelta(minutes=5), midnight + timedelta(minutes=35)) == [today]
+        assert station.listing_cache.entries(yesterday, START - timedelta(minutes=1), midnight) == []
+        station.close()
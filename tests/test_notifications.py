@@ -0,0 +1,70 @@
+"""
+test_notifications.py
+
+Following new segments through segments.jsonl.
+"""
+
+
+import queue
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from hydrophone_streamer.notifications import SegmentFeed, _has_unix_sockets, follow
+
+
+START = datetime(2025, 5, 24, tzinfo=timezone.utc)
+
+
+def publish(feed: SegmentFeed, i: int) -> dict:
+    return feed.publish(f'segment_{i}.flac', START + timedelta(minutes=5 * i), duration=300)
+
+
+def test_follow_resumes_after_the_cursor(tmp_path):
+    feed = SegmentFeed(str(tmp_path))
+    for i in range(3):
+        publish(feed, i)
+
+    entries = list(follow(str(tmp_path), cursor=1, timeout=0.2))
+    assert [entry['seq'] for entry in entries] == [2, 3]
+    assert entries[0]['path'] == str(tmp_path / 'segment_1.flac')
+    assert entries[0]['start_time'] == (START + timedelta(minutes=5)).isoformat()
+
+    # a new feed object (i.e. after a restart) keeps numbering
+    assert publish(SegmentFeed(str(tmp_path)), 3)['seq'] == 4
+
+
+def test_partial_line_waits_for_the_rest(tmp_path):
+    feed = SegmentFeed(str(tmp_path))
+    publish(feed, 0)
+    with open(feed.path, 'a') as f:
+        f.write('{"seq": 2, "file": "segment_1.fl')
+
+    assert [entry['seq'] for entry in follow(str(tmp_path), timeout=0.2)] == [1]
+
+
+@pytest.mark.skipif(not _has_unix_sockets(), reason='needs Unix domain sockets')
+def test_followers_are_woken_up(tmp_path):
+    feed = SegmentFeed(str(tmp_path))
+    received = queue.Queue()
+
+    def consume() -> None:
+        # re-reading the feed alone would take 30 s
+        for entry in follow(str(tmp_path), timeout=5, poll_interval=30):
+            received.put((entry['seq'], time.monotonic()))
+            if entry['seq'] == 2:
+                return
+
+    follower = threading.Thread(target=consume)
+    follower.start()
+    time.sleep(0.3)
+    published = time.monotonic()
+    publish(feed, 0)
+    publish(feed, 1)
+    follower.join(timeout=5)
+
+    seqs = [received.get_nowait() for _ in range(received.qsize())]
+    assert [seq for seq, _ in seqs] == [1, 2]
+    assert seqs[-1][1] - published < 1
@@ -0,0 +1,109 @@
+"""
+test_onc_streaming_class.py
+
+ONC archive files already on disk, i.e. after a crash between the download and
+the index, or on a retried backfill shard.
+"""
+
+
+import os
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+os.environ.setdefault('ONC_TOKEN', 'test')
+
+from hydrophone_streamer.supported_classes.onc_streaming_class import ONCStreamingClass
+
+
+DEVICE_CODE = 'ICLISTENHF6095'
+
+
+class FakeArchive:
+    def __init__(self, out_path: str, names: list) -> None:
+        """
+        The calls of the onc client used for archive files. getFile refuses to
+        overwrite a non-empty file, as onc's saveAsFile does.
+        """
+        self.outPath = out_path
+        self.names = names
+        self.fetched = []
+
+    def getListByDevice(self, filters: dict, allPages: bool = False) -> dict:
+        return {'files': list(self.names)}
+
+    def getFile(self, filename: str = '', overwrite: bool = False) -> dict:
+        path = os.path.join(self.outPath, filename)
+        if not overwrite and os.path.exists(path) and os.path.getsize(path) != 0:
+            raise FileExistsError(path)
+        write_flac(path)
+        self.fetched.append(filename)
+        return {'status': 'completed', 'file': filename}
+
+
+def write_flac(path: str) -> None:
+    sf.write(path, np.zeros(1000, dtype=np.int16), 1000, format='FLAC')
+
+
+def file_names(start: datetime, n_files: int) -> list:
+    times = [start + timedelta(minutes=5 * i) for i in range(n_files)]
+    return [f"{DEVICE_CODE}_{time.strftime('%Y%m%dT%H%M%S')}.000Z.flac" for time in times]
+
+
+@pytest.fixture
+def station(tmp_path):
+    save_dir = str(tmp_path / 'onc_station')
+    os.makedirs(save_dir)
+    # skip the citation lookup against the deployments API
+    with open(os.path.join(save_dir, 'reference.bib'), 'w') as f:
+        f.write('@misc{test,}')
+    return ONCStreamingClass({'deviceCode': DEVICE_CODE}, save_dir=save_dir)
+
+
+def test_file_on_disk_but_not_indexed_is_registered(station):
+    names = file_names(datetime.now(timezone.utc) - timedelta(hours=5), 3)
+    station.onc = FakeArchive(station.save_dir, names)
+    # downloaded before a crash, never registered
+    write_flac(os.path.join(station.save_dir, names[1]))
+
+    fetched = station.download_data()
+
+    assert [os.path.basename(path) for path in fetched] == names
+    assert sorted(station.onc.fetched) == [names[0], names[2]]
+    assert all(station.segment_index.contains(name) for name in names)
+    assert station._read_cursor()[1] == names[-1]
+
+
+def test_retried_backfill_shard_completes(station):
+    start = datetime(2025, 5, 1, tzinfo=timezone.utc)
+    names = file_names(start, 4)
+    station.onc = FakeArchive(station.save_dir, names)
+    # an earlier try of the shard fetched half the files before failing
+    for name in names[:2]:
+        write_flac(os.path.join(station.save_dir, name))
+
+    fetched = station.backfill_shard(start, start + timedelta(hours=6))
+
+    assert len(fetched) == 4
+    assert sorted(station.onc.fetched) == names[2:]
+    assert len(station.segment_index) == 4
+
+
+def test_untracked_files_are_registered_in_time_order(station, monkeypatch):
+    import glob
+    import json
+
+    names = file_names(datetime.now(timezone.utc) - timedelta(hours=1), 5)
+    for name in names:
+        write_flac(os.path.join(station.save_dir, name))
+    # glob makes no promise on the order
+    listed = glob.glob
+    monkeypatch.setattr(glob, 'glob', lambda pattern, **kwargs: sorted(listed(pattern, **kwargs), reverse=pattern.endswith('.flac')))
+
+    registered = station._index_untracked_files()
+
+    assert [os.path.basename(path) for path in registered] == names
+    with open(os.path.join(station.save_dir, 'segments.jsonl')) as f:
+        assert [json.loads(line)['file'] for line in f] == names
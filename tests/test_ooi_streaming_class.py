@@ -0,0 +1,52 @@
+"""
+test_ooi_streaming_class.py
+
+OOI segments against the local stand-in of the raw data archive.
+"""
+
+
+import glob
+import os
+
+import pytest
+
+from hydrophone_streamer.supported_classes.ooi_streaming_class import OOIStreamingClass
+from standins import OOIServer
+
+
+@pytest.fixture
+def server():
+    with OOIServer(n_segments=3) as server:
+        server.release(3)
+        yield server
+
+
+def make_station(server, save_dir: str, **kwargs) -> OOIStreamingClass:
+    class LocalOOIStreamingClass(OOIStreamingClass):
+        url_prefixes = (server.url,)
+
+    return LocalOOIStreamingClass({'url': server.url}, save_dir=save_dir, **kwargs)
+
+
+@pytest.mark.parametrize('streaming_decode', [False, True])
+def test_flac_on_disk_but_not_indexed_is_registered_without_download(server, tmp_path, streaming_decode):
+    station = make_station(server, str(tmp_path / 'ooi_station'), streaming_decode=streaming_decode)
+    assert len(station.poll()) == 3
+
+    # a crash between the transcode and the index, with the mseed still next to the FLAC
+    flac_path = sorted(glob.glob(os.path.join(station.save_dir, '*.flac')))[-1]
+    station.segment_index.remove(flac_path)
+    mseed_path = flac_path.replace('.flac', '.mseed')
+    with open(mseed_path, 'wb') as f:
+        f.write(b'\0' * 100)
+    bytes_sent = server.published.bytes_sent
+
+    fetched = station.poll()
+
+    assert fetched == [flac_path]
+    assert station.segment_index.contains(flac_path)
+    assert station.segment_index.get(flac_path).duration == pytest.approx(15)
+    assert not os.path.exists(mseed_path)
+    # the listing at most, no segment body
+    assert server.published.bytes_sent - bytes_sent < 100000
+    assert len(station.poll()) == 0
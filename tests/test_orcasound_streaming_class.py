@@ -0,0 +1,94 @@
+"""
+test_orcasound_streaming_class.py
+
+Orcasound segments against the local stand-in of a node's HLS bucket. The stand-in
+and the class both need ffmpeg.
+"""
+
+
+import glob
+import os
+import shutil
+import time
+
+import pytest
+import soundfile as sf
+
+from standins import HLSServer
+
+
+pytestmark = pytest.mark.skipif(shutil.which(os.environ.get('FFMPEG_BINARY', 'ffmpeg')) is None, reason='needs ffmpeg')
+
+
+class EndingHLSServer(HLSServer):
+    """
+    HLSServer that ends the playlist once `ended` is set and answers 503 for the
+    segments in `failing`, once each.
+    """
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.ended = False
+        self.failing = set()
+        # the stream starts on a minute, two minutes ago, so batches are predictable
+        self.folder = str(int(time.time()) // 60 * 60 - 120)
+
+    def _resolve(self, path: str) -> tuple:
+        name = path.rsplit('/', 1)[-1]
+        if name in self.failing:
+            self.failing.discard(name)
+            return 503, b'', None
+        status, body, modified = super()._resolve(path)
+        if name == 'live.m3u8' and status == 200 and self.ended:
+            body += b'#EXT-X-ENDLIST\n'
+        return status, body, modified
+
+
+def make_station(server, save_dir: str):
+    from hydrophone_streamer.supported_classes.orcasound_streaming_class import OrcasoundStreamingClass
+
+    return OrcasoundStreamingClass({'node': server.node, 'url': server.url}, save_dir=save_dir, max_workers=2)
+
+
+def test_failed_segment_of_an_ended_stream_is_retried_on_an_unchanged_playlist(tmp_path):
+    with EndingHLSServer(n_segments=6) as server:
+        server.release(6)
+        server.ended = True
+        server.failing.add('live002.ts')
+        station = make_station(server, str(tmp_path / 'orcasound_station'))
+
+        assert station.poll() == []
+        assert station._read_cursor()['next_sequence'] == 2
+
+        # the playlist is answered with a 304 from here on
+        fetched = station.poll()
+
+        assert len(fetched) == 1
+        assert sf.info(fetched[0]).duration == pytest.approx(60, abs=0.5)
+        cursor = station._read_cursor()
+        assert cursor['next_sequence'] == 6
+        assert cursor['pending'] == []
+        assert station.poll() == []
+
+
+def test_pending_segments_whose_files_are_gone_are_dropped(tmp_path):
+    with EndingHLSServer(n_segments=6) as server:
+        server.release(3)
+        station = make_station(server, str(tmp_path / 'orcasound_station'))
+
+        # half a minute, waiting for the rest of its batch
+        assert station.poll() == []
+        assert len(station._read_cursor()['pending']) == 3
+        # i.e. the hls folder was cleared while the streamer was down
+        for path in glob.glob(os.path.join(station.hls_dir, '*.ts')):
+            os.remove(path)
+
+        server.release(3)
+        server.ended = True
+        fetched = station.poll()
+
+        # the second half of the minute is still archived
+        assert len(fetched) == 1
+        assert sf.info(fetched[0]).duration == pytest.approx(30, abs=0.5)
+        assert station._read_cursor()['pending'] == []
+        assert glob.glob(os.path.join(station.hls_dir, '*.ts')) == []
+        assert station.poll() == []
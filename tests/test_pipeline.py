@@ -0,0 +1,94 @@
+"""
+test_pipeline.py
+
+The download -> transcode pipeline with stand-in stages.
+"""
+
+
+import os
+import threading
+import time
+
+import pytest
+
+from hydrophone_streamer.pipeline import SegmentPipeline
+
+
+def transcode(path: str) -> str:
+    """
+    Runs in a worker process, so it lives at module level.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    with open(path + '.out', 'wb') as f:
+        f.write(data[::-1])
+    return path + '.out'
+
+
+class Downloads:
+    def __init__(self, directory, delay: float = 0.0) -> None:
+        self.directory = directory
+        self.delay = delay
+        self.started = []
+        self._lock = threading.Lock()
+
+    def __call__(self, job: int):
+        with self._lock:
+            self.started.append(job)
+        time.sleep(self.delay)
+        if job % 5 == 4:
+            return None # skipped
+        path = os.path.join(self.directory, f'{job:03d}.bin')
+        with open(path, 'wb') as f:
+            f.write(bytes([job]) * (100 + job))
+        return path
+
+
+def test_results_come_back_in_job_order(tmp_path):
+    downloads = Downloads(str(tmp_path))
+    pipeline = SegmentPipeline(downloads, transcode, download_workers=4, max_pending=3)
+
+    results = [(job, future.result()) for job, future in pipeline.run(range(10))]
+
+    assert [job for job, _ in results] == list(range(10))
+    for job, path in results:
+        if job % 5 == 4:
+            assert path is None
+            continue
+        with open(path, 'rb') as f:
+            assert f.read() == bytes([job]) * (100 + job)
+    download, transcoded = pipeline.report()
+    assert download['items'] == transcoded['items'] == 8
+
+
+def test_stopped_consumer_stops_the_pipeline(tmp_path):
+    downloads = Downloads(str(tmp_path), delay=0.05)
+    pipeline = SegmentPipeline(downloads, transcode, download_workers=2, max_pending=3)
+
+    with pytest.raises(RuntimeError):
+        for job, future in pipeline.run(range(30)):
+            # i.e. the lease was lost while registering the first segment
+            raise RuntimeError('stop')
+
+    time.sleep(0.3)
+    # only the jobs in flight when the consumer stopped
+    assert len(downloads.started) <= 3 + 1
+
+
+def test_refused_transcode_is_the_result_of_its_job(tmp_path):
+    calls = []
+
+    def check() -> None:
+        calls.append(None)
+        if len(calls) == 2:
+            raise PermissionError('fenced')
+
+    pipeline = SegmentPipeline(Downloads(str(tmp_path)), transcode, download_workers=1, max_pending=1, check=check)
+
+    results = [(job, future) for job, future in pipeline.run(range(3))]
+
+    assert results[0][1].result().endswith('000.bin.out')
+    with pytest.raises(PermissionError):
+        results[1][1].result()
+    assert not os.path.exists(str(tmp_path / '001.bin.out'))
+    assert results[2][1].result().endswith('002.bin.out')
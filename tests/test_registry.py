@@ -0,0 +1,72 @@
+"""
+test_registry.py
+
+Lazy, entry point based lookup of the networks.
+"""
+
+
+import os
+import subprocess
+import sys
+from importlib.metadata import EntryPoint
+
+import pytest
+
+from hydrophone_streamer import registry
+from hydrophone_streamer.supported_classes.base_streaming_class import BaseStreamingClass
+
+
+PLUGIN = '''
+from hydrophone_streamer.supported_classes.base_streaming_class import BaseStreamingClass
+
+
+class PluginStreamingClass(BaseStreamingClass):
+    network = 'plugin'
+'''
+
+
+@pytest.fixture
+def fresh_registry(monkeypatch, tmp_path):
+    monkeypatch.setattr(registry, '_targets', {})
+    monkeypatch.setattr(registry, '_classes', {})
+    monkeypatch.setattr(registry, '_discovered', False)
+    (tmp_path / 'hydrophone_plugin_test.py').write_text(PLUGIN)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    entry_point = EntryPoint(name='plugin', value='hydrophone_plugin_test:PluginStreamingClass', group=registry.ENTRY_POINT_GROUP)
+    monkeypatch.setattr('importlib.metadata.entry_points',
+                        lambda group: [entry_point] if group == registry.ENTRY_POINT_GROUP else [])
+    yield
+    sys.modules.pop('hydrophone_plugin_test', None)
+
+
+def test_plugins_are_imported_when_selected(fresh_registry):
+    assert registry.available_networks() == ['onc', 'ooi', 'ooi_async', 'orcasound', 'plugin']
+    assert 'hydrophone_plugin_test' not in sys.modules
+
+    network_class = registry.get_network_class('plugin')
+    assert issubclass(network_class, BaseStreamingClass) and network_class.network == 'plugin'
+    assert registry.get_network_class('plugin') is network_class
+
+    with pytest.raises(ValueError):
+        registry.get_network_class('hydrophonez')
+
+
+def test_registered_network_replaces_the_cached_class(fresh_registry):
+    class Replacement(BaseStreamingClass):
+        network = 'plugin'
+
+    registry.get_network_class('plugin')
+    registry.register_network('plugin', Replacement)
+    assert registry.get_network_class('plugin') is Replacement
+
+
+def test_listing_networks_imports_none_of_them():
+    code = ('import sys\n'
+            'import hydrophone_streamer.cli\n'
+            'from hydrophone_streamer.registry import available_networks\n'
+            'available_networks()\n'
+            'print(sorted(name for name in ("obspy", "onc", "scipy", "hydrophone_streamer.supported_classes.ooi_streaming_class") if name in sys.modules))\n')
+    src = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+    env = {**os.environ, 'PYTHONPATH': os.pathsep.join([src, os.environ.get('PYTHONPATH', '')])}
+    output = subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True, check=True).stdout
+    assert output.strip() == '[]'
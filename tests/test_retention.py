@@ -0,0 +1,86 @@
+"""
+test_retention.py
+
+Retention across several archives.
+"""
+
+
+import os
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from hydrophone_streamer.archive import ContinuousArchive
+from hydrophone_streamer.retention import RetentionPolicy, enforce_retention, prune_sample_sinks
+from hydrophone_streamer.segment_index import SegmentIndex
+from hydrophone_streamer.spectrogram import SpectrogramPyramid, SpectrogramReader
+from standins import synthetic_samples
+
+
+def make_archive(save_dir: str, start: datetime, n_segments: int) -> SegmentIndex:
+    os.makedirs(save_dir)
+    index = SegmentIndex(save_dir)
+    for i in range(n_segments):
+        filename = f'segment_{i}.flac'
+        with open(os.path.join(save_dir, filename), 'wb') as f:
+            f.write(b'\0' * 10)
+        index.add(filename, start + timedelta(minutes=5 * i), duration=300)
+    return index
+
+
+def test_global_retention_deletes_from_the_right_archive(tmp_path):
+    start = datetime(2025, 5, 1, tzinfo=timezone.utc)
+    # station a holds the oldest segments, so all the evictions come from it
+    index_a = make_archive(str(tmp_path / 'a'), start, 3)
+    index_b = make_archive(str(tmp_path / 'b'), start + timedelta(days=1), 3)
+
+    removed = enforce_retention([(index_a, None), (index_b, None)], RetentionPolicy(max_files=2))
+
+    assert sorted(removed) == sorted(str(tmp_path / 'a' / f'segment_{i}.flac') for i in range(3)) + [str(tmp_path / 'b' / 'segment_0.flac')]
+    assert not any(name.endswith('.flac') for name in os.listdir(tmp_path / 'a'))
+    assert os.path.exists(tmp_path / 'b' / 'segment_1.flac') and os.path.exists(tmp_path / 'b' / 'segment_2.flac')
+    assert len(index_a) == 0
+    assert len(index_b) == 2
+
+
+def test_global_retention_keeps_each_protected_file(tmp_path):
+    start = datetime(2025, 5, 1, tzinfo=timezone.utc)
+    index_a = make_archive(str(tmp_path / 'a'), start, 3)
+    index_b = make_archive(str(tmp_path / 'b'), start + timedelta(days=1), 3)
+
+    removed = enforce_retention([(index_a, str(tmp_path / 'a' / 'segment_0.flac')), (index_b, None)], RetentionPolicy(max_files=1))
+
+    assert str(tmp_path / 'a' / 'segment_0.flac') not in removed
+    assert os.path.exists(tmp_path / 'a' / 'segment_0.flac')
+    assert index_a.contains('segment_0.flac') and len(index_a) == 1
+    assert len(index_b) == 0
+
+
+def test_archive_and_spectrogram_follow_the_segments(tmp_path):
+    start = datetime(2025, 5, 1, tzinfo=timezone.utc)
+    index = make_archive(str(tmp_path / 'station'), start, 3)
+    # and a day later
+    for i in range(3, 6):
+        filename = f'segment_{i}.flac'
+        with open(tmp_path / 'station' / filename, 'wb') as f:
+            f.write(b'\0' * 10)
+        index.add(filename, start + timedelta(days=1, minutes=5 * (i - 3)), duration=300)
+
+    archive = ContinuousArchive(index.save_dir, chunk_seconds=60)
+    pyramid = SpectrogramPyramid(index.save_dir, nfft=16, levels=(60, 600))
+    for segment in index.iter_oldest():
+        samples = synthetic_samples(10, 300, seed=0)
+        archive.write(samples, 10, segment.start_time)
+        pyramid.write(samples, 10, segment.start_time)
+
+    enforce_retention([(index, None)], RetentionPolicy(max_files=2))
+    removed = prune_sample_sinks(index, [archive, pyramid])
+
+    oldest = start + timedelta(days=1, minutes=5)
+    assert any(path.endswith('.i32') for path in removed) and any(path.endswith('.f16') for path in removed)
+    assert archive.coverage(start, start + timedelta(days=2)) == [(oldest, oldest + timedelta(minutes=10))]
+    spectrogram = SpectrogramReader(index.save_dir).read(start, start + timedelta(days=1), level=600)
+    assert np.all(np.isnan(spectrogram.values.astype(np.float32)))
+    spectrogram = SpectrogramReader(index.save_dir).read(oldest, oldest + timedelta(minutes=10), level=60)
+    assert not np.any(np.isnan(spectrogram.values.astype(np.float32)))
+    archive.close()
@@ -0,0 +1,71 @@
+"""
+test_ring_buffer.py
+
+The shared memory PCM ring buffer.
+"""
+
+
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+
+from hydrophone_streamer.ring_buffer import PCMRingBuffer, RingBufferReader, pcm_to_float
+from standins import synthetic_samples
+
+
+START = datetime(2025, 5, 24, tzinfo=timezone.utc)
+
+
+def test_last_seconds_across_the_wrap(tmp_path):
+    ring = PCMRingBuffer(str(tmp_path), seconds=10)
+    segments = [synthetic_samples(100, 4, seed=i) for i in range(4)]
+    for i, samples in enumerate(segments):
+        ring.write(samples, 100, START + timedelta(seconds=4 * i))
+
+    reader = RingBufferReader(str(tmp_path))
+    assert reader.write_head == 1600
+    # 16 s were written, only the last 10 s are kept and they wrap around the end of the file
+    samples, start_time = reader.last(60)
+    assert start_time == START + timedelta(seconds=6)
+    np.testing.assert_array_equal(samples, pcm_to_float(np.concatenate(segments))[-1000:])
+
+    samples, start_time = reader.last(3)
+    assert start_time == START + timedelta(seconds=13)
+    np.testing.assert_array_equal(samples, pcm_to_float(segments[-1])[-300:])
+
+    with pytest.raises(IndexError):
+        # overwritten
+        reader.read(0, 100)
+    with pytest.raises(IndexError):
+        # not written yet
+        reader.read(1500, 200)
+
+
+def test_view_without_wrap_is_zero_copy(tmp_path):
+    ring = PCMRingBuffer(str(tmp_path), seconds=10)
+    ring.write(synthetic_samples(100, 2, seed=0), 100, START)
+    reader = RingBufferReader(str(tmp_path / 'ring.pcm'))
+    view = reader.read(50, 100)
+    assert isinstance(view, np.memmap)
+    assert reader.time_of(50) == START + timedelta(seconds=0.5)
+
+
+def test_long_segment_keeps_its_tail(tmp_path):
+    ring = PCMRingBuffer(str(tmp_path), seconds=10)
+    samples = synthetic_samples(100, 25, seed=0)
+    ring.write(samples, 100, START)
+
+    samples_read, start_time = RingBufferReader(str(tmp_path)).last(10)
+    assert start_time == START + timedelta(seconds=15)
+    np.testing.assert_array_equal(samples_read, pcm_to_float(samples[-1000:]))
+
+
+def test_new_sample_rate_recreates_the_buffer(tmp_path):
+    ring = PCMRingBuffer(str(tmp_path), seconds=10)
+    ring.write(synthetic_samples(100, 5, seed=0), 100, START)
+    ring.write(synthetic_samples(200, 1, seed=1), 200, START + timedelta(seconds=5))
+
+    reader = RingBufferReader(str(tmp_path))
+    assert reader.sample_rate == 200
+    assert reader.write_head == 200
@@ -0,0 +1,68 @@
+"""
+test_scheduler.py
+
+Cadence-aware poll delays.
+"""
+
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from hydrophone_streamer.scheduler import PollScheduler
+
+
+START = datetime(2025, 5, 24, tzinfo=timezone.utc)
+
+
+def learned(**kwargs) -> PollScheduler:
+    """
+    A scheduler that saw 5 minute segments arrive 30 minutes after they started.
+    """
+    scheduler = PollScheduler(jitter=0, **kwargs)
+    scheduler.seed(START + timedelta(minutes=5 * i) for i in range(4))
+    scheduler.observe([START + timedelta(minutes=15)], now=START + timedelta(minutes=45))
+    return scheduler
+
+
+def test_cadence_and_lag_are_learned():
+    scheduler = PollScheduler()
+    assert scheduler.next_delay(0, now=START) == scheduler.default_interval
+
+    scheduler = learned()
+    assert scheduler.cadence == 300
+    assert scheduler.lag == 1800
+    assert scheduler.next_arrival() == START + timedelta(minutes=50)
+    # catch-up segments of a batch say nothing about the lag
+    scheduler.observe([START + timedelta(minutes=20), START + timedelta(minutes=25)], now=START + timedelta(minutes=55))
+    assert scheduler.lags[-1] == 1800
+    assert list(scheduler.start_times)[-2:] == [START + timedelta(minutes=20), START + timedelta(minutes=25)]
+
+
+def test_sleeps_until_the_next_segment_then_polls_fast():
+    scheduler = learned()
+    # more may be waiting
+    assert scheduler.next_delay(1, now=START + timedelta(minutes=45)) == 0
+    assert scheduler.next_delay(0, now=START + timedelta(minutes=46)) == 240
+    assert scheduler.next_delay(0, now=START + timedelta(minutes=50, seconds=10)) == scheduler.min_interval
+
+
+@pytest.mark.parametrize('minutes_late, delay', [(2, 8), (3, 16), (10, 300)])
+def test_backs_off_while_data_is_overdue(minutes_late, delay):
+    scheduler = learned()
+    assert scheduler.next_delay(0, now=START + timedelta(minutes=50 + minutes_late)) == delay
+
+
+def test_errors_back_off_exponentially_up_to_a_limit():
+    scheduler = learned(max_backoff=60)
+    assert [scheduler.next_delay(0, error=True, now=START) for _ in range(5)] == [10, 20, 40, 60, 60]
+    assert scheduler.predictions()['consecutive_errors'] == 5
+    scheduler.next_delay(1, now=START)
+    assert scheduler.errors == 0
+
+
+def test_jitter_stays_within_bounds():
+    scheduler = PollScheduler(jitter=0.1)
+    delays = [scheduler.next_delay(0, error=True, now=START) for _ in range(3)]
+    for delay, nominal in zip(delays, [10, 20, 40]):
+        assert 0.9 * nominal <= delay <= 1.1 * nominal
@@ -0,0 +1,41 @@
+"""
+test_sessions.py
+
+Process wide HTTP plumbing.
+"""
+
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from hydrophone_streamer.sessions import HostLimiter, get_host_limiter
+
+
+def test_one_host_limiter_holds_the_smallest_limit():
+    limiter = get_host_limiter(7)
+    assert get_host_limiter(3) is limiter
+    assert limiter.max_per_host <= 3
+    assert get_host_limiter(7).max_per_host <= 3
+
+
+def test_stations_share_the_slots_of_a_host():
+    limiter = HostLimiter(4)
+    limiter.restrict(2)
+    lock = threading.Lock()
+    in_flight = {'a.example': 0, 'b.example': 0}
+    peak = dict(in_flight)
+
+    def fetch(host: str) -> None:
+        with limiter.limit(f'https://{host}/data'):
+            with lock:
+                in_flight[host] += 1
+                peak[host] = max(peak[host], in_flight[host])
+            time.sleep(0.02)
+            with lock:
+                in_flight[host] -= 1
+
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(fetch, ['a.example', 'b.example'] * 6))
+
+    assert peak == {'a.example': 2, 'b.example': 2}
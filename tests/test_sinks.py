@@ -0,0 +1,92 @@
+"""
+test_sinks.py
+
+S3 output sinks against moto.
+"""
+
+
+import glob
+import os
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from hydrophone_streamer.sinks import S3Sink
+from hydrophone_streamer.supported_classes.ooi_streaming_class import OOIStreamingClass
+from standins import OOIServer
+
+
+BUCKET = 'hydrophones'
+
+
+@pytest.fixture
+def client():
+    with mock_aws():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def keys(client) -> list:
+    return sorted(entry['Key'] for entry in client.list_objects_v2(Bucket=BUCKET).get('Contents', []))
+
+
+def write(path: str) -> str:
+    with open(path, 'wb') as f:
+        f.write(os.urandom(1000))
+    return path
+
+
+def test_without_keep_local_the_segment_latest_names_stays(client, tmp_path):
+    sink = S3Sink(BUCKET, 'station', client=client, keep_local=False)
+    first, second, third = [write(str(tmp_path / f'segment_{i}.flac')) for i in range(3)]
+    reference = write(str(tmp_path / 'reference.bib'))
+
+    sink.put_file(reference)
+    sink.put_file(first)
+    sink.put_file(second)
+    sink.put_text('latest.txt', 'segment_1.flac', after='segment_1.flac')
+    sink.flush()
+    assert sorted(os.listdir(tmp_path)) == ['reference.bib', 'segment_1.flac', 'segment_2.flac']
+
+    sink.put_file(third)
+    sink.put_text('latest.txt', 'segment_2.flac', after='segment_2.flac')
+    sink.flush()
+    assert sorted(os.listdir(tmp_path)) == ['reference.bib', 'segment_2.flac']
+
+    sink.close()
+    assert sorted(os.listdir(tmp_path)) == ['reference.bib', 'segment_2.flac']
+    assert keys(client) == ['station/latest.txt', 'station/reference.bib',
+                            'station/segment_0.flac', 'station/segment_1.flac', 'station/segment_2.flac']
+
+
+def make_station(server, save_dir: str, **kwargs) -> OOIStreamingClass:
+    class LocalOOIStreamingClass(OOIStreamingClass):
+        url_prefixes = (server.url,)
+
+    return LocalOOIStreamingClass({'url': server.url}, save_dir=save_dir, **kwargs)
+
+
+def test_station_without_keep_local(client, tmp_path):
+    output = {'type': 's3', 'bucket': BUCKET, 'region_name': 'us-east-1', 'keep_local': False}
+    with OOIServer(n_segments=3) as server:
+        server.release(3)
+
+        with pytest.raises(ValueError):
+            make_station(server, str(tmp_path / 'ooi_retention'), output=output, retention={'max_files': 2})
+
+        station = make_station(server, str(tmp_path / 'ooi_station'), output=output)
+        assert len(station.poll()) == 3
+        station.close()
+
+        # only the segment latest.txt names is left, the index still knows the rest
+        with open(os.path.join(station.save_dir, 'latest.txt')) as f:
+            latest = f.read().strip()
+        assert [os.path.basename(path) for path in glob.glob(os.path.join(station.save_dir, '*.flac'))] == [latest]
+        assert len(station.segment_index) == 3
+        assert len([key for key in keys(client) if key.endswith('.flac')]) == 3
+
+        bytes_sent = server.published.bytes_sent
+        assert station.poll() == []
+        assert server.published.bytes_sent - bytes_sent < 100000
@@ -0,0 +1,78 @@
+"""
+test_spectrogram.py
+
+The ingest-time spectrogram pyramid.
+"""
+
+
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+
+from hydrophone_streamer.spectrogram import SpectrogramPyramid, SpectrogramReader, stft_power
+
+
+START = datetime(2025, 5, 24, tzinfo=timezone.utc)
+SAMPLE_RATE = 1024
+
+
+def tone(seconds: float, frequency: float, amplitude: float = 0.5) -> np.ndarray:
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    return (amplitude * np.sin(2 * np.pi * frequency * t)).astype(np.float32)
+
+
+def test_power_of_a_tone():
+    power = stft_power(tone(4, 100), SAMPLE_RATE, nfft=256, hop=128)
+    assert power.shape == (31, 129)
+    frequencies = np.fft.rfftfreq(256, 1 / SAMPLE_RATE)
+    assert np.all(frequencies[np.argmax(power, axis=1)] == 100)
+    # the density integrates to the mean square of the signal
+    np.testing.assert_allclose(power.sum(axis=1) * (frequencies[1] - frequencies[0]), 0.5 ** 2 / 2, rtol=0.01)
+
+    assert stft_power(tone(0.1, 100), SAMPLE_RATE, nfft=256, hop=256).shape == (0, 129)
+
+
+def test_levels_average_the_same_frames(tmp_path):
+    pyramid = SpectrogramPyramid(str(tmp_path), nfft=256, levels=(1, 60))
+    # two segments sharing the minute bin
+    pyramid.write(tone(30, 100), SAMPLE_RATE, START)
+    pyramid.write(tone(30, 200, amplitude=0.1), SAMPLE_RATE, START + timedelta(seconds=30))
+
+    reader = SpectrogramReader(str(tmp_path))
+    assert reader.levels == [1, 60]
+    seconds = reader.read(START, START + timedelta(minutes=1), level=1)
+    minute = reader.read(START, START + timedelta(minutes=1), level=60)
+    assert seconds.values.shape == (60, 129) and minute.values.shape == (1, 129)
+    assert seconds.times[0] == np.datetime64('2025-05-24T00:00:00.000')
+
+    mean_power = (10 ** (seconds.values.astype(np.float64) / 10)).mean(axis=0)
+    np.testing.assert_allclose(minute.values[0].astype(np.float64), 10 * np.log10(mean_power), atol=0.15) # float16 steps
+    peaks = reader.frequencies[np.argmax(seconds.values, axis=1)]
+    assert np.all(peaks[:30] == 100) and np.all(peaks[30:] == 200)
+
+    # nothing recorded after the two segments
+    later = reader.read(START + timedelta(minutes=1), START + timedelta(minutes=2), level=1)
+    assert np.all(np.isnan(later.values.astype(np.float32)))
+
+
+def test_reader_picks_the_finest_level_that_fits(tmp_path):
+    pyramid = SpectrogramPyramid(str(tmp_path), nfft=256, levels=(1, 60, 600))
+    pyramid.write(tone(10, 100), SAMPLE_RATE, START)
+
+    reader = SpectrogramReader(str(tmp_path))
+    assert reader.read(START, START + timedelta(hours=1), max_bins=5000).level == 1
+    assert reader.read(START, START + timedelta(days=1), max_bins=5000).level == 60
+    assert reader.read(START, START + timedelta(days=30), max_bins=5000).level == 600
+    with pytest.raises(AssertionError):
+        reader.read(START, START + timedelta(hours=1), level=10)
+
+
+def test_settings_are_kept_by_the_first_write(tmp_path):
+    SpectrogramPyramid(str(tmp_path), nfft=256, levels=(1, 60)).write(tone(2, 100), SAMPLE_RATE, START)
+
+    # a later instance uses the stored settings
+    pyramid = SpectrogramPyramid(str(tmp_path), nfft=1024, levels=(600,))
+    assert pyramid.meta['nfft'] == 256 and pyramid.meta['levels'] == [1, 60]
+    with pytest.raises(ValueError):
+        pyramid.write(tone(2, 100), 2 * SAMPLE_RATE, START)
@@ -0,0 +1,110 @@
+"""
+test_supervisor.py
+
+A station that fails outside its poll must not take the supervisor down.
+"""
+
+
+import asyncio
+import collections
+import glob
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+from hydrophone_streamer.registry import register_network
+from hydrophone_streamer.supervisor import AsyncSupervisor, Supervisor
+from hydrophone_streamer.supported_classes.base_streaming_class import BaseStreamingClass
+
+
+POLLS = collections.Counter()
+
+
+class FullDiskStation(BaseStreamingClass):
+    network = 'full_disk_test'
+
+    def _file_time(self, filename: str) -> datetime:
+        return datetime.now(timezone.utc)
+
+    def download_data(self) -> list:
+        POLLS[self.station] += 1
+        return []
+
+    def latest_file(self) -> None:
+        pass
+
+    def next_poll_delay(self, n_fetched: int, error: bool = False) -> float:
+        if self.hydrophone_identifier.get('full_disk', False):
+            # schedule.json cannot be written
+            raise OSError(28, 'No space left on device')
+        return 0.05
+
+
+def specs(tmp_path) -> list:
+    register_network('full_disk_test', FullDiskStation)
+    return [{'hydrophone_network': 'full_disk_test', 'stream_setting': {'full_disk': True}, 'save_dir': str(tmp_path / 'full')},
+            {'hydrophone_network': 'full_disk_test', 'stream_setting': {}, 'save_dir': str(tmp_path / 'healthy')}]
+
+
+def test_failing_poll_delay_is_a_station_failure(tmp_path):
+    POLLS.clear()
+    supervisor = Supervisor(specs(tmp_path), restart_delay=0.1)
+    full, healthy = supervisor.stations
+
+    # returned to the scheduling loop instead of raised out of it
+    assert [supervisor._poll(full) for _ in range(3)] == [0.1, 0.2, 0.4]
+    assert full.failures == 3
+    assert full.instance is None
+    assert supervisor._poll(healthy) == 0.05
+    assert POLLS == {'full': 3, 'healthy': 1}
+
+
+def test_failing_poll_delay_is_a_station_failure_async(tmp_path):
+    POLLS.clear()
+    supervisor = AsyncSupervisor(specs(tmp_path), restart_delay=0.1)
+
+    async def run() -> None:
+        await asyncio.wait_for(supervisor.run_async(), timeout=1)
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(run())
+    assert POLLS['healthy'] >= 5
+    assert POLLS['full'] >= 2
+
+
+def test_asynchronous_network_runs_on_the_event_loop_by_default(tmp_path):
+    from hydrophone_streamer.supervisor import load_stations, supervisor_class
+    from hydrophone_streamer.supported_classes.ooi_streaming_class import AsyncOOIStreamingClass
+    from standins import OOIServer
+
+    with OOIServer(n_segments=3) as server:
+        server.release(3)
+
+        class LocalAsyncOOIStreamingClass(AsyncOOIStreamingClass):
+            url_prefixes = (server.url,)
+
+        register_network('ooi_async_test', LocalAsyncOOIStreamingClass)
+        # no use_asyncio in the file
+        config_file = tmp_path / 'stations.json'
+        config_file.write_text(json.dumps({'stations': [{'hydrophone_network': 'ooi_async_test', 'stream_setting': {'url': server.url},
+                                                         'save_dir': str(tmp_path / 'ooi_async')}]}))
+        stations = load_stations(str(config_file))['stations']
+
+        with pytest.raises(ValueError):
+            Supervisor(stations).run()
+
+        supervisor = supervisor_class(stations)(stations)
+        assert isinstance(supervisor, AsyncSupervisor)
+
+        async def run() -> None:
+            from hydrophone_streamer.aio import close_client_session
+            try:
+                await asyncio.wait_for(supervisor.run_async(), timeout=3)
+            finally:
+                await close_client_session()
+
+        with pytest.raises(asyncio.TimeoutError):
+            asyncio.run(run())
+        assert len(glob.glob(str(tmp_path / 'ooi_async' / '*.flac'))) == 3
+        assert supervisor.stations[0].failures == 0
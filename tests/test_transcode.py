@@ -0,0 +1,135 @@
+"""
+test_transcode.py
+
+miniSEED -> FLAC, whole and record by record.
+"""
+
+
+import io
+import random
+from datetime import datetime, timezone
+
+import numpy as np
+import obspy
+import pytest
+import soundfile as sf
+
+from hydrophone_streamer.transcode import UnsortedRecords, encode_flac, mseed_record_length, mseed_to_flac, read_flac, stream_mseed_to_flac
+from standins import synthetic_samples
+
+
+RECORD_LENGTH = 512
+
+
+def mseed_bytes(samples: np.ndarray, sample_rate: float = 1000, reclen: int = RECORD_LENGTH, byteorder: str = '>') -> bytes:
+    trace = obspy.Trace(data=samples, header={'network': 'OO', 'station': 'TEST', 'channel': 'YDH', 'sampling_rate': sample_rate,
+                                              'starttime': obspy.UTCDateTime(2025, 5, 24)})
+    buffer = io.BytesIO()
+    obspy.Stream([trace]).write(buffer, format='MSEED', reclen=reclen, encoding='STEIM2', byteorder=byteorder)
+    return buffer.getvalue()
+
+
+def write_mseed(path: str, samples: np.ndarray, sample_rate: float = 1000, shuffle: bool = False) -> None:
+    data = mseed_bytes(samples, sample_rate)
+    records = [data[i:i + RECORD_LENGTH] for i in range(0, len(data), RECORD_LENGTH)]
+    if shuffle:
+        random.Random(0).shuffle(records)
+    with open(path, 'wb') as f:
+        f.write(b''.join(records))
+
+
+def test_flac_keeps_the_top_24_bits(tmp_path):
+    samples = synthetic_samples(1000, 5, seed=0)
+    buffer = io.BytesIO()
+    assert encode_flac(samples, 1000, buffer, block_size=1000) == len(samples)
+
+    buffer.seek(0)
+    assert sf.info(buffer).subtype == 'PCM_24'
+    buffer.seek(0)
+    np.testing.assert_array_equal(sf.read(buffer, dtype='int32')[0], samples & ~0xff)
+
+    # 16 bit data is stored as is
+    buffer = io.BytesIO()
+    encode_flac((samples // 256).astype(np.int16), 1000, buffer)
+    buffer.seek(0)
+    np.testing.assert_array_equal(sf.read(buffer, dtype='int16')[0], (samples // 256).astype(np.int16))
+
+
+def test_mseed_round_trip(tmp_path):
+    samples = synthetic_samples(1000, 50, seed=1)
+    write_mseed(str(tmp_path / 'segment.mseed'), samples)
+
+    segment = mseed_to_flac(str(tmp_path / 'segment.mseed'), keep_samples=True)
+
+    assert segment.path == str(tmp_path / 'segment.flac')
+    assert segment.start_time == datetime(2025, 5, 24, tzinfo=timezone.utc)
+    assert segment.sample_rate == 1000 and segment.n_samples == len(samples) and segment.duration == 50
+    assert segment.gaps == []
+    np.testing.assert_array_equal(segment.samples, samples)
+    assert not (tmp_path / 'segment.mseed').exists()
+    assert not (tmp_path / 'segment.flac.part').exists()
+    decoded, sample_rate = read_flac(segment.path)
+    assert sample_rate == 1000
+    np.testing.assert_allclose(decoded, (samples & ~0xff) / 2 ** 31)
+
+    # an existing FLAC is left alone, like ffmpeg -n
+    write_mseed(str(tmp_path / 'segment.mseed'), samples[::-1].copy())
+    assert mseed_to_flac(str(tmp_path / 'segment.mseed')) is None
+    np.testing.assert_allclose(read_flac(segment.path)[0], decoded)
+
+
+def test_unsorted_records_are_decoded_whole(tmp_path):
+    samples = synthetic_samples(1000, 50, seed=0)
+    write_mseed(str(tmp_path / 'shuffled.mseed'), samples, shuffle=True)
+
+    with open(tmp_path / 'shuffled.mseed', 'rb') as f:
+        chunks = [f.read(RECORD_LENGTH) for _ in range(200)]
+    with pytest.raises(UnsortedRecords):
+        stream_mseed_to_flac(chunks, str(tmp_path / 'streamed.flac'), batch_bytes=4 * RECORD_LENGTH)
+    assert not (tmp_path / 'streamed.flac').exists()
+
+    whole = mseed_to_flac(str(tmp_path / 'shuffled.mseed'), str(tmp_path / 'whole.flac'), remove_source=False)
+    streamed = mseed_to_flac(str(tmp_path / 'shuffled.mseed'), str(tmp_path / 'streamed.flac'), streaming=True)
+
+    assert streamed.n_samples == whole.n_samples == len(samples)
+    assert streamed.start_time == whole.start_time
+    np.testing.assert_array_equal(sf.read(str(tmp_path / 'streamed.flac'), dtype='int32')[0],
+                                  sf.read(str(tmp_path / 'whole.flac'), dtype='int32')[0])
+    assert not (tmp_path / 'shuffled.mseed').exists()
+
+
+@pytest.mark.parametrize('reclen, byteorder', [(512, '>'), (4096, '>'), (512, '<')])
+def test_record_length_from_the_header(reclen, byteorder):
+    data = mseed_bytes(synthetic_samples(1000, 10, seed=0), reclen=reclen, byteorder=byteorder)
+    assert mseed_record_length(data) == reclen
+    assert mseed_record_length(data[reclen:]) == reclen
+    # more bytes are needed to tell
+    assert mseed_record_length(data[:40]) is None
+
+    with pytest.raises(ValueError):
+        mseed_record_length(b'<html><body>Not Found</body></html>' + bytes(100))
+
+
+def test_streaming_matches_the_whole_file(tmp_path):
+    samples = synthetic_samples(1000, 60, seed=3)
+    data = mseed_bytes(samples)
+
+    # pieces that do not line up with the records, several records per batch
+    chunks = [data[i:i + 777] for i in range(0, len(data), 777)]
+    streamed = stream_mseed_to_flac(chunks, str(tmp_path / 'streamed.flac'), batch_bytes=8 * RECORD_LENGTH, keep_samples=True)
+    with open(tmp_path / 'segment.mseed', 'wb') as f:
+        f.write(data)
+    whole = mseed_to_flac(str(tmp_path / 'segment.mseed'), str(tmp_path / 'whole.flac'), keep_samples=True)
+
+    assert (streamed.start_time, streamed.sample_rate, streamed.n_samples) == (whole.start_time, whole.sample_rate, whole.n_samples)
+    assert streamed.gaps == whole.gaps == []
+    np.testing.assert_array_equal(streamed.samples, whole.samples)
+    with open(tmp_path / 'streamed.flac', 'rb') as a, open(tmp_path / 'whole.flac', 'rb') as b:
+        assert sf.read(a, dtype='int32')[0].tobytes() == sf.read(b, dtype='int32')[0].tobytes()
+
+
+def test_truncated_stream_leaves_nothing_behind(tmp_path):
+    data = mseed_bytes(synthetic_samples(1000, 10, seed=0))
+    with pytest.raises(ValueError):
+        stream_mseed_to_flac([data[:-100]], str(tmp_path / 'segment.flac'), batch_bytes=4 * RECORD_LENGTH)
+    assert list(tmp_path.iterdir()) == []